@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Client of the starwatts daemon (see starwatts.daemon). Only uses the standard library, so that the scripts asking the
+daemon start in milliseconds : boto, paramiko and the starwatts package are only imported when falling back on the
+direct mode.
+
+The requests and the replies are single lines of JSON : {"command": ..., "args": {...}} and {"result": ...} or
+{"error": ...}.
+"""
+
+import os
+import json
+import struct
+import socket
+import logging
+
+# Seconds call() waits for a reply before falling back on the direct mode
+CALL_TIMEOUT = 5.0
+
+
+def default_socket():
+    """
+    :return: $STARWATTS_SOCKET, or starwatts.sock in $XDG_RUNTIME_DIR, or in ~/.starwatts (created with mode 0700 by the
+        daemon) : directories the other users can't write in.
+    :rtype: string
+    """
+    if os.environ.get('STARWATTS_SOCKET'):
+        return os.environ['STARWATTS_SOCKET']
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.starwatts')
+    return os.path.join(directory, 'starwatts.sock')
+
+
+DEFAULT_SOCKET = default_socket()
+
+
+def peer_uid(sock, path):
+    """
+    :param socket.socket sock: A socket connected to the daemon.
+    :param string path: Path of the socket.
+
+    :return: The uid of the process listening on the socket (SO_PEERCRED), or of the owner of the socket where the
+        option isn't available.
+    :rtype: int
+    """
+    if hasattr(socket, 'SO_PEERCRED'):
+        # struct ucred : pid, uid, gid
+        return struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))[1]
+    return os.stat(path).st_uid
+
+
+def request(command, path=None, timeout=None, **args):
+    """
+    Sends a command to the daemon.
+
+    :param string command: The command, see starwatts.daemon.Daemon.
+    :param string path: Path of the socket of the daemon. Default : None (DEFAULT_SOCKET, see default_socket()).
+    :param float timeout: Number of seconds to wait for the reply. Default : None.
+    :param args: Arguments of the command.
+
+    :return: The result of the command.
+    :raises ConnectionError: If no daemon listens on the socket.
+    :raises PermissionError: If the daemon runs as another user : nothing is sent to it.
+    :raises RuntimeError: If the command failed in the daemon.
+    """
+    path = path or DEFAULT_SOCKET
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        sock.close()
+        raise ConnectionError("No starwatts daemon on {} ({})".format(path, e))
+    # Replies such as ssh_config end up in files run by ssh, they are only trusted from our own daemon
+    uid = peer_uid(sock, path)
+    if uid != os.getuid():
+        sock.close()
+        raise PermissionError("The starwatts daemon on {} runs as uid {}, not as the current user".format(path, uid))
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps({'command': command, 'args': args}).encode('utf-8') + b'\n')
+        f.flush()
+        line = f.readline()
+    if not line:
+        raise ConnectionError("The starwatts daemon on {} closed the connection".format(path))
+    reply = json.loads(line.decode('utf-8'))
+    if 'error' in reply:
+        raise RuntimeError(reply['error'])
+    return reply['result']
+
+
+def serves(conf, path=None, timeout=None):
+    """
+    :param string conf: Path of a configuration file.
+    :param string path: Path of the socket of the daemon. Default : None.
+    :param float timeout: Number of seconds to wait for the reply. Default : None.
+
+    :return: Whether the daemon was started with this configuration file.
+    :rtype: bool
+    :raises ConnectionError: If no daemon listens on the socket.
+    """
+    return request('ping', path, timeout)['conf'] == os.path.realpath(conf)
+
+
+def call(command, direct, path=None, conf=None, timeout=CALL_TIMEOUT, **args):
+    """
+    Sends a command to the daemon, or calls direct() if no daemon is running, if it serves another configuration, runs
+    as another user or doesn't answer in time.
+
+    :param string command: The command.
+    :param callable direct: Computes the result without the daemon.
+    :param string path: Path of the socket of the daemon. Default : None.
+    :param string conf: Configuration file direct() uses. Default : None (any daemon is used).
+    :param float timeout: Number of seconds to wait for each reply of the daemon. Default : 5.
+    :param args: Arguments of the command.
+
+    :return: The result of the command.
+    """
+    try:
+        if conf is not None and not serves(conf, path, timeout):
+            return direct()
+        return request(command, path, timeout, **args)
+    except OSError as e:
+        # ConnectionError, PermissionError and socket.timeout included
+        if not isinstance(e, ConnectionError):
+            logging.warning("Not using the starwatts daemon : {}".format(e))
+        return direct()
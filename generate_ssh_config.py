@@ -2,15 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import click
-from starwatts import StarWatts
+from daemon_client import call
+
+
+def direct(local):
+    from starwatts import StarWatts
+    s = StarWatts('conf.yml')
+    return s.generate_ssh_config(local=local)
 
 
 @click.command()
 @click.argument('output', type=click.File('w'))
 @click.option('--local', is_flag=True)
 def cli(output, local):
-    s = StarWatts('conf.yml')
-    output.write(s.generate_ssh_config(local=local))
+    output.write(call('ssh_config', lambda: direct(local), conf='conf.yml', local=local))
     output.flush()
 
 if __name__ == '__main__':
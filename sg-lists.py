@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
-from starwatts import StarWatts
+from daemon_client import call
 
 
-def main():
+def direct():
+    from starwatts import StarWatts
     s = StarWatts('conf.yml')
     c = s.get_connection()
     sg_dc = dict()
@@ -13,12 +14,15 @@ def main():
                 sg_dc[i.id].append(sg.name)
             else:
                 sg_dc[i.id] = [sg.name, ]
+    return [(inst.tags.get('name', 'No Name'), inst.id, sg_dc.get(inst.id, [])) for inst in c.get_only_instances()]
+
 
-    for inst in c.get_only_instances():
+def main():
+    for name, instance_id, sgs in call('security_groups', direct, conf='conf.yml'):
         print("{name:20}{id}\t{sg}".format(
-            name=inst.tags.get('name', 'No Name'),
-            id=inst.id,
-            sg=", ".join(sg_dc.get(inst.id, [])),
+            name=name,
+            id=instance_id,
+            sg=", ".join(sgs),
         ))
 
 if __name__ == '__main__':
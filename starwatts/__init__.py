@@ -10,6 +10,26 @@ from boto.ec2.snapshot import Snapshot
 # General Outscale import
 from .starwatts import StarWatts
 from .cloud_app import CloudApp
+from .transfer import TransferEngine, TransferStats
+from .dedup import DeltaTransfer
+from .fanout import distribute
+from .catalog import ImageCatalog, invalidating
+from .pool import WarmPool
+from .script import RemoteScript, render_user_data
+from .session import ShellSession
+from .job import Job, poll_jobs
+from .collect import ResultCollector, collect_fleet
+from .scheduler import BinPackingScheduler, JobRequest, instance_launcher
+from .autoscale import Autoscaler, JobQueue, SimulatedClock
+from .instrument import ApiInstrumentation, instrument
+from .throttle import RateLimiter
+from .connections import ConnectionPool
+from .coalesce import SingleFlight
+from .records import InstanceRecord, VolumeRecord, SecurityGroupRecord
+from .columnar import ColumnarInventory
+from .query import Query
+from .batch import batching, listing
+from .daemon import Daemon
 
 # Instances related imports
 from .meta.instance import get_all_attached_volumes, lower_tags
@@ -18,7 +38,8 @@ from .meta.instance import instance_set_private, stop_and_wait, terminate_and_cl
 
 # Connection related imports
 from .meta.connection import security_group_exists, keypair_exists
-from .meta.connection import connection_set_private, get_instances_by_tags, quick_instance
+from .meta.connection import connection_set_private, get_instances_by_tags, quick_instance, get_image_catalog
+from .meta.connection import get_instances_by_query
 
 # Volume related imports
 from .meta.volume import get_attached_instance, increase_size
@@ -48,4 +69,14 @@ setattr(EC2Connection, 'security_group_exists', security_group_exists)
 setattr(EC2Connection, 'keypair_exists', keypair_exists)
 setattr(EC2Connection, 'set_private', connection_set_private)
 setattr(EC2Connection, 'get_instances_by_tags', get_instances_by_tags)
+setattr(EC2Connection, 'get_instances_by_query', get_instances_by_query)
+setattr(EC2Connection, 'batching', batching)
+for method in ('get_only_instances', 'get_all_volumes'):
+    if not getattr(getattr(EC2Connection, method), 'enqueues_in_batch', False):
+        setattr(EC2Connection, method, listing(getattr(EC2Connection, method)))
 setattr(EC2Connection, 'quick_instance', quick_instance)
+setattr(EC2Connection, 'get_image_catalog', get_image_catalog)
+
+for method in ('register_image', 'create_image', 'deregister_image', 'copy_image'):
+    if not getattr(getattr(EC2Connection, method), 'invalidates_catalog', False):
+        setattr(EC2Connection, method, invalidating(getattr(EC2Connection, method)))
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+Sizes a fleet of worker nodes according to a local job queue.
+"""
+
+import math
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from boto.exception import EC2ResponseError
+
+QueuedJob = namedtuple('QueuedJob', ['id', 'name', 'payload', 'enqueued_at'])
+
+Decision = namedtuple('Decision', ['queued', 'running', 'nodes', 'desired', 'launched', 'terminated'])
+
+
+class SimulatedClock:
+    """
+    A clock that only moves when slept on, to run the autoscaler in tests and simulations.
+
+    :param float start: Initial time. Default : 0.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class JobQueue:
+    """
+    A job queue stored in a SQLite database, so that it can be shared by several processes through a file.
+
+    :param string path: Path of the database. Default : ':memory:'.
+    :param callable clock: Returns the current time. Default : time.time.
+    """
+
+    def __init__(self, path=':memory:', clock=time.time):
+        self.clock = clock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, payload TEXT, "
+                "state TEXT, worker TEXT, enqueued_at REAL, started_at REAL, finished_at REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    def put(self, name, payload=''):
+        """
+        Adds a job at the end of the queue.
+
+        :param string name: Name of the job.
+        :param string payload: Data of the job (e.g : a command). Default : ''.
+
+        :return: The id of the job.
+        :rtype: int
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute("INSERT INTO jobs (name, payload, state, enqueued_at) VALUES (?, ?, 'queued', ?)",
+                                      (name, payload, self.clock()))
+            return cursor.lastrowid
+
+    def claim(self, worker):
+        """
+        Takes the oldest queued job for a worker. A job is only given to one worker, even when several processes
+        share the database.
+
+        :param string worker: Name of the worker.
+
+        :return: The job, or None if the queue is empty.
+        :rtype: QueuedJob
+        """
+        with self._lock:
+            while True:
+                with self._db:
+                    row = self._db.execute("SELECT id, name, payload, enqueued_at FROM jobs WHERE state = 'queued' "
+                                           "ORDER BY id LIMIT 1").fetchone()
+                    if row is None:
+                        return None
+                    # Another connection to the file may have claimed the job since the SELECT
+                    if self._db.execute("UPDATE jobs SET state = 'running', worker = ?, started_at = ? "
+                                        "WHERE id = ? AND state = 'queued'",
+                                        (worker, self.clock(), row[0])).rowcount == 1:
+                        return QueuedJob(*row)
+
+    def complete(self, job_id):
+        """
+        Marks a job as finished.
+
+        :param int job_id: The id of the job.
+        """
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET state = 'done', finished_at = ? WHERE id = ?", (self.clock(), job_id))
+
+    def requeue(self, worker):
+        """
+        Puts back in the queue the jobs a worker was running, e.g : when its node is lost.
+
+        :param string worker: Name of the worker.
+
+        :return: The number of requeued jobs.
+        :rtype: int
+        """
+        with self._lock, self._db:
+            return self._db.execute("UPDATE jobs SET state = 'queued', worker = NULL, started_at = NULL "
+                                    "WHERE state = 'running' AND worker = ?", (worker,)).rowcount
+
+    def counts(self):
+        """
+        Number of queued and running jobs.
+
+        :return: A (queued, running) tuple.
+        :rtype: tuple
+        """
+        with self._lock:
+            rows = dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return rows.get('queued', 0), rows.get('running', 0)
+
+    def running(self, worker):
+        """
+        Number of jobs a worker is running.
+
+        :param string worker: Name of the worker.
+
+        :rtype: int
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'running' AND worker = ?",
+                                    (worker,)).fetchone()[0]
+
+    def oldest_wait(self):
+        """
+        Number of seconds the oldest queued job has been waiting.
+
+        :return: The age of the oldest job, 0 if the queue is empty.
+        :rtype: float
+        """
+        with self._lock:
+            oldest = self._db.execute("SELECT MIN(enqueued_at) FROM jobs WHERE state = 'queued'").fetchone()[0]
+        return 0.0 if oldest is None else self.clock() - oldest
+
+    def mean_duration(self, last=50):
+        """
+        Mean duration of the last finished jobs.
+
+        :param int last: Number of jobs taken into account. Default : 50.
+
+        :return: The mean duration in seconds, None if no job finished yet.
+        :rtype: float
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT finished_at - started_at FROM jobs WHERE state = 'done' "
+                                    "ORDER BY finished_at DESC LIMIT ?", (last,)).fetchall()
+        return sum(r[0] for r in rows) / len(rows) if rows else None
+
+    def mean_wait(self):
+        """
+        Mean number of seconds the started jobs waited in the queue.
+
+        :rtype: float
+        """
+        with self._lock:
+            value = self._db.execute("SELECT AVG(started_at - enqueued_at) FROM jobs "
+                                     "WHERE started_at IS NOT NULL").fetchone()[0]
+        return value or 0.0
+
+
+class Autoscaler:
+    """
+    Launches and terminates worker nodes so that the jobs of a queue don't wait longer than a target latency. At each
+    step, the number of nodes needed is estimated from the jobs running and from the queued jobs a node can start within
+    the target latency, given the mean duration of the jobs. Nodes are launched concurrently, and only idle nodes are
+    terminated. Separate cooldowns prevent scaling again before the previous decision had an effect.
+
+    The queued jobs are handed to the nodes with free slots by the runner, called as ``runner(name, instance, job)``.
+    It must start the job and call queue.complete(job.id) once it finished.
+
+    :param JobQueue queue: The job queue.
+    :param callable launcher: Launches a node, called as ``launcher(instance_type, name)``, returns the instance or
+        None. See starwatts.scheduler.instance_launcher.
+    :param callable runner: Starts a job on a node. Default : None (the nodes claim their jobs
+        themselves, see JobQueue.claim).
+    :param callable terminator: Terminates a node, called with its instance. Default : terminate_and_clean without
+        confirmation.
+    :param string instance_type: Type of the nodes. Default : 'm1.xlarge'.
+    :param float target_latency: Number of seconds a job should wait in the queue at most. Default : 300.
+    :param float job_seconds: Estimated duration of a job until some jobs finished. Default : 600.
+    :param int jobs_per_node: Number of jobs a node runs at the same time. Default : 1.
+    :param int min_nodes: Minimum number of nodes. Default : 0.
+    :param int max_nodes: Maximum number of nodes. Default : 10.
+    :param float scale_up_cooldown: Number of seconds between two scale ups. Default : 60.
+    :param float scale_down_cooldown: Number of seconds between a scaling and a scale down. Default : 300.
+    :param callable clock: Returns the current time. Default : time.time.
+    :param int workers: Number of nodes launched or terminated at the same time. Default : 8.
+    """
+
+    def __init__(self, queue, launcher, runner=None, terminator=None, instance_type='m1.xlarge', target_latency=300,
+                 job_seconds=600, jobs_per_node=1, min_nodes=0, max_nodes=10, scale_up_cooldown=60,
+                 scale_down_cooldown=300, clock=time.time, workers=8):
+        self.queue = queue
+        self.launcher = launcher
+        self.runner = runner
+        self.terminator = terminator if terminator is not None else lambda inst: inst.terminate_and_clean(confirm=False)
+        self.instance_type = instance_type
+        self.target_latency = target_latency
+        self.job_seconds = job_seconds
+        self.jobs_per_node = jobs_per_node
+        self.min_nodes = min_nodes
+        self.max_nodes = max_nodes
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.clock = clock
+        self.nodes = dict()
+        self.launched = 0
+        self.terminated = 0
+        self.node_seconds = 0.0
+        self._launching = list()
+        self._last_up = None
+        self._last_change = None
+        self._last_step = None
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def desired(self, queued, running):
+        """
+        Number of nodes needed for the current load.
+
+        :param int queued: Number of queued jobs.
+        :param int running: Number of running jobs.
+
+        :rtype: int
+        """
+        duration = self.queue.mean_duration() or self.job_seconds
+        # Jobs a node starts within the target latency
+        per_node = self.jobs_per_node * max(1.0, self.target_latency / duration)
+        needed = math.ceil(running / self.jobs_per_node + queued / per_node)
+        if queued and self.queue.oldest_wait() > self.target_latency:
+            needed = max(needed, len(self.nodes) + len(self._launching) + 1)
+        return min(self.max_nodes, max(self.min_nodes, needed))
+
+    def _launch(self, name):
+        try:
+            return name, self.launcher(self.instance_type, name)
+        except (EC2ResponseError, RuntimeError, TimeoutError) as e:
+            logging.error("Could not launch {} : {}".format(name, e))
+            return name, None
+
+    def _collect_launches(self):
+        still = list()
+        for future in self._launching:
+            if not future.done():
+                still.append(future)
+                continue
+            name, instance = future.result()
+            if instance is not None:
+                self.nodes[name] = instance
+                self.launched += 1
+        self._launching = still
+
+    def wait_launches(self):
+        """
+        Waits for the nodes being launched, e.g : to run a simulation step by step.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: Autoscaler
+        """
+        for future in self._launching:
+            future.result()
+        self._collect_launches()
+        return self
+
+    def scale_up(self, count):
+        """
+        Launches nodes in the background. They take part in the dispatch once launched.
+
+        :param int count: Number of nodes to launch.
+        """
+        for _ in range(count):
+            name = "worker-{}".format(uuid.uuid4().hex[:8])
+            self._launching.append(self._executor.submit(self._launch, name))
+        self._last_up = self._last_change = self.clock()
+
+    def scale_down(self, count):
+        """
+        Terminates idle nodes.
+
+        :param int count: Maximum number of nodes to terminate.
+
+        :return: The number of terminated nodes.
+        :rtype: int
+        """
+        idle = [name for name in self.nodes if self.queue.running(name) == 0][:count]
+        instances = [self.nodes.pop(name) for name in idle]
+        for name, result in zip(idle, self._executor.map(self._terminate, instances)):
+            if not result:
+                logging.error("Could not terminate {}.".format(name))
+        if idle:
+            self.terminated += len(idle)
+            self._last_change = self.clock()
+        return len(idle)
+
+    def _terminate(self, instance):
+        try:
+            self.terminator(instance)
+            return True
+        except (EC2ResponseError, RuntimeError, TimeoutError) as e:
+            logging.error("Could not terminate {} : {}".format(instance, e))
+            return False
+
+    def dispatch(self):
+        """
+        Hands the queued jobs to the nodes with free slots through the runner.
+
+        :return: The number of started jobs.
+        :rtype: int
+        """
+        if self.runner is None:
+            return 0
+        started = 0
+        for name, instance in list(self.nodes.items()):
+            for _ in range(self.jobs_per_node - self.queue.running(name)):
+                job = self.queue.claim(name)
+                if job is None:
+                    return started
+                self.runner(name, instance, job)
+                started += 1
+        return started
+
+    def step(self):
+        """
+        Makes a single decision : collects the launched nodes, scales up or down, then dispatches the queued jobs.
+
+        :rtype: Decision
+        """
+        now = self.clock()
+        if self._last_step is not None:
+            self.node_seconds += (now - self._last_step) * len(self.nodes)
+        self._last_step = now
+        self._collect_launches()
+        self.dispatch()
+        queued, running = self.queue.counts()
+        current = len(self.nodes) + len(self._launching)
+        desired = self.desired(queued, running)
+        launched = terminated = 0
+        if desired > current and (self._last_up is None or now - self._last_up >= self.scale_up_cooldown):
+            launched = desired - current
+            self.scale_up(launched)
+        elif desired < current and not self._launching and \
+                (self._last_change is None or now - self._last_change >= self.scale_down_cooldown):
+            terminated = self.scale_down(current - desired)
+        return Decision(queued, running, len(self.nodes), desired, launched, terminated)
+
+    def run(self, interval=30, steps=None, sleep=time.sleep):
+        """
+        Calls step() periodically.
+
+        :param float interval: Number of seconds between two steps. Default : 30.
+        :param int steps: Number of steps, None to run forever. Default : None.
+        :param callable sleep: Waits between two steps, e.g : SimulatedClock.sleep. Default : time.sleep.
+
+        :return: The decision of the last step.
+        :rtype: Decision
+        """
+        decision = None
+        count = 0
+        while steps is None or count < steps:
+            decision = self.step()
+            count += 1
+            sleep(interval)
+        return decision
+
+    def shutdown(self):
+        """
+        Terminates every node, idle or not, and stops the background threads. The jobs the nodes were running are put
+        back in the queue.
+        """
+        self.wait_launches()
+        names = list(self.nodes)
+        list(self._executor.map(self._terminate, [self.nodes.pop(name) for name in names]))
+        for name in names:
+            self.queue.requeue(name)
+        self.terminated += len(names)
+        self._executor.shutdown()
+
+    def __str__(self):
+        queued, running = self.queue.counts()
+        return "Autoscaler : {} node(s) ({} launching), {} queued, {} running, {} launched, {} terminated".format(
+            len(self.nodes), len(self._launching), queued, running, self.launched, self.terminated)
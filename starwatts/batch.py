@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Batching of the per-object helpers : inside a batching context, the helpers such as get_all_attached_volumes() or
+get_attached_instance() are resolved together with a single describe call for all the objects known to the context.
+"""
+
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+from boto.ec2.instance import Instance
+from boto.ec2.volume import Volume
+
+from .instrument import register_internal
+from .records import InstanceRecord
+
+register_internal(__name__)
+
+# Values of a filter sent in a single describe call
+MAX_KEYS = 200
+
+
+class _Tick:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class Loader:
+    """
+    Loads values by key, DataLoader style : the keys asked for or enqueued are fetched together, in a single call, and
+    the values are cached. A key asked for while no fetch is planned starts a tick : the keys asked for by the other
+    threads during the tick are fetched with it.
+
+    :param callable fetch: Takes a list of keys and returns a dict of their values.
+    :param callable default: Returns the value of the keys missing from the dict. Default : None.
+    :param float tick: Seconds waited for the keys of the other threads. Default : 0.005.
+    :param int max_keys: Number of keys fetched in a single call. Default : 200.
+    """
+
+    def __init__(self, fetch, default=None, tick=0.005, max_keys=MAX_KEYS):
+        self.fetch = fetch
+        self.default = default
+        self.tick = tick
+        self.max_keys = max_keys
+        self.calls = 0
+        self.loads = 0
+        self.hits = 0
+        self._cache = dict()
+        self._pending = dict()
+        self._in_flight = dict()
+        self._next = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, keys):
+        """
+        Adds keys to the next fetch, without fetching them.
+
+        :param list keys: The keys.
+        """
+        with self._lock:
+            for key in keys:
+                if key is not None and key not in self._cache and key not in self._in_flight:
+                    self._pending[key] = None
+
+    def load(self, key):
+        """
+        :param key: A key.
+
+        :return: Its value, fetched with all the keys pending if it isn't cached.
+        :raises Exception: The exception of the fetch.
+        """
+        with self._lock:
+            self.loads += 1
+            if key in self._cache:
+                self.hits += 1
+                return self._cache[key]
+            tick = self._in_flight.get(key)
+            leader = False
+            if tick is None:
+                self._pending[key] = None
+                if self._next is None:
+                    self._next = _Tick()
+                    leader = True
+                tick = self._next
+        if leader:
+            self._dispatch(tick)
+        else:
+            tick.done.wait()
+        if tick.error is not None:
+            raise tick.error
+        with self._lock:
+            return self._cache[key]
+
+    def _dispatch(self, tick):
+        if self.tick:
+            time.sleep(self.tick)
+        with self._lock:
+            keys = list(self._pending)
+            self._pending.clear()
+            self._next = None
+            for key in keys:
+                self._in_flight[key] = tick
+        try:
+            values = dict()
+            for start in range(0, len(keys), self.max_keys):
+                self.calls += 1
+                values.update(self.fetch(keys[start:start + self.max_keys]))
+            with self._lock:
+                for key in keys:
+                    self._cache[key] = values[key] if key in values else self.default() if self.default else None
+        except Exception as e:
+            tick.error = e
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._in_flight.pop(key, None)
+            tick.done.set()
+
+    def clear(self):
+        """
+        Forgets the cached values.
+        """
+        with self._lock:
+            self._cache.clear()
+
+
+class Batch:
+    """
+    The loaders of the connections sharing a batching context, with their cached values. The describe calls of a tick
+    are made on the connection of the thread that started it, or on the connection the context was entered with.
+
+    :param boto.ec2.EC2Connection connection: The connection the context was entered with.
+    :param float tick: Seconds waited for the keys of the other threads. Default : 0.005.
+    """
+
+    def __init__(self, connection, tick=0.005):
+        self.connection = connection
+        self.volumes = Loader(self._fetch_volumes, list, tick)
+        self.instances = Loader(self._fetch_instances, None, tick)
+        self.groups = Loader(self._fetch_groups, list, tick)
+        self._local = threading.local()
+
+    @contextmanager
+    def _using(self, connection):
+        previous = getattr(self._local, 'connection', None)
+        self._local.connection = connection
+        try:
+            yield
+        finally:
+            self._local.connection = previous
+
+    def _connection(self):
+        return getattr(self._local, 'connection', None) or self.connection
+
+    def _fetch_volumes(self, instance_ids):
+        volumes = {i: list() for i in instance_ids}
+        for v in self._connection().get_all_volumes(filters={'attachment.instance-id': instance_ids}):
+            if v.attach_data.instance_id in volumes:
+                volumes[v.attach_data.instance_id].append(v)
+        return volumes
+
+    def _fetch_instances(self, instance_ids):
+        return {i.id: i for i in self._connection().get_only_instances(filters={'instance-id': instance_ids})}
+
+    def _fetch_groups(self, instance_ids):
+        connection = self._connection()
+        groups = connection.get_all_security_groups()
+        instances = connection.get_only_instances(filters={'instance-id': instance_ids})
+        return {i.id: [sg for sg in groups if sg.id in {g.id for g in i.groups}] for i in instances}
+
+    def add(self, objects):
+        """
+        Enqueues the keys of instances and volumes : the helpers called on any of them will be resolved together.
+
+        :param list objects: Instances (boto ones or InstanceRecord) and volumes.
+        """
+        instance_ids = [o.id for o in objects if isinstance(o, (Instance, InstanceRecord))]
+        self.volumes.enqueue(instance_ids)
+        self.groups.enqueue(instance_ids)
+        self.instances.enqueue([o.attach_data.instance_id for o in objects if isinstance(o, Volume)])
+
+    def attached_volumes(self, instance_id, connection=None):
+        """
+        :param string instance_id: The instance.
+        :param boto.ec2.EC2Connection connection: Connection of the caller. Default : None.
+
+        :return: The volumes attached to an instance.
+        :rtype: list
+        """
+        with self._using(connection):
+            return list(self.volumes.load(instance_id))
+
+    def security_groups(self, instance_id, connection=None):
+        """
+        :param string instance_id: The instance.
+        :param boto.ec2.EC2Connection connection: Connection of the caller. Default : None.
+
+        :return: The security groups of an instance.
+        :rtype: list
+        """
+        with self._using(connection):
+            return list(self.groups.load(instance_id))
+
+    def instance(self, instance_id, connection=None):
+        """
+        :param string instance_id: The instance.
+        :param boto.ec2.EC2Connection connection: Connection of the caller. Default : None.
+
+        :return: An instance, None if it doesn't exist.
+        :rtype: boto.ec2.instance.Instance
+        """
+        with self._using(connection):
+            return self.instances.load(instance_id)
+
+    def clear(self):
+        """
+        Forgets the cached values, after changes made inside the context.
+        """
+        for loader in (self.volumes, self.instances, self.groups):
+            loader.clear()
+
+    def __str__(self):
+        return "Batch : {}".format(', '.join("{} {} call(s) for {} load(s)".format(name, loader.calls, loader.loads)
+                                             for name, loader in (('volumes', self.volumes),
+                                                                  ('instances', self.instances),
+                                                                  ('groups', self.groups))))
+
+
+class BatchScope:
+    """
+    The batching context shared by a group of connections, e.g : self.conn and the connections of the pool of a
+    StarWatts instance. It is torn down when the last of its nested or concurrent with blocks ends.
+    """
+
+    def __init__(self):
+        self.batch = None
+        self.depth = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def entered(self, connection, objects=(), tick=0.005):
+        """
+        Enters the context, creating its batch if none is active.
+
+        :param boto.ec2.EC2Connection connection: The connection entering it.
+        :param list objects: Instances and volumes whose helpers will be called. Default : ().
+        :param float tick: Seconds waited for the keys of the other threads, for a new batch. Default : 0.005.
+
+        :rtype: Batch
+        """
+        with self._lock:
+            if self.batch is None:
+                self.batch = Batch(connection, tick)
+            self.depth += 1
+            batch = self.batch
+        batch.add(objects)
+        try:
+            yield batch
+        finally:
+            with self._lock:
+                self.depth -= 1
+                if not self.depth:
+                    self.batch = None
+
+
+_scopes_lock = threading.Lock()
+
+
+def batch_scope(connection):
+    """
+    :param boto.ec2.EC2Connection connection: A connection.
+
+    :return: The scope of the batching contexts of the connection, its own one unless it shares one with other
+        connections.
+    :rtype: BatchScope
+    """
+    scope = getattr(connection, 'batch_scope', None)
+    if scope is None:
+        with _scopes_lock:
+            scope = getattr(connection, 'batch_scope', None)
+            if scope is None:
+                scope = connection.batch_scope = BatchScope()
+    return scope
+
+
+def current_batch(connection):
+    """
+    :param boto.ec2.EC2Connection connection: A connection.
+
+    :return: The batch of the batching context active on the connection, or on a connection sharing its scope. None
+        outside of a context.
+    :rtype: Batch
+    """
+    scope = getattr(connection, 'batch_scope', None)
+    return scope.batch if scope is not None else None
+
+
+def listing(method):
+    """
+    Wraps an EC2Connection method listing instances or volumes so that, inside a batching context, the objects it
+    returns are enqueued in the batch.
+
+    :param callable method: The method to wrap.
+
+    :return: The wrapped method.
+    :rtype: callable
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        batch = current_batch(self)
+        if batch is not None:
+            batch.add(result)
+        return result
+    wrapper.enqueues_in_batch = True
+    return wrapper
+
+
+def batching(self, objects=(), tick=0.005):
+    """
+    Batching context of a connection : inside it, get_all_attached_volumes(), get_all_security_groups(),
+    get_all_security_groups_ids(), get_single_security_group() and get_attached_instance() are resolved together, with
+    one describe call per tick for all the instances and volumes given or listed inside the context, and their results
+    are cached until the end of the context.
+
+    The context is shared by the connections of the same scope (see BatchScope), e.g : all the connections of a
+    StarWatts instance, and by the threads using them : the objects listed on any of them are batched together. Nested
+    or concurrent contexts use the batch of the first one, which is torn down when the last one ends.
+
+    Loops calling these helpers object by object make a constant number of calls, without being rewritten :
+    ``with conn.batching(instances): for inst in instances: inst.get_all_attached_volumes()``.
+
+    :param boto.ec2.EC2Connection self: Current connection.
+    :param list objects: Instances and volumes whose helpers will be called. Default : ().
+    :param float tick: Seconds waited for the keys of the other threads. Default : 0.005.
+
+    :return: The batch, whose clear() method forgets the values cached.
+    :rtype: Batch
+    """
+    return batch_scope(self).entered(self, objects, tick)
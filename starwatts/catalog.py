@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the images available on a connection, indexed by name.
+"""
+
+import time
+import fnmatch
+import functools
+import threading
+
+
+class ImageCatalog:
+    """
+    Lists the images of the account once and answers name lookups from memory. The catalog expires after ttl seconds
+    and is invalidated whenever an image is registered, created or deregistered through the connection. Names that
+    aren't in the listing (e.g : images shared by another account) are searched individually and cached as well.
+
+    Lookups running at the same time share a single API call.
+
+    :param boto.ec2.EC2Connection connection: The connection to list the images from.
+    :param int ttl: Number of seconds before the catalog is listed again. Default : 300.
+    :param list owners: Owners of the listed images. Default : ['self'].
+    """
+
+    def __init__(self, connection, ttl=300, owners=None):
+        self.connection = connection
+        self.ttl = ttl
+        self.owners = owners if owners is not None else ['self']
+        self.hits = 0
+        self.misses = 0
+        self._images = None
+        self._extra = dict()
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Forgets everything, the next lookup lists the images again.
+        """
+        self._expires = 0
+
+    def _fresh(self):
+        return self._images is not None and time.time() < self._expires
+
+    def refresh(self):
+        """
+        Lists the images and rebuilds the name index.
+
+        :return: This instance.
+        :rtype: ImageCatalog
+        """
+        index = dict()
+        for img in self.connection.get_all_images(owners=self.owners):
+            index.setdefault(img.name, []).append(img)
+        self._images = index
+        self._extra = dict()
+        self._expires = time.time() + self.ttl
+        return self
+
+    def lookup(self, name):
+        """
+        Finds the images with the given name. Wildcards are supported the same way as in the API filters.
+
+        :param string name: Name of the image (e.g : 'blender-2.72-prod').
+
+        :return: List of boto.ec2.image.Image
+        :rtype: list
+        """
+        if not self._fresh():
+            with self._lock:
+                # Threads that waited on the lock find the catalog refreshed by the first one.
+                if not self._fresh():
+                    self.misses += 1
+                    self.refresh()
+        found = self._match(name)
+        if found:
+            self.hits += 1
+            return found
+        with self._lock:
+            if name not in self._extra:
+                self.misses += 1
+                self._extra[name] = self.connection.get_all_images(filters={'name': name})
+            else:
+                self.hits += 1
+            return list(self._extra[name])
+
+    def _match(self, name):
+        images = self._images
+        if any(c in name for c in '*?'):
+            return [img for key in fnmatch.filter(list(images), name) for img in images[key]]
+        return list(images.get(name, []))
+
+    def __str__(self):
+        return "ImageCatalog : {} name(s), {} hit(s), {} miss(es)".format(
+            len(self._images or {}), self.hits, self.misses
+        )
+
+
+def invalidating(method):
+    """
+    Wraps an EC2Connection method so that it invalidates the image catalog of the connection.
+
+    :param callable method: The method to wrap.
+
+    :return: The wrapped method.
+    :rtype: callable
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            catalog = getattr(self, '_image_catalog', None)
+            if catalog is not None:
+                catalog.invalidate()
+    wrapper.invalidates_catalog = True
+    return wrapper
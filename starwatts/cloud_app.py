@@ -3,9 +3,20 @@
 import os
 import time
 import logging
+import threading
 
 import paramiko
 
+from .collect import ResultCollector
+from .dedup import DeltaTransfer
+from .job import Job, job_paths, start_command
+from .probe import wait_for_ssh
+from .script import RemoteScript
+from .session import ShellSession
+from .sshcache import new_client, private_key, ssh_config
+from .transfer import TransferEngine
+from .tuning import apply_profile, connect_kwargs, format_self_test, get_profile, self_test
+
 
 class CloudApp:
     """
@@ -35,14 +46,21 @@ class CloudApp:
         machine will be fetched using the API using the application, version and environment parameters.
     :param bool debug:
         Set to True in case you want to enable debug logging.
+    :param string profile:
+        Name of the transport profile applied when connecting (one of starwatts.tuning.PROFILES). Use 'bulk' for
+        large transfers on the internal network and 'wan' for slow links. Default : 'default'.
 
     :return: A new CloudApp instance.
     :rtype: CloudApp
     """
     workdir = '/home/starwatts/jobs/'
 
+    # SSH clients to other hosts (e.g : 'files', 'bastion'), shared by all the CloudApps of the process.
+    _source_clients = dict()
+    _source_lock = threading.Lock()
+
     def __init__(self, connection, application, version, environment, project, instance_type='m1.xlarge', user='root',
-                 instance=None, ami=None, debug=False):
+                 instance=None, ami=None, debug=False, profile='default'):
         if debug:
             logging.basicConfig(level=logging.DEBUG)
 
@@ -67,15 +85,20 @@ class CloudApp:
         self.connected = False
         self.errors = list()
         self.ssh_sock = None
-        self.ssh_client = paramiko.SSHClient()
-        self.ssh_client.load_system_host_keys()
-        self.ssh_client._policy = paramiko.WarningPolicy()
-        self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.ssh_client = new_client()
+        self.profile = get_profile(profile)
+        self.engine = None
+        self.shell = None
+
+        # Boot timings
+        self.launched_at = None
+        self.boot_to_ready = None
 
     def fetch_ami(self):
         """
         Fetches the AMI according to the application name, version and environment. Called automatically when creating
-        the machine if no AMI object was supplied when creating this CloudApp.
+        the machine if no AMI object was supplied when creating this CloudApp. The lookup goes through the image catalog
+        of the connection, so CloudApps sharing a connection only list the images once.
 
         :raises ValueError: If no AMI matched.
         :raises ValueError: If multiple AMIs matched.
@@ -83,7 +106,7 @@ class CloudApp:
         :rtype: CloudApp
         """
         ami_filter = '{}-{}-{}'.format(self.application, self.version, self.environment)
-        imgs = self.connection.get_all_images(filters={'name': ami_filter})
+        imgs = self.connection.get_image_catalog().lookup(ami_filter)
         if not imgs:
             raise ValueError("AMI wasn't found for {}.".format(ami_filter))
         if len(imgs) > 1:
@@ -97,31 +120,26 @@ class CloudApp:
         :return:
         """
         files = self.connection.get_only_instances(filters={'tag:name': 'files', 'instance-state-name': 'running'})[0]
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client = new_client()
         client.connect(files.private_ip_address, username='root')
         (stdin, stdout, stderr) = client.exec_command("cat {}/{}/index".format(self.workdir, self.application))
         print(stdout)
         client.close()
 
-    def through(self, host, user='root'):
+    @staticmethod
+    def lookup_host(host, user='root'):
         """
-        Defines a proxy command to rebound on the host.
-        This method is actually unsafe to use and will cause an SSH Banner Error. This library can't work through a
-        proxy
+        Resolves a host through ~/.ssh/config. The file is only parsed again when it changes.
 
         :param string host: Either a valid name stored in ~/.ssh/config or a valid IP address.
-        :param string user: A valid user for the host. Default : 'root'.
+        :param string user: User to use if the configuration doesn't define one. Default : 'root'.
 
-        :return: This instance. Allows to chain methods.
-        :rtype: CloudApp
+        :return: A (user, hostname) tuple.
+        :rtype: tuple
         """
         ssh_conf_file = os.path.expanduser("~/.ssh/config")
         try:
-            ssh_conf = paramiko.SSHConfig()
-            with open(ssh_conf_file) as f:
-                ssh_conf.parse(f)
+            ssh_conf = ssh_config(ssh_conf_file)
             if host in ssh_conf.get_hostnames():
                 host_conf = ssh_conf.lookup(host)
                 user = host_conf.get('user', 'root')
@@ -130,6 +148,21 @@ class CloudApp:
                 print("Could not find host {} in {}. Using raw hostname.".format(host, ssh_conf_file))
         except FileNotFoundError as e:
             print("Could not load {} : {}. Using raw hostname.".format(ssh_conf_file, e))
+        return user, host
+
+    def through(self, host, user='root'):
+        """
+        Defines a proxy command to rebound on the host.
+        This method is actually unsafe to use and will cause an SSH Banner Error. This library can't work through a
+        proxy
+
+        :param string host: Either a valid name stored in ~/.ssh/config or a valid IP address.
+        :param string user: A valid user for the host. Default : 'root'.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: CloudApp
+        """
+        user, host = self.lookup_host(host, user)
 
         # "ssh -W %h:%p {}@{}" doesn't create an entry in the logs. "ssh {}@{} nc %h %p"
         # Actually connects to name (causing an entry in the logs)
@@ -149,26 +182,67 @@ class CloudApp:
         time.sleep(seconds)
         return self
 
-    def connect(self, key_filename=None, use_key=True):
+    def wait_ready(self, bastion=None, bastion_user='root', timeout=300):
         """
-        Connect to the server and keep the connection open.
+        Waits until the SSH daemon of the VM answers, by connecting to it and reading its banner with a short
+        exponential backoff. Use it instead of a fixed wait between create() and connect(). The time elapsed since the
+        launch of the VM is stored in boot_to_ready.
+
+        :param string bastion:
+            Either a valid name stored in ~/.ssh/config or a valid IP address of a host to probe from, when the VM
+            can't be reached directly. Default : None.
+        :param string bastion_user:
+            A valid user for the bastion. Default : 'root'.
+        :param int timeout:
+            Number of seconds before an exception is raised. Default : 300.
+
+        :raises TimeoutError: If the VM didn't answer in time.
+        :return: This instance. Allows to chain methods.
+        :rtype: CloudApp
+        """
+        transport = self.source_client(bastion, bastion_user).get_transport() if bastion is not None else None
+        print("Waiting for SSH on {}... ".format(self.instance.private_ip_address), end='')
+        banner, waited, attempts = wait_for_ssh(self.instance.private_ip_address, timeout=timeout,
+                                                transport=transport)
+        if self.launched_at is not None:
+            self.boot_to_ready = time.time() - self.launched_at
+        print("Done. {} answered after {:.2f}s and {} attempt(s){}.".format(
+            banner, waited, attempts,
+            ", {:.2f}s after launch".format(self.boot_to_ready) if self.boot_to_ready is not None else "",
+        ))
+        return self
+
+    def connect(self, key_filename=None, use_key=True, profile=None):
+        """
+        Connect to the server and keep the connection open. The cipher, compression, window and packet sizes of the
+        transport are set according to the transport profile.
 
         :param string key_filename:
             Path to the correct .pem file. Defaults to ~/.ssh/config/{project_name}.pem
         :param bool use_key:
             Whether or not to use the default key (or the one given as argument). Becomes handy if your public key is
             already in the authorized hosts.
+        :param string profile:
+            Name of the transport profile, replaces the one given to the constructor. Default : None.
 
         :return: This instance. Allows to chain methods.
         :rtype: CloudApp
         """
+        if profile is not None:
+            self.profile = get_profile(profile)
         if not self.connected:
             if key_filename is None and use_key:
                 key_filename = os.path.expanduser("~/.ssh/config/{}.pem".format(self.project))
             if not use_key:
                 key_filename = None
-            self.ssh_client.connect(hostname=self.instance.private_ip_address, username=self.user,
-                                    key_filename=key_filename, sock=self.ssh_sock)
+            pkey = None
+            if key_filename is not None and os.path.isfile(key_filename):
+                # Loaded once for all the CloudApps of the process
+                pkey = private_key(key_filename)
+                key_filename = None
+            self.ssh_client.connect(hostname=self.instance.private_ip_address, username=self.user, pkey=pkey,
+                                    key_filename=key_filename, sock=self.ssh_sock, **connect_kwargs(self.profile))
+            apply_profile(self.ssh_client.get_transport(), self.profile)
             self.connected = True
         return self
 
@@ -180,10 +254,127 @@ class CloudApp:
         :rtype: CloudApp
         """
         if self.connected:
+            if self.engine is not None:
+                self.engine.close()
+                self.engine = None
+            if self.shell is not None:
+                self.shell.close()
+                self.shell = None
             self.ssh_client.close()
             self.connected = False
         return self
 
+    def self_test(self, size=64 * 1024 * 1024):
+        """
+        Measures the throughput of the SSH connection in both directions and prints it.
+
+        :param int size: Number of bytes sent in each direction. Default : 64 MiB.
+
+        :return: The result of starwatts.tuning.self_test() or None if the CloudApp isn't connected.
+        :rtype: dict
+        """
+        if not self.connected:
+            print("Currently not connected to the VM. Run self.connect() first.")
+            return None
+        result = self_test(self.ssh_client, size)
+        print("Self-test ({} profile) : {}".format(self.profile.name, format_self_test(result)))
+        return result
+
+    def transfer_engine(self, workers=4):
+        """
+        Returns the transfer engine bound to the SSH connection of this CloudApp. The engine is created on first use
+        and reuses the already opened transport.
+
+        :param int workers: Number of files transferred at the same time. Default : 4.
+
+        :return: The transfer engine or None if the CloudApp isn't connected.
+        :rtype: starwatts.transfer.TransferEngine
+        """
+        if not self.connected:
+            print("Currently not connected to the VM. Run self.connect() first.")
+            return None
+        if self.engine is None:
+            self.engine = TransferEngine(self.ssh_client.get_transport(), workers=workers)
+        self.engine.workers = workers
+        return self.engine
+
+    @classmethod
+    def source_client(cls, host, user='root'):
+        """
+        Returns a connected SSH client to a host other than the VM, such as the host files are copied from or a bastion.
+        Clients are shared by all the CloudApps of the process so that many nodes only open a single connection to it.
+
+        :param string host: Either a valid name stored in ~/.ssh/config or a valid IP address.
+        :param string user: A valid user for the host. Default : 'root'.
+
+        :return: A connected SSH client.
+        :rtype: paramiko.SSHClient
+        """
+        user, hostname = cls.lookup_host(host, user)
+        with cls._source_lock:
+            client = cls._source_clients.get((user, hostname))
+            transport = client.get_transport() if client is not None else None
+            if transport is None or not transport.is_active():
+                client = new_client()
+                client.connect(hostname, username=user)
+                cls._source_clients[(user, hostname)] = client
+            return client
+
+    def collector(self, remote_dir, local_dir, pattern='*', verify=True, workers=4):
+        """
+        Returns a collector downloading the results a job writes on this host, through the transfer engine of this
+        CloudApp.
+
+        :param string remote_dir: Absolute path of the output directory on the VM.
+        :param string local_dir: Local directory the files are downloaded to.
+        :param string pattern: Only the files matching this pattern are collected. Default : '*'.
+        :param bool verify: Checks the SHA-1 of the downloaded files. Default : True.
+        :param int workers: Number of files downloaded at the same time. Default : 4.
+
+        :raises RuntimeError: If the CloudApp isn't connected.
+        :rtype: starwatts.collect.ResultCollector
+        """
+        if not self.connected:
+            raise RuntimeError("Currently not connected to the VM. Run self.connect() first.")
+        return ResultCollector(self.ssh_client, remote_dir, local_dir, pattern, verify,
+                               engine=self.transfer_engine(workers), workers=workers)
+
+    def collect(self, remote_dir, local_dir, job=None, pattern='*', interval=5.0, verify=True, workers=4):
+        """
+        Downloads the results of a job. With a job, the files are collected while it runs and the method returns once
+        it ended and every file was retrieved. Without one, a single pass downloads every file of the directory.
+
+        :param string remote_dir: Absolute path of the output directory on the VM.
+        :param string local_dir: Local directory the files are downloaded to.
+        :param starwatts.job.Job job: The job writing the results, see run(). Default : None.
+        :param string pattern: Only the files matching this pattern are collected. Default : '*'.
+        :param float interval: Number of seconds between two passes while the job runs. Default : 5.
+        :param bool verify: Checks the SHA-1 of the downloaded files. Default : True.
+        :param int workers: Number of files downloaded at the same time. Default : 4.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: CloudApp
+        """
+        if not self.connected:
+            print("Currently not connected to the VM. Run self.connect() first.")
+            return self
+        collector = self.collector(remote_dir, local_dir, pattern, verify, workers)
+        try:
+            if job is not None:
+                stats = collector.follow(job, interval)
+            else:
+                stats = collector.collect(final=True).stop()
+        finally:
+            collector.close()
+        self._report_transfer(stats)
+        return self
+
+    def _report_transfer(self, stats):
+        print("Transfer : {}".format(stats))
+        for path, exc in stats.errors:
+            self.errors.append("{} : {}".format(path, exc))
+            print("Failed : {} : {}".format(path, exc))
+
     def command(self, command, show_stderr=True, show_stdout=True, timeout=None):
         """
         Runs a command on the remote host.
@@ -217,12 +408,84 @@ class CloudApp:
                 print(line)
         return self
 
-    def create(self, terminate_on_shutdown=True):
+    def session(self):
+        """
+        Returns the persistent shell session of this CloudApp, opened on first use. Commands sent through the session
+        share a single channel and can be pipelined, see starwatts.session.ShellSession.
+
+        :raises RuntimeError: If the CloudApp isn't connected.
+        :return: The shell session.
+        :rtype: starwatts.session.ShellSession
+        """
+        if not self.connected:
+            raise RuntimeError("Currently not connected to the VM. Run self.connect() first.")
+        if self.shell is None or self.shell.channel.closed:
+            self.shell = ShellSession(self.ssh_client)
+        return self.shell
+
+    def commands(self, commands, show_stderr=True, show_stdout=True, timeout=None):
+        """
+        Runs several commands on the remote host through the persistent shell session. All the commands are sent at
+        once and run one after the other, which costs about one round trip instead of one per command.
+
+        :param list commands:
+            Commands to execute.
+        :param bool show_stderr:
+            Show the stderr. Default : True.
+        :param bool show_stdout:
+            Show the stdout. Default : True.
+        :param int timeout:
+            Number of seconds allowed for each command. Default : None.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: CloudApp
+        """
+        if not self.connected:
+            print("Currently not connected to the VM. Run self.connect() first.")
+            return self
+        for result in self.session().run_many(commands, timeout=timeout):
+            print("{} : Exit Status Code : {}".format(result.command, result.status))
+            if show_stdout and result.stdout:
+                print("Stdout :")
+                print(result.stdout)
+            if result.stderr:
+                self.errors.append(result.stderr)
+                if show_stderr:
+                    print("Stderr :")
+                    print(result.stderr)
+        return self
+
+    def execute(self, command, timeout=None):
+        """
+        Runs a command on the remote host and returns its result instead of printing it.
+
+        :param string command:
+            Command to execute.
+        :param int timeout:
+            Defines a timeout, raises an error if the command doesn't complete in the given delay. Default : None.
+
+        :raises RuntimeError: If the CloudApp isn't connected.
+        :return: A (exit status, stdout, stderr) tuple.
+        :rtype: tuple
+        """
+        if not self.connected:
+            raise RuntimeError("Currently not connected to the VM. Run self.connect() first.")
+        (stdin, stdout, stderr) = self.ssh_client.exec_command(command, timeout=timeout)
+        out = stdout.read().decode()
+        err = stderr.read().decode()
+        return stdout.channel.recv_exit_status(), out, err
+
+    def create(self, terminate_on_shutdown=True, pool=None, bootstrap=None):
         """
         Starts the associated VM, with the correct AMI, instance type and tags.
 
         :param bool terminate_on_shutdown:
             Determines whether or not to terminate the VM when it shutdowns or not. Default : True.
+        :param starwatts.pool.WarmPool pool:
+            A warm pool to claim an already launched VM from. A new VM is booted if the pool is empty. Default : None.
+        :param starwatts.script.RemoteScript bootstrap:
+            Steps the VM runs by itself at boot, see bootstrap_script(). Ignored when the VM is claimed from a pool, as
+            it has already booted. Default : None.
 
         :return: This instance. Allows to chain method calls.
         :rtype: CloudApp
@@ -236,14 +499,52 @@ class CloudApp:
         if self.instance is not None:
             print("This CloudApp has already an associated instance.")
             return self
+        self.launched_at = time.time()
+        if pool is not None:
+            self.instance = pool.claim(self.ami.id, self.instance_type, self.instance_name, tags={
+                'env': self.environment, 'os': 'debian', 'zone': 'starwatts', 'privacy': 'true',
+            })
+            if self.instance is not None:
+                print("Claimed {} from the warm pool.".format(self.instance))
+                return self
         self.instance = self.connection.quick_instance(
             name=self.instance_name, image=self.ami.id, instance_type=self.instance_type,
             env_tag=self.environment, os_tag='debian', zone_tag='starwatts', sg_id='sg-9b5adf25',
-            terminate_on_shutdown=terminate_on_shutdown,
+            terminate_on_shutdown=terminate_on_shutdown, user_data_script=bootstrap,
         )
         self.instance.wait_for('running')
         return self
 
+    def bootstrap_script(self, src_vm='files', src_user='root', src_path=None, dest=workdir):
+        """
+        Steps that set up the VM, fetch the job script and run it, meant to be run by the VM itself at boot through
+        create(bootstrap=...). Equivalent to setup().copy(src_vm, ...).run() without any SSH connection.
+
+        :param string src_vm: IP or name of the remote VM on which the job script is fetched. Default : 'files'.
+        :param string src_user: Remote VM user. Default : 'root'.
+        :param string src_path: Path of the job script on the remote VM. Default : see copy().
+        :param string dest: Destination directory of the job script. Default : workdir.
+
+        :return: The bootstrap steps.
+        :rtype: starwatts.script.RemoteScript
+        """
+        return RemoteScript('bootstrap') \
+            .extend(self.hostname_script()) \
+            .extend(self.monitoring_script()) \
+            .add('fetch job script', self.copy_command(src_vm, src_user, src_path, dest)) \
+            .add('run job script', self.run_command())
+
+    def bootstrap_status(self):
+        """
+        Reads the progress of the bootstrap steps from the console output of the VM, without connecting to it.
+
+        :return: List of starwatts.script.StepResult, one for each step that ran so far.
+        :rtype: list
+        """
+        console = self.connection.get_console_output(self.instance.id)
+        output = console.output or b''
+        return RemoteScript.parse(output.decode('utf-8', 'replace') if isinstance(output, bytes) else output)
+
     def terminate(self):
         """
         Terminates the VM.
@@ -258,7 +559,50 @@ class CloudApp:
             print("This CloudApp doesn't have an associated instance. Can't terminate.")
             return self
 
-    def copy(self, src_vm, src_user='root', src_path=None, dest=workdir):
+    def put(self, local_paths, dest=workdir, resume=True, workers=4, dedup=False):
+        """
+        Uploads local files to this host using the transfer engine.
+
+        :param list local_paths: Paths of the local files.
+        :param string dest: Destination directory. Default : workdir.
+        :param bool resume: Resume partial uploads. Default : True.
+        :param int workers: Number of files uploaded at the same time. Default : 4.
+        :param bool dedup:
+            Only sends the blocks this host doesn't already hold, according to its manifest. Default : False.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: CloudApp
+        """
+        engine = self.transfer_engine(workers)
+        if engine is None:
+            return self
+        pairs = [(path, os.path.join(dest, os.path.basename(path))) for path in local_paths]
+        if dedup:
+            self._report_transfer(DeltaTransfer(engine, self.ssh_client).put_many(pairs))
+        else:
+            self._report_transfer(engine.put_many(pairs, resume=resume))
+        return self
+
+    def get(self, remote_paths, dest='.', resume=True, workers=4):
+        """
+        Downloads files from this host using the transfer engine.
+
+        :param list remote_paths: Absolute paths of the remote files.
+        :param string dest: Local destination directory. Default : '.'.
+        :param bool resume: Resume partial downloads. Default : True.
+        :param int workers: Number of files downloaded at the same time. Default : 4.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: CloudApp
+        """
+        engine = self.transfer_engine(workers)
+        if engine is None:
+            return self
+        pairs = [(path, os.path.join(dest, os.path.basename(path))) for path in remote_paths]
+        self._report_transfer(engine.get_many(pairs, resume=resume))
+        return self
+
+    def copy(self, src_vm, src_user='root', src_path=None, dest=workdir, native=False, workers=4, dedup=False):
         """
         Copy a specific file from a remote server to this host.
 
@@ -267,37 +611,164 @@ class CloudApp:
 
         :param string src_path:
             Absolute path on the remote VM of the file to fetch. If the argument isn't specified, the default path will
-             be applied (/home/starwatts/deploy/{app}/{project}.sh).
+             be applied (/home/starwatts/deploy/{app}/{project}.sh). A list of paths can be given when native is set.
 
         :param string src_user: Remote VM user. Default : 'root'.
         :param string dest: Destination directory in which to copy the file. Default : workdir.
+        :param bool native:
+            Streams the file(s) through the transfer engine instead of running scp on this host. The connection to the
+            remote VM is shared by all the CloudApps. Default : False.
+        :param int workers: Number of files copied at the same time when native is set. Default : 4.
+        :param bool dedup:
+            Only sends the blocks this host doesn't already hold, according to its manifest. Implies native.
+            Default : False.
 
         :return: This instance. Allows to chain methods.
         :rtype: CloudApp
         """
         if src_path is None:
             src_path = '/home/starwatts/deploy/{app}/{project}.sh'.format(app=self.application, project=self.project)
-        copy_cmd = "scp {src_user}@{src_vm}:{src_path} {dest}".format(
+        if native or dedup:
+            engine = self.transfer_engine(workers)
+            if engine is None:
+                return self
+            source = TransferEngine(self.source_client(src_vm, src_user).get_transport(), workers=workers)
+            src_paths = src_path if isinstance(src_path, (list, tuple)) else [src_path]
+            pairs = [(path, os.path.join(dest, os.path.basename(path))) for path in src_paths]
+            try:
+                if dedup:
+                    self._report_transfer(DeltaTransfer(engine, self.ssh_client).relay_many(source, pairs))
+                else:
+                    self._report_transfer(engine.relay_many(source, pairs))
+            finally:
+                source.close()
+            return self
+        self.command(self.copy_command(src_vm, src_user, src_path, dest))
+        return self
+
+    def copy_command(self, src_vm, src_user='root', src_path=None, dest=workdir):
+        """
+        Builds the scp command run on this host by copy().
+
+        :param string src_vm: IP or name (can be defined in ~/.ssh/config) of the remote VM holding the file.
+        :param string src_user: Remote VM user. Default : 'root'.
+        :param string src_path: Absolute path of the file on the remote VM. Default : see copy().
+        :param string dest: Destination directory in which to copy the file. Default : workdir.
+
+        :return: The command.
+        :rtype: string
+        """
+        if src_path is None:
+            src_path = '/home/starwatts/deploy/{app}/{project}.sh'.format(app=self.application, project=self.project)
+        return "scp {src_user}@{src_vm}:{src_path} {dest}".format(
             src_user=src_user,
             src_vm=src_vm,
             src_path=src_path,
             dest=dest,
         )
-        self.command(copy_cmd)
-        return self
 
     def run(self):
         """
-        Runs the script which is located in the workdir and that is named according to the project. For example :
-        /home/starwatts/jobs/project1.sh
+        Runs the script which is located in the workdir and that is named according to the project in the background.
+        For example : /home/starwatts/jobs/project1.sh, logging to /home/starwatts/jobs/project1.log.
+
+        :raises RuntimeError: If the CloudApp isn't connected or the job didn't start.
+        :return: A handle on the job, to check its status and read its log.
+        :rtype: starwatts.job.Job
+        """
+        status, out, err = self.execute(self.run_command())
+        if status != 0 or not out.strip().isdigit():
+            self.errors.append(err)
+            raise RuntimeError("Could not start {} : {}".format(self.script_path(), err.strip()))
+        job = Job(self.session(), int(out.strip()), self.script_path())
+        print("Started {} (pid {}), logging to {}.".format(job.name, job.pid, job.log_path))
+        return job
+
+    def job(self):
+        """
+        Returns a handle on the job previously started on this host by run() or at boot by the bootstrap script.
+
+        :raises RuntimeError: If the CloudApp isn't connected or no job was started.
+        :return: A handle on the job.
+        :rtype: starwatts.job.Job
+        """
+        pid_path = job_paths(self.script_path())[1]
+        result = self.session().run("cat {}".format(pid_path))
+        if result.status != 0 or not result.stdout.strip().isdigit():
+            raise RuntimeError("No job was started on {} : {}".format(self.instance_name, result.stderr.strip()))
+        return Job(self.session(), int(result.stdout.strip()), self.script_path())
+
+    def script_path(self):
+        """
+        Full path of the job script of this host.
+
+        :rtype: string
+        """
+        return os.path.join(self.workdir, "{}.sh".format(self.project))
+
+    def run_command(self):
+        """
+        Builds the command run on this host by run().
+
+        :return: The command.
+        :rtype: string
+        """
+        return start_command(self.script_path())
+
+    def run_script(self, script, timeout=None):
+        """
+        Runs a RemoteScript in a single exec and prints the status and timing of each step. The script stops at the
+        first failing step, whose output is added to the errors.
+
+        :param starwatts.script.RemoteScript script:
+            The script to run.
+        :param int timeout:
+            Defines a timeout, raises an error if the script doesn't complete in the given delay. Default : None.
 
         :return: This instance. Allows to chain methods.
         :rtype: CloudApp
         """
-        script_fullpath = os.path.join(self.workdir, "{}.sh".format(self.project))
-        self.command("nohup {script}&".format(script_fullpath))
+        if not self.connected:
+            print("Currently not connected to the VM. Run self.connect() first.")
+            return self
+        status, results, err = script.run(self.ssh_client, timeout=timeout)
+        for step in results:
+            print("[{}] {} : {}{}".format(
+                script.name, step.name, "OK" if step.status == 0 else "Failed ({})".format(step.status),
+                " ({:.2f}s)".format(step.seconds) if step.seconds is not None else "",
+            ))
+            if step.status != 0:
+                self.errors.append(step.output)
+                print(step.output)
+        if status != 0 and (not results or results[-1].status == 0):
+            self.errors.append(err)
+            print("Script {} exited with status {} : {}".format(script.name, status, err))
         return self
 
+    def hostname_script(self):
+        """
+        Steps setting up the hostname of the machine.
+
+        :return: The setup steps.
+        :rtype: starwatts.script.RemoteScript
+        """
+        return RemoteScript('hostname') \
+            .add('write /etc/hostname', 'echo "{hostname}" > /etc/hostname'.format(hostname=self.instance_name)) \
+            .add('apply hostname', 'hostname -F /etc/hostname') \
+            .add('update /etc/hosts', 'sed -i -e "s/node1-blender/{hostname}/g" /etc/hosts'.format(
+                hostname=self.instance_name))
+
+    def monitoring_script(self):
+        """
+        Steps setting up the monitoring of the machine.
+
+        :return: The setup steps.
+        :rtype: starwatts.script.RemoteScript
+        """
+        return RemoteScript('monitoring') \
+            .add('enable zabbix-agent', 'systemctl enable zabbix-agent') \
+            .add('restart zabbix-agent', 'service zabbix-agent restart')
+
     def setup_hostname(self):
         """
         Setup the hostname of the machine. Must be called at some point because the monitoring of this VM depends on
@@ -309,10 +780,7 @@ class CloudApp:
         if not self.connected:
             print("Connection is closed. Run self.connect() first.")
             return
-        self.command('echo "{hostname}" > /etc/hostname'.format(hostname=self.instance_name))
-        self.command('hostname -F /etc/hostname')
-        self.command('sed -i -e "s/node1-blender/{hostname}/g" /etc/hosts'.format(hostname=self.instance_name))
-        return self
+        return self.run_script(self.hostname_script())
 
     def setup_monitoring(self):
         """
@@ -325,23 +793,30 @@ class CloudApp:
         if not self.connected:
             print("Connection is closed. Run self.connect() first.")
             return
-        self.command("systemctl enable zabbix-agent")
-        self.command("service zabbix-agent restart")
-        return self
+        return self.run_script(self.monitoring_script())
 
     def setup(self):
         """
-        Successive calls to setup_hostname and setup_monitoring.
+        Sets up the hostname then the monitoring, in a single remote script.
 
         :return: This instance. Allows to chain methods.
         :rtype: CloudApp
         """
-        self.setup_hostname()
-        self.setup_monitoring()
-        return self
+        if not self.connected:
+            print("Connection is closed. Run self.connect() first.")
+            return
+        script = RemoteScript('setup').extend(self.hostname_script()).extend(self.monitoring_script())
+        return self.run_script(script)
 
-    def fullchain(self):
+    def fullchain(self, bootstrap=False):
         """
         Simple example on how to use this object
+
+        :param bool bootstrap:
+            Lets the VM set itself up and start the job at boot instead of doing it over SSH. Default : False.
         """
-        self.create().wait(5).connect().setup().copy('files').run().disconnect()
+        if bootstrap:
+            self.create(bootstrap=self.bootstrap_script('files'))
+            return
+        self.create().wait_ready().connect().setup().copy('files').run()
+        self.disconnect()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Coalescing of identical read-only API calls made at the same time by several threads.
+"""
+
+import copy
+import threading
+
+from .instrument import register_internal
+
+register_internal(__name__)
+
+# Actions that don't change anything, and can be shared between callers
+READ_ONLY_PREFIXES = ('Describe', 'Get')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Runs a single call at a time for each key : the callers asking for a key while its call is in flight wait for it and
+    get its result (or its exception) instead of making their own call.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Calls a function, or waits for the call in flight with the same key.
+
+        :param key: Hashable key of the call.
+        :param callable function: Makes the call.
+
+        :return: A (result, shared) tuple, shared being True if the result comes from the call of another thread.
+        :rtype: tuple
+        """
+        with self._lock:
+            call = self._flights.get(key)
+            leader = call is None
+            if leader:
+                call = self._flights[key] = _Call()
+                self.calls += 1
+            else:
+                call.followers += 1
+                self.shared += 1
+        if leader:
+            try:
+                call.result = function()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
+
+    def in_flight(self):
+        """
+        Number of calls in flight.
+
+        :rtype: int
+        """
+        with self._lock:
+            return len(self._flights)
+
+    def __str__(self):
+        return "SingleFlight : {} call(s), {} shared".format(self.calls, self.shared)
+
+
+def _coalescing(method, connection, flight, instrumentation):
+    def wrapper(action, params, markers, path='/', parent=None, verb='GET'):
+        if not action.startswith(READ_ONLY_PREFIXES) or parent not in (None, connection):
+            return method(action, params, markers, path, parent, verb)
+        key = (connection.host, connection.port, connection.aws_access_key_id, method.__name__, action,
+               tuple(sorted((params or dict()).items())), tuple(markers) if isinstance(markers, list) else markers,
+               path, verb)
+        try:
+            hash(key)
+        except TypeError:
+            return method(action, params, markers, path, parent, verb)
+        (result, owner), shared = flight.do(
+            key, lambda: (method(action, params, markers, path, parent, verb), connection))
+        if not shared:
+            return result
+        if instrumentation is not None:
+            instrumentation.increment(action, 'coalesced')
+        if owner is not connection:
+            # The objects of another connection are copied and bound to this one, as if it had listed them
+            return copy.deepcopy(result, {id(owner): connection})
+        # Each caller gets its own list, the objects in it are shared
+        return copy.copy(result) if isinstance(result, list) else result
+    return wrapper
+
+
+def coalesce(connection, flight, instrumentation=None):
+    """
+    Makes the identical read-only calls (same action and parameters) of a connection made while one of them is in
+    flight share its HTTP call and its parsed result. The flight is usually shared by several connections with the same
+    credentials. Callers get their own result list. The boto objects in it are shared by the callers of the same
+    connection, the callers of the other connections get copies bound to their connection.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+    :param SingleFlight flight: The calls in flight.
+    :param starwatts.instrument.ApiInstrumentation instrumentation: Where the coalesced calls are counted.
+        Default : None.
+
+    :return: The connection.
+    :rtype: boto.ec2.EC2Connection
+    """
+    connection.get_list = _coalescing(connection.get_list, connection, flight, instrumentation)
+    connection.get_object = _coalescing(connection.get_object, connection, flight, instrumentation)
+    connection.flight = flight
+    return connection
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Retrieves the results of the jobs from the nodes while the jobs are still running.
+"""
+
+import os
+import stat
+import time
+import shlex
+import hashlib
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+from .transfer import TransferEngine, TransferStats
+
+
+def file_sha1(path, block_size=1024 * 1024):
+    """
+    SHA-1 of a local file.
+
+    :param string path: Path of the file.
+    :param int block_size: Size of the reads. Default : 1 MiB.
+
+    :rtype: string
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCollector:
+    """
+    Downloads the files a job writes in an output directory of a node. Each call to collect() lists the directory and
+    downloads the new and changed files concurrently through a TransferEngine, resuming the partial ones. A file is only
+    downloaded once its size and modification time didn't change between two listings, so that frames still being
+    written are left for a later pass. Downloaded files are checked against a SHA-1 computed on the node, and removed to
+    be downloaded again on a mismatch.
+
+    follow() calls collect() periodically while the job runs, so most of the results are already retrieved when it
+    ends.
+
+    :param paramiko.SSHClient client: A connected client to the node.
+    :param string remote_dir: Absolute path of the output directory on the node.
+    :param string local_dir: Local directory the files are downloaded to, created if needed.
+    :param string pattern: Only the files whose path relative to remote_dir match this pattern are collected.
+        Default : '*'.
+    :param bool verify: Checks the SHA-1 of the downloaded files. Default : True.
+    :param TransferEngine engine: Engine to download with. Default : None (a new one is created on the transport of the
+        client).
+    :param int workers: Number of files downloaded at the same time. Default : 4.
+    """
+
+    def __init__(self, client, remote_dir, local_dir, pattern='*', verify=True, engine=None, workers=4):
+        self.client = client
+        self.remote_dir = remote_dir.rstrip('/') or '/'
+        self.local_dir = local_dir
+        self.pattern = pattern
+        self.verify = verify
+        self._own_engine = engine is None
+        self.engine = engine if engine is not None else TransferEngine(client.get_transport(), workers=workers)
+        self.workers = workers
+        # Relative path : (size, mtime) of the previous listing and of the downloaded files
+        self.seen = dict()
+        self.done = dict()
+        # Kept between the passes so that the SFTP channels of its threads are reused
+        self._executor = None
+
+    def scan(self):
+        """
+        Lists the files of the output directory and of its subdirectories.
+
+        :return: Dict of relative path : (size, mtime), empty if the directory doesn't exist yet.
+        :rtype: dict
+        """
+        listing = dict()
+        dirs = ['']
+        while dirs:
+            rel_dir = dirs.pop()
+            try:
+                entries = self.engine.sftp.listdir_attr(os.path.join(self.remote_dir, rel_dir))
+            except IOError:
+                continue
+            for entry in entries:
+                rel = os.path.join(rel_dir, entry.filename)
+                if stat.S_ISDIR(entry.st_mode):
+                    dirs.append(rel)
+                elif stat.S_ISREG(entry.st_mode) and fnmatch.fnmatch(rel, self.pattern):
+                    listing[rel] = (entry.st_size, entry.st_mtime)
+        return listing
+
+    def pending(self, listing, final=False):
+        """
+        Selects the files to download.
+
+        :param dict listing: The result of scan().
+        :param bool final: Also selects the files that changed since the previous listing, for the last pass once the
+            job ended. Default : False.
+
+        :return: The relative paths to download.
+        :rtype: list
+        """
+        return sorted(rel for rel, attrs in listing.items()
+                      if self.done.get(rel) != attrs and (final or self.seen.get(rel) == attrs))
+
+    def remote_checksums(self, rels, batch=200):
+        """
+        Computes the SHA-1 of remote files, with a single exec for each batch of files.
+
+        :param list rels: Paths relative to remote_dir.
+        :param int batch: Number of files per exec. Default : 200.
+
+        :return: Dict of relative path : SHA-1, without the files that couldn't be read.
+        :rtype: dict
+        """
+        checksums = dict()
+        for i in range(0, len(rels), batch):
+            command = "cd {} && sha1sum -- {}".format(
+                shlex.quote(self.remote_dir), " ".join(shlex.quote(rel) for rel in rels[i:i + batch]))
+            (stdin, stdout, stderr) = self.client.exec_command(command)
+            for line in stdout.read().decode('utf-8', 'replace').splitlines():
+                digest, _, rel = line.partition('  ')
+                checksums[rel] = digest
+            stdout.channel.recv_exit_status()
+        return checksums
+
+    def _download(self, rel, stats):
+        local_path = os.path.join(self.local_dir, rel)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        if rel in self.done and os.path.exists(local_path):
+            # The file changed on the node after it was downloaded
+            os.remove(local_path)
+        try:
+            self.engine.get(os.path.join(self.remote_dir, rel), local_path, stats=stats)
+            return True
+        except (IOError, OSError, paramiko.SSHException) as e:
+            stats.error(rel, e)
+            return False
+
+    def collect(self, final=False, stats=None):
+        """
+        Makes a single pass : lists the output directory, then downloads and verifies the files ready to be collected.
+
+        :param bool final: Downloads every new or changed file, see pending(). Default : False.
+        :param TransferStats stats: Statistics to update. Default : None (a new object is created).
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        stats = stats if stats is not None else TransferStats()
+        listing = self.scan()
+        rels = self.pending(listing, final)
+        self.seen = listing
+        if not rels:
+            return stats
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        downloaded = [rel for rel, ok in zip(rels, self._executor.map(lambda r: self._download(r, stats), rels)) if ok]
+        checksums = self.remote_checksums(downloaded) if self.verify and downloaded else dict()
+        for rel in downloaded:
+            local_path = os.path.join(self.local_dir, rel)
+            if self.verify and checksums.get(rel) != file_sha1(local_path):
+                # Started over on the next pass
+                os.remove(local_path)
+                self.done.pop(rel, None)
+                stats.error(rel, IOError("Checksum mismatch"))
+                continue
+            self.done[rel] = listing[rel]
+        return stats
+
+    def follow(self, job, interval=5.0, timeout=None, retries=2):
+        """
+        Collects the results while a job is running, then makes a final pass once it ended. The final pass is repeated
+        while some files fail.
+
+        :param starwatts.job.Job job: The job writing in the output directory.
+        :param float interval: Number of seconds between two passes. Default : 5.
+        :param int timeout: Number of seconds after which the job isn't waited for anymore. Default : None.
+        :param int retries: Maximum number of final passes after the first one. Default : 2.
+
+        :return: The transfer statistics of all the passes.
+        :rtype: TransferStats
+        """
+        stats = TransferStats()
+        limit = None if timeout is None else time.time() + timeout
+        while job.status().running and (limit is None or time.time() < limit):
+            self.collect(stats=stats)
+            time.sleep(interval)
+        for _ in range(retries + 1):
+            failed = len(stats.errors)
+            self.collect(final=True, stats=stats)
+            if len(stats.errors) == failed:
+                break
+        return stats.stop()
+
+    def close(self):
+        """
+        Stops the download threads, and closes the engine if it was created by this collector.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._own_engine:
+            self.engine.close()
+
+
+def follow_many(collectors, jobs, interval=5.0, timeout=None, workers=32):
+    """
+    Follows the jobs of many nodes at the same time, one thread per node.
+
+    :param list collectors: The ResultCollector of each node.
+    :param list jobs: The job of each node, in the same order.
+    :param float interval: Number of seconds between two passes. Default : 5.
+    :param int timeout: Number of seconds after which the jobs aren't waited for anymore. Default : None.
+    :param int workers: Maximum number of nodes followed at the same time. Default : 32.
+
+    :return: The transfer statistics of each node, in the same order.
+    :rtype: list
+    """
+    if not collectors:
+        return list()
+    with ThreadPoolExecutor(max_workers=min(workers, len(collectors))) as executor:
+        return list(executor.map(lambda pair: pair[0].follow(pair[1], interval, timeout), zip(collectors, jobs)))
+
+
+def collect_fleet(apps, remote_dir, local_dir, jobs=None, pattern='*', interval=5.0, timeout=None, workers=4):
+    """
+    Collects the results of the jobs of many CloudApps while they run. The files of each node are downloaded to a
+    subdirectory of local_dir named after its instance.
+
+    :param list apps: Connected CloudApps.
+    :param string remote_dir: Absolute path of the output directory on the nodes.
+    :param string local_dir: Local directory holding one subdirectory per node.
+    :param list jobs: The job of each CloudApp. Default : None (the jobs started by CloudApp.run() are looked up).
+    :param string pattern: Only the files matching this pattern are collected. Default : '*'.
+    :param float interval: Number of seconds between two passes. Default : 5.
+    :param int timeout: Number of seconds after which the jobs aren't waited for anymore. Default : None.
+    :param int workers: Number of files downloaded at the same time from each node. Default : 4.
+
+    :return: Dict of CloudApp : TransferStats.
+    :rtype: dict
+    """
+    jobs = jobs if jobs is not None else [app.job() for app in apps]
+    collectors = [app.collector(remote_dir, os.path.join(local_dir, app.instance_name), pattern, workers=workers)
+                  for app in apps]
+    try:
+        return dict(zip(apps, follow_many(collectors, jobs, interval, timeout)))
+    finally:
+        for collector in collectors:
+            collector.close()
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar inventory : the instance records are stored in a single flat buffer that worker processes can attach to without
+copying or unpickling it.
+
+Layout of the buffer, in native byte order :
+
+* a header : magic, version, number of rows, of strings, of tags and size of the string blob,
+* one int32 column per attribute of the records, holding the code of the value in the string table (-1 for None),
+* the offsets of the strings in the blob,
+* the tags, as a sparse table of (row, key code, value code) sorted by row,
+* the blob of the utf-8 encoded strings.
+"""
+
+import os
+import mmap
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from .records import InstanceRecord
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8 : only the files are available
+    shared_memory = None
+
+MAGIC = b'SWCI'
+VERSION = 1
+HEADER = struct.Struct('=4sIIIII')
+INT_SIZE = array('i').itemsize
+
+# Attributes of the records stored as columns, the tags apart
+COLUMNS = tuple(name for name in InstanceRecord.__slots__ if name != 'tags')
+
+
+class ColumnarInventory:
+    """
+    An inventory of instances stored column by column : each value is replaced by the code of the string in a table
+    shared by all the columns, and the tags are a sparse table. Around 150 bytes per instance, a third of the records
+    and a fifteenth of boto instances.
+
+    The buffer can be shared with other processes with share() or save(). Once shared, the inventory is pickled as the
+    name of its buffer : a worker process receiving it attaches the same memory instead of copying it.
+
+    :param buffer: The buffer, as built by from_records(). Bytes, shared memory or mmap.
+    :param owner: Object holding the buffer, closed with the inventory. Default : None.
+    :param string name: Name of the shared memory block. Default : None.
+    :param string path: Path of the file. Default : None.
+    """
+
+    def __init__(self, buffer, owner=None, name=None, path=None):
+        self._owner = owner
+        self.name = name
+        self.path = path
+        self._buffer = memoryview(buffer)
+        magic, version, self.rows, strings, tags, blob = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a columnar inventory : {!r}".format(magic))
+        ints = len(COLUMNS) * self.rows + strings + 1 + 3 * tags
+        start = HEADER.size
+        self._ints = self._buffer[start:start + ints * INT_SIZE].cast('i')
+        self._blob = self._buffer[start + ints * INT_SIZE:start + ints * INT_SIZE + blob]
+        sections = list()
+        offset = 0
+        for size in [self.rows] * len(COLUMNS) + [strings + 1, tags, tags, tags]:
+            sections.append(self._ints[offset:offset + size])
+            offset += size
+        self._columns = dict(zip(COLUMNS, sections))
+        self._offsets, self._tag_rows, self._tag_keys, self._tag_values = sections[len(COLUMNS):]
+        self._codes = None
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Builds an inventory from instance records.
+
+        :param list records: The starwatts.records.InstanceRecord, as listed by StarWatts.inventory().
+
+        :rtype: ColumnarInventory
+        """
+        codes = dict()
+
+        def code(value):
+            if value is None:
+                return -1
+            c = codes.get(value)
+            if c is None:
+                c = codes[value] = len(codes)
+            return c
+
+        columns = [array('i', (code(getattr(r, name)) for r in records)) for name in COLUMNS]
+        tag_rows, tag_keys, tag_values = array('i'), array('i'), array('i')
+        for row, record in enumerate(records):
+            for key, value in record.tags.items():
+                tag_rows.append(row)
+                tag_keys.append(code(key))
+                tag_values.append(code(value))
+        offsets = array('i', [0])
+        blob = bytearray()
+        for string in codes:
+            blob += string.encode('utf-8')
+            offsets.append(len(blob))
+        buffer = bytearray(HEADER.pack(MAGIC, VERSION, len(records), len(codes), len(tag_rows), len(blob)))
+        for section in columns + [offsets, tag_rows, tag_keys, tag_values]:
+            buffer += section.tobytes()
+        buffer += blob
+        inventory = cls(bytes(buffer))
+        inventory._codes = codes
+        return inventory
+
+    @property
+    def nbytes(self):
+        """
+        Size of the buffer, in bytes.
+        """
+        return self._buffer.nbytes
+
+    def string(self, code):
+        """
+        :param int code: Code of a string.
+
+        :return: The string, None for -1.
+        :rtype: string
+        """
+        if code < 0:
+            return None
+        return str(self._blob[self._offsets[code]:self._offsets[code + 1]], 'utf-8')
+
+    def code(self, value):
+        """
+        :param string value: A string.
+
+        :return: Its code, -1 for None and None if no value of the inventory is this string.
+        :rtype: int
+        """
+        if value is None:
+            return -1
+        if self._codes is None:
+            self._codes = {self.string(c): c for c in range(len(self._offsets) - 1)}
+        return self._codes.get(value)
+
+    def column(self, name):
+        """
+        :param string name: An attribute of the records : id, state, instance_type...
+
+        :return: The values of the attribute, row by row.
+        :rtype: list
+        """
+        strings = dict()
+        values = list()
+        for c in self._columns[name]:
+            if c not in strings:
+                strings[c] = self.string(c)
+            values.append(strings[c])
+        return values
+
+    def tags(self, row):
+        """
+        :param int row: A row.
+
+        :return: The tags of the instance of the row.
+        :rtype: dict
+        """
+        start = bisect_left(self._tag_rows, row)
+        end = bisect_right(self._tag_rows, row, start)
+        return {self.string(self._tag_keys[i]): self.string(self._tag_values[i]) for i in range(start, end)}
+
+    def select(self, tags=None, **values):
+        """
+        Finds the rows of the instances matching all the values, comparing the codes only.
+
+        :param dict tags: Tags the instances must have. Default : None.
+        :param values: Values of the attributes, such as state='running'.
+
+        :return: The rows.
+        :rtype: list
+        """
+        rows = None
+        for name, value in values.items():
+            code = self.code(value)
+            found = {row for row, c in enumerate(self._columns[name]) if c == code} if code is not None else set()
+            rows = found if rows is None else rows & found
+        for key, value in (tags or dict()).items():
+            key_code, value_code = self.code(key), self.code(value)
+            found = {self._tag_rows[i] for i in range(len(self._tag_rows))
+                     if self._tag_keys[i] == key_code and self._tag_values[i] == value_code} \
+                if None not in (key_code, value_code) else set()
+            rows = found if rows is None else rows & found
+        return sorted(rows) if rows is not None else list(range(self.rows))
+
+    def count_by(self, name):
+        """
+        :param string name: An attribute of the records.
+
+        :return: The number of instances for each value of the attribute.
+        :rtype: dict
+        """
+        return {self.string(c): n for c, n in Counter(self._columns[name]).items()}
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, row):
+        """
+        :return: The instance record of a row.
+        :rtype: starwatts.records.InstanceRecord
+        """
+        if not -self.rows <= row < self.rows:
+            raise IndexError("Row {} out of {}".format(row, self.rows))
+        row %= self.rows
+        record = InstanceRecord()
+        for name, column in self._columns.items():
+            setattr(record, name, self.string(column[row]))
+        record.tags = self.tags(row)
+        return record
+
+    def __iter__(self):
+        for row in range(self.rows):
+            yield self[row]
+
+    def share(self, name=None):
+        """
+        Copies the inventory to a shared memory block, unlinked by unlink() once the workers are done.
+
+        :param string name: Name of the block. Default : None (a random one).
+
+        :return: The inventory in shared memory.
+        :rtype: ColumnarInventory
+        :raises RuntimeError: If shared memory isn't available (Python < 3.8), save() has to be used instead.
+        """
+        if shared_memory is None:
+            raise RuntimeError("Shared memory requires Python 3.8, use save() instead")
+        block = shared_memory.SharedMemory(name=name, create=True, size=self.nbytes)
+        block.buf[:self.nbytes] = self._buffer
+        return ColumnarInventory(block.buf[:self.nbytes], block, name=block.name)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attaches an inventory shared by another process, without copying it.
+
+        :param string name: Name of the shared memory block.
+
+        :rtype: ColumnarInventory
+        """
+        try:
+            block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 always tracks the block
+            block = shared_memory.SharedMemory(name=name)
+        return cls(block.buf, block, name=name)
+
+    def save(self, path):
+        """
+        Writes the inventory to a file, which other processes map with ColumnarInventory.open().
+
+        :param string path: The file.
+
+        :return: The inventory mapped from the file.
+        :rtype: ColumnarInventory
+        """
+        with open(path, 'wb') as f:
+            f.write(self._buffer)
+        return ColumnarInventory.open(path)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Maps an inventory written by save(), without reading it.
+
+        :param string path: The file.
+
+        :rtype: ColumnarInventory
+        """
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, mapped, path=path)
+
+    def close(self):
+        """
+        Releases the buffer. The inventory can't be used anymore.
+        """
+        for view in [self._offsets, self._tag_rows, self._tag_keys, self._tag_values, self._blob, self._ints] + \
+                list(self._columns.values()) + [self._buffer]:
+            view.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def unlink(self):
+        """
+        Closes the inventory and destroys its shared memory block or file.
+        """
+        self.close()
+        if self.name is not None:
+            block = shared_memory.SharedMemory(name=self.name)
+            block.close()
+            block.unlink()
+        elif self.path is not None:
+            os.remove(self.path)
+
+    def __reduce__(self):
+        if self.name is not None:
+            return ColumnarInventory.attach, (self.name,)
+        if self.path is not None:
+            return ColumnarInventory.open, (self.path,)
+        return ColumnarInventory, (bytes(self._buffer),)
+
+    def __del__(self):
+        # The views have to be released before the shared memory or the mmap is closed
+        if getattr(self, '_owner', None) is not None:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __str__(self):
+        return "ColumnarInventory : {} instance(s), {} tag(s), {} bytes".format(self.rows, len(self._tag_rows),
+                                                                               self.nbytes)
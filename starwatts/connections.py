@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of API connections, so that threads don't share a single EC2Connection nor pay a new TLS handshake for each task.
+"""
+
+import gzip
+import time
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+
+from boto.exception import BotoClientError, BotoServerError
+
+from .instrument import register_internal
+
+register_internal(__name__)
+
+
+def _keepalive(http_connection):
+    connect = http_connection.connect
+
+    def keepalive_connect():
+        connect()
+        if http_connection.sock is not None:
+            http_connection.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    http_connection.connect = keepalive_connect
+    return http_connection
+
+
+def keep_alive(connection):
+    """
+    Enables TCP keep-alive on the sockets of a connection, so that the HTTP connections boto keeps for the following
+    calls aren't silently dropped by the network while they are idle.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+
+    :return: The connection.
+    :rtype: boto.ec2.EC2Connection
+    """
+    new_http_connection = connection.new_http_connection
+    connection.new_http_connection = lambda *args, **kwargs: _keepalive(new_http_connection(*args, **kwargs))
+    return connection
+
+
+def accept_gzip(connection):
+    """
+    Asks for gzip compressed responses, and decompresses them before boto parses them.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+
+    :return: The connection.
+    :rtype: boto.ec2.EC2Connection
+    """
+    build_base_http_request = connection.build_base_http_request
+    inner = connection.make_request
+
+    def build_request(*args, **kwargs):
+        request = build_base_http_request(*args, **kwargs)
+        request.headers['Accept-Encoding'] = 'gzip'
+        return request
+
+    def make_request(action, params=None, path='/', verb='GET'):
+        response = inner(action, params, path, verb)
+        if (response.getheader('content-encoding') or '').lower() == 'gzip':
+            # boto returns the cached body on the following reads
+            response._cached_response = gzip.decompress(response.read())
+        return response
+
+    connection.build_base_http_request = build_request
+    connection.make_request = make_request
+    return connection
+
+
+def warm(connection):
+    """
+    Opens an HTTP connection (including the TLS handshake) to the endpoint of a connection and leaves it in the pool of
+    boto, to be used by the next call.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+
+    :return: False if the endpoint couldn't be reached.
+    :rtype: bool
+    """
+    host, port, is_secure = connection.host, connection.port, connection.is_secure
+    try:
+        http_connection = connection.new_http_connection(host, port, is_secure)
+        http_connection.connect()
+    except (socket.error, IOError) as e:
+        logging.error("Could not open a connection to {} : {}".format(host, e))
+        return False
+    connection.put_http_connection(host, port, is_secure, http_connection)
+    return True
+
+
+class ConnectionPool:
+    """
+    Hands out API connections to threads. A connection is either checked out for a task with connection() and given
+    back afterwards, or kept by a thread with local() until it ends. Connections are created by the factory, and keep
+    their HTTP connection open between two calls.
+
+    :param callable factory: Creates a new connection.
+    :param int size: Maximum number of connections checked out at the same time. Default : 8.
+    :param int prewarm: Number of connections created and warmed in a background thread. Default : 0.
+    """
+
+    def __init__(self, factory, size=8, prewarm=0):
+        self.factory = factory
+        self.size = size
+        self.created = 0
+        self.checkouts = 0
+        self.waits = 0
+        self._idle = list()
+        self._owners = dict()
+        self._cond = threading.Condition()
+        self._warming = None
+        if prewarm:
+            self.prewarm(prewarm)
+
+    def prewarm(self, count, others=()):
+        """
+        Creates and warms connections in a background thread, up to the size of the pool.
+
+        :param int count: Number of connections.
+        :param list others: Connections outside of the pool warmed first. Default : ().
+
+        :return: The thread.
+        :rtype: threading.Thread
+        """
+        def run():
+            for connection in others:
+                warm(connection)
+            for _ in range(count):
+                with self._cond:
+                    if self.created >= self.size:
+                        return
+                    self.created += 1
+                try:
+                    connection = self.factory()
+                except (BotoClientError, BotoServerError) as e:
+                    logging.error("Could not create a connection : {}".format(e))
+                    with self._cond:
+                        self.created -= 1
+                    return
+                warm(connection)
+                with self._cond:
+                    self._idle.append(connection)
+                    self._cond.notify()
+        self._warming = threading.Thread(target=run, daemon=True)
+        self._warming.start()
+        return self._warming
+
+    def wait_warm(self, timeout=None):
+        """
+        Waits for the connections being warmed.
+
+        :param float timeout: Number of seconds to wait for. Default : None.
+        """
+        if self._warming is not None:
+            self._warming.join(timeout)
+
+    def _reclaim(self):
+        # Connections kept by threads with local() are given back once the threads ended
+        for thread in [thread for thread in self._owners if not thread.is_alive()]:
+            self._idle.append(self._owners.pop(thread))
+
+    def checkout(self, timeout=None):
+        """
+        Takes a connection, creating one if none is idle and the pool isn't full.
+
+        :param float timeout: Number of seconds to wait for a connection when the pool is full. Default : None.
+
+        :raises TimeoutError: If no connection was given back in time.
+        :rtype: boto.ec2.EC2Connection
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self.checkouts += 1
+            self._reclaim()
+            if not self._idle and self.created >= self.size:
+                self.waits += 1
+            while not self._idle and self.created >= self.size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No connection available after {} seconds.".format(timeout))
+                # Threads ending don't notify, hence the periodic checks
+                self._cond.wait(0.5 if remaining is None else min(remaining, 0.5))
+                self._reclaim()
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        try:
+            return self.factory()
+        except Exception:
+            with self._cond:
+                self.created -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, connection):
+        """
+        Gives back a connection.
+
+        :param boto.ec2.EC2Connection connection: The connection.
+        """
+        with self._cond:
+            self._idle.append(connection)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Checks out a connection for the duration of a with block.
+
+        :param float timeout: Number of seconds to wait for a connection when the pool is full. Default : None.
+        """
+        connection = self.checkout(timeout)
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    def local(self):
+        """
+        The connection of the current thread, checked out on the first call and kept by the thread until release() or
+        until it ends.
+
+        :rtype: boto.ec2.EC2Connection
+        """
+        thread = threading.current_thread()
+        with self._cond:
+            connection = self._owners.get(thread)
+        if connection is None:
+            connection = self.checkout()
+            with self._cond:
+                self._owners[thread] = connection
+        return connection
+
+    def release(self):
+        """
+        Gives back the connection of the current thread, if it has one.
+        """
+        with self._cond:
+            connection = self._owners.pop(threading.current_thread(), None)
+        if connection is not None:
+            self.checkin(connection)
+
+    def close(self):
+        """
+        Closes the HTTP connections of the idle connections.
+        """
+        with self._cond:
+            for connection in self._idle:
+                with connection._pool.mutex:
+                    for host_pool in connection._pool.host_to_pool.values():
+                        for http_connection, _ in host_pool.queue:
+                            http_connection.close()
+                    connection._pool.host_to_pool.clear()
+
+    def __str__(self):
+        return "ConnectionPool : {} connection(s), {} idle, {} checkout(s), {} wait(s)".format(
+            self.created, len(self._idle), self.checkouts, self.waits)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Daemon keeping a StarWatts instance and its inventory in memory, and answering the scripts over a Unix socket. The
+client side is daemon_client, at the root of the repository.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+
+from boto.exception import EC2ResponseError
+
+from daemon_client import DEFAULT_SOCKET
+from .query import Query
+from .records import describe_instances
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            message = json.loads(line.decode('utf-8'))
+            reply = {'result': self.server.daemon.handle(message['command'], **message.get('args', dict()))}
+        except Exception as e:
+            reply = {'error': "{}: {}".format(e.__class__.__name__, e)}
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+def record_dict(record):
+    """
+    :param starwatts.records.InstanceRecord record: A record.
+
+    :return: The attributes of the record.
+    :rtype: dict
+    """
+    return {name: getattr(record, name) for name in record.__slots__}
+
+
+class Daemon:
+    """
+    Keeps the inventory of a StarWatts instance in memory, refreshed every few seconds in the background lane of its
+    limiter, and answers the commands sent on a Unix socket (readable by the current user only) from it :
+
+    * ping : {pid, generation, age} of the inventory, with the configuration file and the access key it is listed with
+      (conf, access_key), so that the clients can check they use the same account,
+    * ssh_config (local) and ansible_hosts (grain, local) : generate_ssh_config() and generate_ansible_hosts_file(),
+    * query (query) : the attributes of the instances matching a query (see starwatts.query),
+    * instance (instance_id) : the attributes of an instance, None if it doesn't exist,
+    * security_groups : the (name, id, security group names) of the instances,
+    * refresh : refreshes the inventory right away.
+
+    The commands are answered in threads, which make their API calls with a connection of the pool of the StarWatts
+    instance, like the refreshes.
+
+    :param starwatts.StarWatts starwatts: The StarWatts instance, connected.
+    :param string path: Path of the socket, its directory being created with mode 0700 if it doesn't exist. Default :
+        daemon_client.DEFAULT_SOCKET.
+    :param float refresh: Number of seconds between two refreshes of the inventory. Default : 60.
+    :param string conf: Configuration file the StarWatts instance was created from, reported by ping. Default : None.
+    """
+
+    def __init__(self, starwatts, path=DEFAULT_SOCKET, refresh=60.0, conf=None):
+        self.starwatts = starwatts
+        self.path = path
+        self.refresh = refresh
+        self.conf = os.path.realpath(conf) if conf is not None else None
+        self.access_key = starwatts.conn.aws_access_key_id
+        self.inventory = list()
+        self.refreshed = None
+        self.generation = 0
+        self.errors = 0
+        self.requests = 0
+        self.commands = {
+            'ping': self.ping,
+            'ssh_config': self.ssh_config,
+            'ansible_hosts': self.ansible_hosts,
+            'query': self.query,
+            'instance': self.instance,
+            'security_groups': self.security_groups,
+            'refresh': self.refresh_inventory,
+        }
+        self._groups = (None, None)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = None
+        self._threads = list()
+
+    def refresh_inventory(self):
+        """
+        Lists the instances again.
+
+        :return: The generation of the inventory.
+        :rtype: int
+        """
+        with self.starwatts.background(), self.starwatts.connection() as conn:
+            inventory = describe_instances(conn)
+        with self._lock:
+            self.inventory = inventory
+            self.refreshed = time.time()
+            self.generation += 1
+            return self.generation
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh):
+            try:
+                self.refresh_inventory()
+            except Exception as e:
+                # The previous inventory is kept
+                self.errors += 1
+                logging.error("Could not refresh the inventory : {}".format(e))
+
+    def vms(self):
+        """
+        :return: The (tags, record) tuples of the inventory, as all_vms(fast=True).
+        :rtype: list
+        """
+        with self._lock:
+            return [(r.tags, r) for r in self.inventory]
+
+    def handle(self, command, **args):
+        """
+        Runs a command.
+
+        :param string command: The command.
+        :param args: Its arguments.
+
+        :return: Its result, serializable in JSON.
+        :raises ValueError: If the command doesn't exist.
+        """
+        if command not in self.commands:
+            raise ValueError("Unknown command {}".format(command))
+        self.requests += 1
+        return self.commands[command](**args)
+
+    def ping(self):
+        return {'pid': os.getpid(), 'generation': self.generation, 'age': time.time() - self.refreshed,
+                'conf': self.conf, 'access_key': self.access_key}
+
+    def ssh_config(self, local=False):
+        return self.starwatts.generate_ssh_config(local=local, vms=self.vms())
+
+    def ansible_hosts(self, grain=None, local=False):
+        return self.starwatts.generate_ansible_hosts_file(grain=grain, local=local, vms=self.vms())
+
+    def query(self, query=None):
+        query = Query(query)
+        return [record_dict(r) for _, r in self.vms() if query.matches(r)]
+
+    def instance(self, instance_id):
+        for _, r in self.vms():
+            if r.id == instance_id:
+                return record_dict(r)
+        # Created since the last refresh
+        try:
+            with self.starwatts.connection() as conn:
+                instances = describe_instances(conn, filters={'instance-id': instance_id})
+        except EC2ResponseError:
+            return None
+        return record_dict(instances[0]) if instances else None
+
+    def security_groups(self):
+        with self._lock:
+            generation, groups = self._groups
+        if generation != self.generation:
+            # The records don't have the groups, they are listed once per generation of the inventory
+            generation = self.generation
+            with self.starwatts.background(), self.starwatts.connection() as conn:
+                groups = [(i.tags.get('name', 'No Name'), i.id, [g.name for g in i.groups])
+                          for i in conn.get_only_instances()]
+            with self._lock:
+                self._groups = (generation, groups)
+        return groups
+
+    def start(self):
+        """
+        Lists the inventory, then serves the socket and refreshes the inventory in background threads.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: Daemon
+        :raises RuntimeError: If a daemon is already listening on the socket.
+        """
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except ConnectionRefusedError:
+                # Left by a daemon that didn't stop cleanly
+                os.remove(self.path)
+            else:
+                raise RuntimeError("A starwatts daemon is already listening on {}".format(self.path))
+            finally:
+                probe.close()
+        self.refresh_inventory()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.path, _Handler)
+        finally:
+            os.umask(umask)
+        self._server.daemon = self
+        self._stopped.clear()
+        self._threads = [threading.Thread(target=self._server.serve_forever, daemon=True),
+                         threading.Thread(target=self._refresh_loop, daemon=True)]
+        for t in self._threads:
+            t.start()
+        return self
+
+    def wait(self):
+        """
+        Waits for the daemon to be stopped.
+        """
+        # With a timeout, so that the main thread still gets the signals
+        while not self._stopped.wait(1):
+            pass
+
+    def stop(self):
+        """
+        Stops serving and removes the socket.
+        """
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        for t in self._threads:
+            t.join()
+        self._threads = list()
+
+    def __str__(self):
+        return "Daemon on {} : {} instance(s), generation {}, {} request(s), {} error(s)".format(
+            self.path, len(self.inventory), self.generation, self.requests, self.errors)
@@ -0,0 +1,527 @@
+# -*- coding: utf-8 -*-
+"""
+Content addressed transfers to job nodes. Every node keeps a manifest of the block signatures of the files it holds,
+new files are diffed against all the blocks of the node with a rolling checksum and only the missing bytes are sent.
+The file is then rebuilt on the node by a small python script.
+"""
+
+import json
+import zlib
+import shlex
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+from .transfer import TransferStats
+
+BLOCK_SIZE = 128 * 1024
+READ_SIZE = 1024 * 1024
+MANIFEST_PATH = '/home/starwatts/.starwatts-manifest.json'
+REMOTE_PYTHON = 'python3'
+
+# Modulus of the adler32 checksum, used to roll the weak checksum one byte at a time.
+ADLER_MOD = 65521
+
+# Bytes the checksum is rolled over without a match before going back to aligned blocks for a while.
+MAX_ROLL = 8 * BLOCK_SIZE
+
+# Prints the block signatures of the files given as arguments.
+REMOTE_SIGNATURE = '''
+import hashlib, json, os, sys, zlib
+block_size = int(sys.argv[1])
+out = {}
+for path in sys.argv[2:]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        continue
+    blocks = []
+    full = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            full.update(block)
+            blocks.append([zlib.adler32(block) & 0xffffffff, hashlib.sha1(block).hexdigest()])
+    out[path] = {'size': st.st_size, 'mtime': int(st.st_mtime), 'sha1': full.hexdigest(), 'blocks': blocks}
+json.dump(out, sys.stdout)
+'''
+
+# Rebuilds a file from the blocks already on the node and the literal data that was sent, then checks its hash.
+REMOTE_ASSEMBLE = '''
+import hashlib, json, os, sys
+ops_path, data_path, dest, expected = sys.argv[1:5]
+with open(ops_path) as f:
+    ops = json.load(f)
+tmp = dest + '.assemble'
+full = hashlib.sha1()
+handles = {}
+with open(data_path, 'rb') as data, open(tmp, 'wb') as out:
+    for op in ops:
+        if op[0] == 'c':
+            if op[1] not in handles:
+                try:
+                    handles[op[1]] = open(op[1], 'rb')
+                except OSError:
+                    # Removed since the manifest was loaded
+                    sys.exit(2)
+            src = handles[op[1]]
+            src.seek(op[2])
+            left = op[3]
+        else:
+            src = data
+            left = op[1]
+        while left:
+            block = src.read(min(left, 1 << 20))
+            if not block:
+                sys.exit(2)
+            full.update(block)
+            out.write(block)
+            left -= len(block)
+for handle in handles.values():
+    handle.close()
+if full.hexdigest() != expected:
+    os.remove(tmp)
+    sys.exit(3)
+os.rename(tmp, dest)
+os.remove(ops_path)
+os.remove(data_path)
+st = os.stat(dest)
+json.dump([st.st_size, int(st.st_mtime)], sys.stdout)
+'''
+
+
+def run_script(client, script, args):
+    """
+    Runs a python script on a remote host. The script is sent on stdin so nothing has to be uploaded first.
+
+    :param paramiko.SSHClient client: A connected client.
+    :param string script: Source of the script.
+    :param list args: Arguments given to the script.
+
+    :return: A (exit status, stdout, stderr) tuple.
+    :rtype: tuple
+    """
+    command = "{} - {}".format(REMOTE_PYTHON, " ".join(shlex.quote(str(a)) for a in args))
+    (stdin, stdout, stderr) = client.exec_command(command)
+    stdin.write(script)
+    stdin.channel.shutdown_write()
+    out = stdout.read().decode()
+    err = stderr.read().decode()
+    return stdout.channel.recv_exit_status(), out, err
+
+
+class BlockHasher:
+    """
+    Computes the block signatures of a stream fed chunk by chunk, as well as the hash of the whole stream.
+
+    :param int block_size: Size of the blocks. Default : 128 KB.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.blocks = list()
+        self.size = 0
+        self.full = hashlib.sha1()
+        self._pending = b''
+
+    def update(self, data):
+        self.full.update(data)
+        self.size += len(data)
+        data = self._pending + data
+        end = len(data) - len(data) % self.block_size
+        for pos in range(0, end, self.block_size):
+            self._add(data[pos:pos + self.block_size])
+        self._pending = data[end:]
+
+    def _add(self, block):
+        self.blocks.append([zlib.adler32(block) & 0xffffffff, hashlib.sha1(block).hexdigest()])
+
+    def entry(self):
+        """
+        Finishes the stream.
+
+        :return: The manifest entry of the stream (without mtime).
+        :rtype: dict
+        """
+        if self._pending:
+            self._add(self._pending)
+            self._pending = b''
+        return {'size': self.size, 'sha1': self.full.hexdigest(), 'blocks': self.blocks}
+
+
+class Manifest:
+    """
+    Block signatures of the files held by a node, keyed by absolute path.
+
+    :param int block_size: Size of the blocks. Default : 128 KB.
+    :param dict files: Existing entries. Default : None.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE, files=None):
+        self.block_size = block_size
+        self.files = files if files is not None else dict()
+
+    @classmethod
+    def loads(cls, content):
+        data = json.loads(content)
+        return cls(data['block_size'], data['files'])
+
+    def dumps(self):
+        return json.dumps({'block_size': self.block_size, 'files': self.files})
+
+    def index(self):
+        """
+        Indexes every block of the manifest by content.
+
+        :return:
+            A (weak, strong) tuple. weak maps an adler32 checksum to the set of matching sha1 digests, strong maps a
+            sha1 digest to a (path, offset, length) location.
+        :rtype: tuple
+        """
+        weak = dict()
+        strong = dict()
+        for path, entry in self.files.items():
+            for i, (adler, digest) in enumerate(entry['blocks']):
+                if digest in strong:
+                    continue
+                offset = i * self.block_size
+                strong[digest] = (path, offset, min(self.block_size, entry['size'] - offset))
+                weak.setdefault(adler, set()).add(digest)
+        return weak, strong
+
+
+def compute_delta(reader, block_size, weak_index, strong_index, write_literal, hasher=None, max_roll=MAX_ROLL):
+    """
+    Diffs a stream against indexed blocks. Aligned blocks are looked up by their sha1 first, which is enough for files
+    modified in place. When two aligned blocks in a row are missing, the adler32 checksum is rolled one byte at a time
+    to find blocks that were shifted by an insertion or a deletion. Rolling is slow : after max_roll bytes without a
+    match, the following blocks are only looked up at their aligned position, over a stretch twice as long after every
+    unsuccessful roll, so that unrelated data is rolled over on a logarithmic fraction of its size.
+
+    :param reader: Any object with a read(size) method.
+    :param int block_size: Size of the indexed blocks.
+    :param dict weak_index: adler32 checksum to set of sha1 digests, see Manifest.index.
+    :param dict strong_index: sha1 digest to (path, offset, length), see Manifest.index.
+    :param callable write_literal: Called with every piece of data that has to be sent.
+    :param BlockHasher hasher: Fed with the whole stream if given. Default : None.
+    :param int max_roll: Bytes rolled over without a match before looking up aligned blocks only. Default : 1 MB.
+
+    :return:
+        The list of operations rebuilding the stream : ['c', path, offset, length] copies existing data, ['d', length]
+        reads the next literal bytes.
+    :rtype: list
+    """
+    ops = list()
+
+    def copy(location):
+        path, offset, length = location
+        last = ops[-1] if ops else None
+        if last and last[0] == 'c' and last[1] == path and last[2] + last[3] == offset:
+            last[3] += length
+        else:
+            ops.append(['c', path, offset, length])
+
+    def literal(data):
+        if not data:
+            return
+        write_literal(data)
+        if ops and ops[-1][0] == 'd':
+            ops[-1][1] += len(data)
+        else:
+            ops.append(['d', len(data)])
+
+    def digest(data):
+        return hashlib.sha1(data).hexdigest()
+
+    if not strong_index:
+        # Nothing to match against, the whole stream is literal.
+        for chunk in iter(lambda: reader.read(READ_SIZE), b''):
+            if hasher is not None:
+                hasher.update(chunk)
+            literal(chunk)
+        return ops
+
+    buf = b''
+    pos = 0
+    lit = 0
+    eof = False
+    rolling = False
+    # Bytes rolled over by the current search, bytes left to look up aligned only and the length of the next stretch
+    rolled = skip = 0
+    backoff = max(max_roll, block_size)
+    a = b = 0
+    while True:
+        if not eof and len(buf) - pos < 2 * block_size + 1:
+            chunk = reader.read(READ_SIZE)
+            if chunk:
+                if hasher is not None:
+                    hasher.update(chunk)
+                literal(buf[lit:pos])
+                buf = buf[pos:] + chunk
+                pos = lit = 0
+            else:
+                eof = True
+            continue
+        remaining = len(buf) - pos
+        if remaining == 0:
+            break
+        if not rolling:
+            length = min(block_size, remaining)
+            location = strong_index.get(digest(buf[pos:pos + length]))
+            if location is not None and location[2] == length:
+                literal(buf[lit:pos])
+                copy(location)
+                pos += length
+                lit = pos
+                skip = 0
+                backoff = max(max_roll, block_size)
+                continue
+            if length < block_size:
+                break
+            following = buf[pos + block_size:pos + 2 * block_size]
+            if len(following) == block_size and digest(following) in strong_index or skip > 0:
+                # Modified in place, the next block is where it used to be, or too many misses to roll now.
+                pos += block_size
+                skip = max(0, skip - block_size)
+                continue
+            value = zlib.adler32(buf[pos:pos + block_size])
+            a, b = value & 0xffff, value >> 16
+            rolling = True
+        end = len(buf) - block_size
+        found = False
+        while True:
+            digests = weak_index.get((b << 16) | a)
+            if digests is not None and digest(buf[pos:pos + block_size]) in digests:
+                found = True
+                break
+            if pos >= end or rolled >= max_roll:
+                break
+            out = buf[pos]
+            a = (a - out + buf[pos + block_size]) % ADLER_MOD
+            b = (b - block_size * out + a - 1) % ADLER_MOD
+            pos += 1
+            rolled += 1
+        if found:
+            rolling = False
+            rolled = 0
+            continue
+        if rolled >= max_roll:
+            rolling = False
+            rolled = 0
+            skip = backoff
+            backoff *= 2
+            continue
+        if eof:
+            # The last full window didn't match, everything left is literal.
+            pos = len(buf)
+            break
+    literal(buf[lit:len(buf)])
+    return ops
+
+
+class DeltaTransfer:
+    """
+    Sends files to a node through a TransferEngine, only transferring the blocks the node doesn't already hold. The
+    manifest of the node is read on first use and written back by save_manifest().
+
+    :param starwatts.transfer.TransferEngine engine: Engine connected to the node.
+    :param paramiko.SSHClient client: Client connected to the node, used to run the helper scripts.
+    :param int block_size: Size of the blocks. Default : 128 KB.
+    :param string manifest_path: Location of the manifest on the node. Default : MANIFEST_PATH.
+    """
+
+    def __init__(self, engine, client, block_size=BLOCK_SIZE, manifest_path=MANIFEST_PATH):
+        self.engine = engine
+        self.client = client
+        self.block_size = block_size
+        self.manifest_path = manifest_path
+        self.manifest = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def load_manifest(self, paths=()):
+        """
+        Reads the manifest of the node and drops the entries of files that changed since. Files in paths that exist on
+        the node but aren't in the manifest are signed on the node.
+
+        :param list paths: Destination paths about to be written. Default : ().
+
+        :return: The manifest.
+        :rtype: Manifest
+        """
+        sftp = self.engine.sftp
+        try:
+            with sftp.open(self.manifest_path, 'r') as f:
+                manifest = Manifest.loads(f.read().decode())
+        except (IOError, ValueError, KeyError):
+            manifest = Manifest(self.block_size)
+        if manifest.block_size != self.block_size:
+            manifest = Manifest(self.block_size)
+        for path, entry in list(manifest.files.items()):
+            try:
+                st = sftp.stat(path)
+            except IOError:
+                del manifest.files[path]
+                continue
+            if st.st_size != entry['size'] or int(st.st_mtime) != entry['mtime']:
+                del manifest.files[path]
+        unknown = [p for p in paths if p not in manifest.files]
+        if unknown:
+            status, out, err = run_script(self.client, REMOTE_SIGNATURE, [self.block_size] + unknown)
+            if status == 0:
+                manifest.files.update(json.loads(out))
+            else:
+                logging.warning("Could not sign existing files on the node : {}".format(err))
+        self.manifest = manifest
+        self._index = manifest.index()
+        return manifest
+
+    def save_manifest(self):
+        """
+        Writes the manifest back on the node.
+        """
+        if self.manifest is None:
+            return
+        with self._lock:
+            content = self.manifest.dumps()
+        with self.engine.sftp.open(self.manifest_path, 'w') as f:
+            f.write(content)
+
+    def _send(self, reader, dest_path, stats):
+        """
+        :return: False if the file couldn't be rebuilt because a file it copies from changed or was removed on the node.
+        :raises IOError: If the rebuilding failed otherwise, its temporary files being removed.
+        """
+        with self._lock:
+            weak, strong = self._index
+        ops_path = dest_path + '.ops'
+        data_path = dest_path + '.delta'
+        hasher = BlockHasher(self.block_size)
+        sftp = self.engine.sftp
+        with sftp.open(data_path, 'wb', bufsize=0) as data_file:
+            data_file.set_pipelined(True)
+
+            def write_literal(data):
+                for pos in range(0, len(data), self.engine.chunk_size):
+                    data_file.write(data[pos:pos + self.engine.chunk_size])
+                stats.add(len(data))
+
+            ops = compute_delta(reader, self.block_size, weak, strong, write_literal, hasher)
+        content = json.dumps(ops)
+        with sftp.open(ops_path, 'w') as ops_file:
+            ops_file.write(content)
+        stats.add(len(content))
+        entry = hasher.entry()
+        status, out, err = run_script(self.client, REMOTE_ASSEMBLE, [ops_path, data_path, dest_path, entry['sha1']])
+        if status in (2, 3):
+            # A file copied from was rewritten or removed meanwhile (e.g. by another transfer of put_many) : its blocks
+            # are forgotten and the file has to be sent whole
+            self._forget({op[1] for op in ops if op[0] == 'c'} | {dest_path},
+                         [ops_path, data_path, dest_path + '.assemble'])
+            return False
+        if status != 0:
+            self._forget((), [ops_path, data_path, dest_path + '.assemble'])
+            raise IOError("Rebuilding {} failed with status {} : {}".format(dest_path, status, err.strip()))
+        stats.reuse(sum(op[3] for op in ops if op[0] == 'c'))
+        entry['mtime'] = json.loads(out)[1]
+        with self._lock:
+            self.manifest.files[dest_path] = entry
+        return True
+
+    def _forget(self, paths, leftovers):
+        with self._lock:
+            for path in paths:
+                self.manifest.files.pop(path, None)
+            self._index = self.manifest.index()
+        for path in leftovers:
+            try:
+                self.engine.sftp.remove(path)
+            except IOError:
+                pass
+
+    def put(self, local_path, remote_path, stats=None):
+        """
+        Uploads a local file, only sending the blocks the node doesn't hold. The whole file is uploaded if the blocks
+        changed on the node while it was rebuilt.
+
+        :param string local_path: Path of the local file.
+        :param string remote_path: Absolute path of the destination file.
+        :param TransferStats stats: Statistics to update. Default : None (a new object is created).
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        stats = stats if stats is not None else TransferStats()
+        if self.manifest is None:
+            self.load_manifest([remote_path])
+        with open(local_path, 'rb') as reader:
+            rebuilt = self._send(reader, remote_path, stats)
+        if not rebuilt:
+            stats.add(self.engine.put(local_path, remote_path, resume=False).bytes)
+        stats.file_done()
+        return stats
+
+    def relay(self, source, src_path, dest_path, stats=None):
+        """
+        Streams a file from the host of another engine, only sending the blocks the node doesn't hold. The whole file is
+        streamed if the blocks changed on the node while it was rebuilt.
+
+        :param starwatts.transfer.TransferEngine source: Engine connected to the host holding the file.
+        :param string src_path: Absolute path of the file on the source host.
+        :param string dest_path: Absolute path of the destination file on the node.
+        :param TransferStats stats: Statistics to update. Default : None (a new object is created).
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        stats = stats if stats is not None else TransferStats()
+        if self.manifest is None:
+            self.load_manifest([dest_path])
+        with source.sftp.open(src_path, 'rb') as reader:
+            reader.prefetch(reader.stat().st_size)
+            rebuilt = self._send(reader, dest_path, stats)
+        if not rebuilt:
+            stats.add(self.engine.relay(source, src_path, dest_path, resume=False).bytes)
+        stats.file_done()
+        return stats
+
+    def _run_many(self, func, jobs):
+        self.load_manifest([job[-1] for job in jobs])
+        stats = TransferStats()
+
+        def worker(job):
+            try:
+                func(*job, stats=stats)
+            except (IOError, OSError, paramiko.SSHException) as e:
+                stats.error(job[-1], e)
+
+        with ThreadPoolExecutor(max_workers=self.engine.workers) as executor:
+            list(executor.map(worker, jobs))
+        self.save_manifest()
+        return stats.stop()
+
+    def put_many(self, pairs):
+        """
+        Uploads several local files concurrently. Failures are recorded in the returned statistics.
+
+        :param list pairs: List of (local_path, remote_path) tuples.
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        return self._run_many(self.put, list(pairs))
+
+    def relay_many(self, source, pairs):
+        """
+        Streams several files concurrently from the host of another engine. Failures are recorded in the returned
+        statistics.
+
+        :param starwatts.transfer.TransferEngine source: Engine connected to the host holding the files.
+        :param list pairs: List of (src_path, dest_path) tuples.
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        return self._run_many(self.relay, [(source, src, dest) for src, dest in pairs])
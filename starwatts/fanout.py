@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Distribution of a file to a fleet of CloudApps. Nodes that already received the file serve it to the others, so the
+number of nodes holding it grows geometrically at each round instead of every node pulling from the same host.
+"""
+
+import os
+import time
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+from .sshcache import host_keys
+
+# Host keys of the source and of the nodes, written on every node before the copies
+KNOWN_HOSTS_PATH = '~/.ssh/starwatts_known_hosts'
+
+SCP_OPTIONS = "-q -o BatchMode=yes -o StrictHostKeyChecking=yes -o {}".format(
+    shlex.quote("UserKnownHostsFile=~/.ssh/known_hosts {}".format(KNOWN_HOSTS_PATH)))
+
+# Only with distribute(..., insecure=True)
+INSECURE_SCP_OPTIONS = '-q -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
+
+
+def assign_round(holders, pending, fanout=1):
+    """
+    Pairs the holders of a file with the nodes that still need it. Every holder serves at most fanout nodes during the
+    round.
+
+    :param list holders: Holders of the file, the original source first.
+    :param list pending: Nodes that still need the file.
+    :param int fanout: Number of nodes a holder serves at the same time. Default : 1.
+
+    :return: List of (holder, node) tuples.
+    :rtype: list
+    """
+    pairs = list()
+    queue = list(pending)
+    for _ in range(fanout):
+        for holder in holders:
+            if not queue:
+                return pairs
+            pairs.append((holder, queue.pop(0)))
+    return pairs
+
+
+def known_hosts_lines(apps, src_vm, extra=()):
+    """
+    Lists the host keys the nodes need to check each other : the keys the nodes presented to the SSH connections of
+    their CloudApps, under their private IP, and the key of the source VM found in the known hosts of this machine.
+
+    :param list apps: Connected CloudApps.
+    :param string src_vm: IP or name of the VM holding the file.
+    :param list extra: Other lines in the known_hosts format, e.g : the key of the source VM. Default : ().
+
+    :return: Lines in the known_hosts format.
+    :rtype: list
+    """
+    lines = list(extra)
+    for key_type, key in sorted((host_keys().lookup(src_vm) or dict()).items()):
+        lines.append("{} {} {}".format(src_vm, key_type, key.get_base64()))
+    for app in apps:
+        key = app.ssh_client.get_transport().get_remote_server_key()
+        lines.append("{} {} {}".format(app.instance.private_ip_address, key.get_name(), key.get_base64()))
+    return lines
+
+
+def distribute(apps, src_vm, src_path, src_user='root', dest=None, fanout=1, retries=1, known_hosts=(),
+               insecure=False):
+    """
+    Copies a file from a remote VM (e.g : 'files') to every given CloudApp. At each round, the source and every node
+    that already holds the file send it to another node, so N nodes are served in about log2(N) rounds. Each node pulls
+    the file with scp from its holder over the private network, the orchestration goes through the SSH connections of
+    the CloudApps.
+
+    The nodes check the host keys of the holders : the keys learned by the SSH connections of the CloudApps and the key
+    of the source VM (see known_hosts_lines) are written in ~/.ssh/starwatts_known_hosts on every node first. The source
+    VM must be in the known hosts of this machine or of the nodes, or its key given in known_hosts.
+
+    :param list apps:
+        Connected CloudApps.
+    :param string src_vm:
+        IP or name (as known by the nodes) of the VM holding the file.
+    :param string src_path:
+        Absolute path of the file on the source VM.
+    :param string src_user:
+        User on the source VM and on the nodes. Default : 'root'.
+    :param string dest:
+        Destination directory on the nodes. Default : CloudApp.workdir.
+    :param int fanout:
+        Number of nodes a holder serves at the same time. Default : 1.
+    :param int retries:
+        Number of extra attempts for a node whose copy failed. Default : 1.
+    :param list known_hosts:
+        Other lines in the known_hosts format written on the nodes. Default : ().
+    :param bool insecure:
+        Don't check the host keys at all. Default : False.
+
+    :return: A dict mapping each CloudApp to a (round, seconds) tuple, or to the error message if the copy failed.
+    :rtype: dict
+    """
+    if dest is None:
+        dest = apps[0].workdir if apps else '/home/starwatts/jobs/'
+    dest_path = os.path.join(dest, os.path.basename(src_path))
+    source = (src_vm, src_path)
+    holders = [source]
+    pending = list(apps)
+    attempts = {app: 0 for app in apps}
+    result = dict()
+    start = time.time()
+    options = INSECURE_SCP_OPTIONS if insecure else SCP_OPTIONS
+
+    def run(app, command):
+        try:
+            status, out, err = app.execute(command)
+        except (RuntimeError, IOError, paramiko.SSHException) as e:
+            return app, str(e)
+        return app, err.strip() if status != 0 else None
+
+    def pull(pair):
+        (host, path), app = pair
+        return run(app, "scp {} {} {}".format(options, shlex.quote("{}@{}:{}".format(src_user, host, path)),
+                                              shlex.quote(dest_path)))
+
+    rnd = 0
+    with ThreadPoolExecutor(max_workers=max(1, len(apps))) as executor:
+        if not insecure:
+            lines = ''.join("{}\n".format(line) for line in known_hosts_lines(apps, src_vm, known_hosts))
+            command = "mkdir -p ~/.ssh && printf %s {} > {}".format(shlex.quote(lines), KNOWN_HOSTS_PATH)
+            for app, error in executor.map(lambda app: run(app, command), apps):
+                if error is not None:
+                    print("Writing the known hosts of {} failed : {}".format(app.instance_name, error))
+                    app.errors.append(error)
+                    result[app] = error
+                    pending.remove(app)
+        while pending:
+            rnd += 1
+            pairs = assign_round(holders, pending, fanout)
+            print("Round {} : {} transfer(s), {} holder(s).".format(rnd, len(pairs), len(holders)))
+            for app, error in executor.map(pull, pairs):
+                if error is None:
+                    result[app] = (rnd, time.time() - start)
+                    holders.append((app.instance.private_ip_address, dest_path))
+                    pending.remove(app)
+                    continue
+                attempts[app] += 1
+                print("Copy to {} failed : {}".format(app.instance_name, error))
+                if attempts[app] > retries:
+                    app.errors.append(error)
+                    result[app] = error
+                    pending.remove(app)
+    print("{} node(s) served in {} round(s), {:.2f}s.".format(len(apps), rnd, time.time() - start))
+    return result
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Hedged describe calls : a slow call is duplicated and the first response is used.
+"""
+
+import time
+import select
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .instrument import CallAbandoned, register_internal
+
+register_internal(__name__)
+
+# Idempotent actions that can be sent twice
+HEDGED_PREFIXES = ('Describe',)
+
+
+def hedge_delay(instrumentation, action, percentile=95.0, min_samples=20, min_delay=0.05):
+    """
+    Number of seconds after which a call is duplicated : the percentile of the recent latencies of its action.
+
+    :param starwatts.instrument.ApiInstrumentation instrumentation: Where the latencies are recorded.
+    :param string action: The API action.
+    :param float percentile: The percentile. Default : 95.
+    :param int min_samples: Number of recent latencies needed to hedge the calls of an action. Default : 20.
+    :param float min_delay: Minimum delay, in seconds. Default : 0.05.
+
+    :return: The delay, or None if the action wasn't called enough yet.
+    :rtype: float
+    """
+    if instrumentation.samples(action) < min_samples:
+        return None
+    return max(min_delay, instrumentation.percentile(action, percentile))
+
+
+class _Race:
+    """
+    A hedged call : its duplicate wakes the original call up, waiting for its response, when it answered first.
+    """
+
+    def __init__(self, action):
+        self.action = action
+        self.response = None
+        self.answered = None
+        self.done = threading.Event()
+        self._claimed = False
+        self._lock = threading.Lock()
+        self._wake, self._waker = socket.socketpair()
+
+    def answer(self, response):
+        """
+        Gives the response of the duplicate to the original call, unless it already started to receive its own.
+
+        :return: Whether the response of the duplicate is used.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            self.response = response
+            self.answered = time.time()
+            self._waker.send(b'\0')
+            return True
+
+    def wait(self, sock):
+        """
+        Waits, once the request of the original call is sent, for its response or for the one of the duplicate, at most
+        for the timeout of the socket.
+
+        :return: Whether the duplicate answered first.
+        :rtype: bool
+        :raises socket.timeout: If neither answered in time, retried by boto as the original call would be.
+        """
+        if sock is not None:
+            readable, _, _ = select.select([sock, self._wake], [], [], sock.gettimeout())
+            if not readable:
+                raise socket.timeout("timed out")
+        with self._lock:
+            if self.response is not None:
+                return True
+            self._claimed = True
+            return False
+
+    def close(self):
+        with self._lock:
+            self._claimed = True
+            self._wake.close()
+            self._waker.close()
+
+
+@contextmanager
+def _same(connection):
+    yield connection
+
+
+def hedge(connection, instrumentation, percentile=95.0, min_samples=20, min_delay=0.05, limiter=None, executor=None,
+          pool=None):
+    """
+    Duplicates the describe calls of a connection that didn't answer after the percentile of the recent latencies of
+    their action, and uses the first response. The original call is made in the calling thread, the duplicate in a
+    thread of an executor, attributed to the caller, on a connection of the pool : the original call is abandoned when
+    the duplicate answered first. The duplicates are only sent when the limiter has a token
+    and the pool a connection available right away, so that hedging doesn't add load to a throttled API.
+
+    The instrumentation counts, for each action, the duplicates sent (hedges), the calls answered first by the
+    duplicate (hedge_wins) and the seconds they spared (hedge_saved_seconds) : the response of the abandoned call is
+    still read in a thread of the executor, once it arrives.
+
+    :param boto.ec2.EC2Connection connection: The connection, instrumented.
+    :param starwatts.instrument.ApiInstrumentation instrumentation: Where the latencies are read and recorded.
+    :param float percentile: Percentile of the recent latencies after which a call is duplicated. Default : 95.
+    :param int min_samples: Number of recent latencies needed to hedge the calls of an action. Default : 20.
+    :param float min_delay: Minimum delay before a duplicate, in seconds. Default : 0.05.
+    :param starwatts.throttle.RateLimiter limiter: Limiter the duplicates take a token from. Default : None.
+    :param concurrent.futures.Executor executor: Sends the duplicates. Default : None (a new one with 16 threads).
+    :param starwatts.connections.ConnectionPool pool: Pool of connections the duplicates are sent on. Default : None
+        (the duplicates share the connection).
+
+    :return: The connection.
+    :rtype: boto.ec2.EC2Connection
+    """
+    inner = connection.make_request
+    mexe = connection._mexe
+    executor = executor if executor is not None else ThreadPoolExecutor(max_workers=16)
+    local = threading.local()
+
+    def _mexe(request, sender=None, override_num_retries=None, retry_handler=None):
+        race = getattr(local, 'race', None)
+        if race is None or sender is not None:
+            return mexe(request, sender, override_num_retries, retry_handler)
+
+        def send(http_connection, method, path, body, headers):
+            http_connection.request(method, path, body, headers)
+            try:
+                won = race.wait(http_connection.sock)
+            except socket.timeout:
+                # boto retries on a new HTTP connection
+                http_connection.close()
+                raise
+            if won:
+                # boto drops the HTTP connection of the abandoned call, its response is read in the background
+                executor.submit(drain, http_connection, race.action, race.answered)
+                raise CallAbandoned("Answered first by the duplicate")
+            return http_connection.getresponse()
+        return mexe(request, send, override_num_retries, retry_handler)
+
+    def drain(http_connection, action, answered):
+        # The response of an abandoned call tells the seconds its duplicate spared
+        try:
+            http_connection.getresponse().read()
+        except Exception:
+            return
+        finally:
+            http_connection.close()
+        instrumentation.increment(action, 'hedge_saved_seconds', max(0.0, time.time() - answered))
+
+    def duplicate(race, delay, caller, action, params, path, verb):
+        if race.done.wait(delay):
+            return
+        if limiter is not None and not limiter.try_acquire(action):
+            return
+        try:
+            with (pool.connection(timeout=0) if pool is not None else _same(connection)) as other:
+                instrumentation.increment(action, 'hedges')
+                # boto adds the signature to the parameters, the duplicate has its own copy
+                with instrumentation.attributed(caller):
+                    response = getattr(other, 'unhedged_request', other.make_request)(
+                        action, dict(params) if params else params, path, verb)
+        except TimeoutError:
+            # No connection to spare
+            return
+        except Exception as e:
+            logging.debug("Duplicate of {} failed ({}).".format(action, e))
+            return
+        if response.status < 400:
+            race.answer(response)
+
+    def make_request(action, params=None, path='/', verb='GET'):
+        delay = hedge_delay(instrumentation, action, percentile, min_samples, min_delay) \
+            if action.startswith(HEDGED_PREFIXES) else None
+        if delay is None:
+            return inner(action, params, path, verb)
+        race = _Race(action)
+        executor.submit(duplicate, race, delay, instrumentation.caller(), action, params, path, verb)
+        local.race = race
+        try:
+            return inner(action, dict(params) if params else params, path, verb)
+        except CallAbandoned:
+            instrumentation.increment(action, 'hedge_wins')
+            return race.response
+        finally:
+            local.race = None
+            race.done.set()
+            race.close()
+
+    connection._mexe = _mexe
+    connection.make_request = make_request
+    connection.unhedged_request = inner
+    return connection
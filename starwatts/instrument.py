@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Per action instrumentation of the API calls made through an EC2Connection.
+"""
+
+import re
+import sys
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from .transfer import human_size
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Modules whose frames are never reported as the caller of an API call
+INTERNAL_MODULES = {__name__}
+
+ERROR_CODE = re.compile(br'<Code>([^<]+)</Code>')
+
+
+class CallAbandoned(Exception):
+    """
+    Raised by a wrapper giving up on a call in flight (e.g : a hedged call answered first by its duplicate). The call is
+    recorded without an error.
+    """
+
+
+def register_internal(module):
+    """
+    Excludes the frames of a module from the caller attribution, for the modules wrapping the API calls.
+
+    :param string module: Name of the module.
+    """
+    INTERNAL_MODULES.add(module)
+
+
+def error_code(body):
+    """
+    Extracts the error code of an API error response (e.g : 'RequestLimitExceeded').
+
+    :param bytes body: Body of the response.
+
+    :return: The code, or None if the body doesn't contain one.
+    :rtype: string
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    match = ERROR_CODE.search(body or b'')
+    return match.group(1).decode('utf-8', 'replace') if match else None
+
+
+class ActionStats:
+    """
+    Counters of a single API action.
+
+    :param int window: Number of recent latencies kept for the percentiles.
+    """
+
+    def __init__(self, window=200):
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = dict()
+        self.callers = dict()
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.extra = dict()
+        self.recent = deque(maxlen=window)
+
+    def percentile(self, q):
+        """
+        Latency percentile over the recent calls.
+
+        :param float q: The percentile, between 0 and 100.
+
+        :return: The latency in seconds, None if no call was made.
+        :rtype: float
+        """
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, max(0, int(round(q / 100.0 * len(values) + 0.5)) - 1))]
+
+
+class ApiInstrumentation:
+    """
+    Records, for each API action, the number of calls, a latency histogram, the size of the responses, the retries and
+    the errors. Each call is attributed to the outermost starwatts function on the stack (e.g : quick_instance), or to
+    the calling function outside of boto when the call didn't go through starwatts. Safe to share between threads.
+
+    :param int window: Number of recent latencies kept for each action, used by the percentiles. Default : 200.
+    """
+
+    def __init__(self, window=200):
+        self.window = window
+        self.started = time.time()
+        self._actions = dict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stats(self, action):
+        stats = self._actions.get(action)
+        if stats is None:
+            stats = self._actions[action] = ActionStats(self.window)
+        return stats
+
+    def caller(self):
+        """
+        Name of the function an API call made now is attributed to.
+
+        :rtype: string
+        """
+        forced = getattr(self._local, 'caller', None)
+        if forced is not None:
+            return forced
+        outside = None
+        library = None
+        frame = sys._getframe(1)
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if module not in INTERNAL_MODULES and not module.startswith('boto'):
+                if module == 'starwatts' or module.startswith('starwatts.'):
+                    library = frame.f_code.co_name
+                elif outside is None and library is None:
+                    outside = frame.f_code.co_name
+            frame = frame.f_back
+        return library or outside or 'unknown'
+
+    @contextmanager
+    def attributed(self, caller):
+        """
+        Attributes the API calls made by the current thread to a given caller, e.g : in a thread working for another
+        one.
+
+        :param string caller: Name of the caller.
+        """
+        previous = getattr(self._local, 'caller', None)
+        self._local.caller = caller
+        try:
+            yield
+        finally:
+            self._local.caller = previous
+
+    def record(self, action, seconds, nbytes=0, error=None, caller=None):
+        """
+        Records a call.
+
+        :param string action: The API action (e.g : 'DescribeInstances').
+        :param float seconds: Duration of the call.
+        :param int nbytes: Size of the response. Default : 0.
+        :param string error: Error code if the call failed. Default : None.
+        :param string caller: Function the call is attributed to. Default : None ('unknown').
+        """
+        caller = caller or 'unknown'
+        with self._lock:
+            stats = self._stats(action)
+            stats.count += 1
+            stats.seconds += seconds
+            stats.bytes += nbytes
+            stats.recent.append(seconds)
+            stats.callers[caller] = stats.callers.get(caller, 0) + 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[i] += 1
+                    break
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+    def record_retry(self, action):
+        """
+        Records that a call is about to be retried.
+
+        :param string action: The API action.
+        """
+        with self._lock:
+            self._stats(action).retries += 1
+
+    def increment(self, action, name, value=1):
+        """
+        Increments an additional counter of an action (e.g : the time spent waiting for the rate limiter).
+
+        :param string action: The API action.
+        :param string name: Name of the counter.
+        :param value: Value to add. Default : 1.
+        """
+        with self._lock:
+            stats = self._stats(action)
+            stats.extra[name] = stats.extra.get(name, 0) + value
+
+    def percentile(self, action, q):
+        """
+        Latency percentile of an action over its recent calls.
+
+        :param string action: The API action.
+        :param float q: The percentile, between 0 and 100.
+
+        :return: The latency in seconds, None if the action wasn't called yet.
+        :rtype: float
+        """
+        with self._lock:
+            stats = self._actions.get(action)
+            return stats.percentile(q) if stats is not None else None
+
+    def samples(self, action):
+        """
+        Number of recent latencies kept for an action.
+
+        :param string action: The API action.
+
+        :rtype: int
+        """
+        with self._lock:
+            stats = self._actions.get(action)
+            return len(stats.recent) if stats is not None else 0
+
+    def reset(self):
+        """
+        Forgets every recorded call.
+        """
+        with self._lock:
+            self._actions = dict()
+            self.started = time.time()
+
+    def snapshot(self):
+        """
+        Copy of the counters.
+
+        :return: Dict of action : counters. The histogram buckets are cumulative, as in Prometheus.
+        :rtype: dict
+        """
+        with self._lock:
+            snap = dict()
+            for action, stats in self._actions.items():
+                cumulative = list()
+                total = 0
+                for bound, n in zip(LATENCY_BUCKETS, stats.buckets):
+                    total += n
+                    cumulative.append((bound, total))
+                snap[action] = dict(
+                    count=stats.count,
+                    seconds=stats.seconds,
+                    bytes=stats.bytes,
+                    retries=stats.retries,
+                    errors=dict(stats.errors),
+                    callers=dict(stats.callers),
+                    buckets=cumulative,
+                    p50=stats.percentile(50),
+                    p99=stats.percentile(99),
+                    extra=dict(stats.extra),
+                )
+            return snap
+
+    def to_json(self):
+        """
+        Dumps the counters as JSON.
+
+        :rtype: string
+        """
+        snap = self.snapshot()
+        for stats in snap.values():
+            stats['buckets'] = {str(bound): n for bound, n in stats['buckets']}
+        return json.dumps(dict(started=self.started, actions=snap), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='starwatts_api'):
+        """
+        Dumps the counters in the Prometheus text exposition format.
+
+        :param string prefix: Prefix of the metric names. Default : 'starwatts_api'.
+
+        :rtype: string
+        """
+        snap = self.snapshot()
+        lines = list()
+
+        def header(name, kind, text):
+            lines.append("# HELP {}_{} {}".format(prefix, name, text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+
+        header('calls_total', 'counter', "API calls by action and caller.")
+        for action, stats in sorted(snap.items()):
+            for caller, n in sorted(stats['callers'].items()):
+                lines.append('{}_calls_total{{action="{}",caller="{}"}} {}'.format(prefix, action, caller, n))
+        header('errors_total', 'counter', "Failed API calls by action and error code.")
+        for action, stats in sorted(snap.items()):
+            for code, n in sorted(stats['errors'].items()):
+                lines.append('{}_errors_total{{action="{}",code="{}"}} {}'.format(prefix, action, code, n))
+        header('retries_total', 'counter', "Retried API calls by action.")
+        for action, stats in sorted(snap.items()):
+            lines.append('{}_retries_total{{action="{}"}} {}'.format(prefix, action, stats['retries']))
+        header('response_bytes_total', 'counter', "Size of the API responses by action.")
+        for action, stats in sorted(snap.items()):
+            lines.append('{}_response_bytes_total{{action="{}"}} {}'.format(prefix, action, stats['bytes']))
+        for name in sorted({name for stats in snap.values() for name in stats['extra']}):
+            header(name + '_total', 'counter', "{} by action.".format(name.replace('_', ' ').capitalize()))
+            for action, stats in sorted(snap.items()):
+                if name in stats['extra']:
+                    lines.append('{}_{}_total{{action="{}"}} {}'.format(prefix, name, action, stats['extra'][name]))
+        header('latency_seconds', 'histogram', "Latency of the API calls by action.")
+        for action, stats in sorted(snap.items()):
+            for bound, n in stats['buckets']:
+                lines.append('{}_latency_seconds_bucket{{action="{}",le="{}"}} {}'.format(prefix, action, bound, n))
+            lines.append('{}_latency_seconds_bucket{{action="{}",le="+Inf"}} {}'.format(prefix, action, stats['count']))
+            lines.append('{}_latency_seconds_sum{{action="{}"}} {}'.format(prefix, action, stats['seconds']))
+            lines.append('{}_latency_seconds_count{{action="{}"}} {}'.format(prefix, action, stats['count']))
+        return "\n".join(lines) + "\n"
+
+    def __str__(self):
+        lines = list()
+        for action, stats in sorted(self.snapshot().items()):
+            lines.append("{} : {} call(s), {} error(s), {} retry(ies), {}, p50 {:.3f}s, p99 {:.3f}s".format(
+                action, stats['count'], sum(stats['errors'].values()), stats['retries'], human_size(stats['bytes']),
+                stats['p50'], stats['p99'],
+            ))
+            for caller, n in sorted(stats['callers'].items(), key=lambda i: -i[1]):
+                lines.append("    {} : {}".format(caller, n))
+        return "\n".join(lines) if lines else "No API call recorded."
+
+
+def instrument(connection, instrumentation):
+    """
+    Records every API call made through a connection. The response body is read as soon as the response arrives (boto
+    caches it for the parsers), so the recorded latency includes its download.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+    :param ApiInstrumentation instrumentation: Where the calls are recorded.
+
+    :return: The connection.
+    :rtype: boto.ec2.EC2Connection
+    """
+    inner = connection.make_request
+
+    def make_request(action, params=None, path='/', verb='GET'):
+        caller = instrumentation.caller()
+        start = time.time()
+        try:
+            response = inner(action, params, path, verb)
+            body = response.read()
+        except CallAbandoned:
+            instrumentation.record(action, time.time() - start, caller=caller)
+            raise
+        except Exception as e:
+            # Server errors (5xx) are raised by boto once its own retries are exhausted
+            error = getattr(e, 'error_code', None) or type(e).__name__
+            instrumentation.record(action, time.time() - start, error=error, caller=caller)
+            raise
+        error = None
+        if response.status >= 400:
+            error = error_code(body) or str(response.status)
+        instrumentation.record(action, time.time() - start, len(body or b''), error, caller)
+        return response
+
+    connection.make_request = make_request
+    connection.instrumentation = instrumentation
+    return connection
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Handles on the jobs started in the background on the nodes, with cheap status checks and incremental log tails.
+"""
+
+import os
+import shlex
+from collections import namedtuple
+
+JobStatus = namedtuple('JobStatus', ['pid', 'running', 'exit_status', 'log_size'])
+
+
+def start_command(script):
+    """
+    Builds the command starting a script in the background. The output of the script goes to a log file next to it, its
+    PID and exit status to a .pid and a .status file (e.g : /home/starwatts/jobs/project1.log, .pid and .status for
+    /home/starwatts/jobs/project1.sh). The command prints the PID.
+
+    :param string script: Full path of the script.
+
+    :return: The command.
+    :rtype: string
+    """
+    log_path, pid_path, status_path = job_paths(script)
+    inner = "{}; echo $? > {}".format(shlex.quote(script), shlex.quote(status_path))
+    return "rm -f {status}; nohup sh -c {inner} > {log} 2>&1 < /dev/null & echo $! > {pid}; cat {pid}".format(
+        status=shlex.quote(status_path), inner=shlex.quote(inner), log=shlex.quote(log_path),
+        pid=shlex.quote(pid_path),
+    )
+
+
+def job_paths(script):
+    """
+    Paths of the files written by a job started with start_command().
+
+    :param string script: Full path of the script.
+
+    :return: A (log, pid, status) tuple of paths.
+    :rtype: tuple
+    """
+    base = os.path.splitext(script)[0]
+    return base + '.log', base + '.pid', base + '.status'
+
+
+class Job:
+    """
+    A job running in the background on a node. Every check is a single small command sent through the persistent
+    shell session of the node : status() reports whether the process is alive and its exit status once it ended, and
+    tail() only receives the bytes appended to the log since the previous call.
+
+    :param starwatts.session.ShellSession session: Shell session on the node.
+    :param int pid: PID of the job.
+    :param string script: Full path of the script the job runs.
+    :param string name: Name of the job in the reports. Default : the name of the script.
+    """
+
+    def __init__(self, session, pid, script, name=None):
+        self.session = session
+        self.pid = pid
+        self.script = script
+        self.name = name if name is not None else os.path.basename(script)
+        self.log_path, self.pid_path, self.status_path = job_paths(script)
+        self.offset = 0
+        self.last_status = None
+
+    def __str__(self):
+        status = self.last_status
+        if status is None:
+            state = "unknown"
+        elif status.running:
+            state = "running"
+        else:
+            state = "exited ({})".format("?" if status.exit_status is None else status.exit_status)
+        return "{} (pid {}) : {}, {} byte(s) of log read".format(self.name, self.pid, state, self.offset)
+
+    def poll_command(self, tail=False):
+        """
+        Builds the command reporting the status of the job, followed by the new bytes of the log if tail is set.
+
+        :param bool tail: Appends the bytes of the log after the current offset. Default : False.
+
+        :return: The command.
+        :rtype: string
+        """
+        lines = [
+            "_sw_s=$(cat {} 2>/dev/null)".format(shlex.quote(self.status_path)),
+            # The status file is written when the job ends, kill -0 alone would see a zombie as running.
+            "if [ -z \"$_sw_s\" ] && kill -0 {} 2>/dev/null; then _sw_r=1; else _sw_r=0; fi".format(self.pid),
+            "_sw_n=$(stat -c %s {} 2>/dev/null || echo 0)".format(shlex.quote(self.log_path)),
+            # A log smaller than the offset was truncated or replaced, read it from the start.
+            "_sw_o={}; [ \"$_sw_n\" -ge \"$_sw_o\" ] || _sw_o=0".format(self.offset if tail else 0),
+            "printf '%s %s %s %s\\n' \"$_sw_r\" \"${_sw_s:--}\" \"$_sw_n\" \"$_sw_o\"",
+        ]
+        if tail:
+            lines.append("tail -c +$((_sw_o + 1)) {} 2>/dev/null | head -c $((_sw_n - _sw_o))".format(
+                shlex.quote(self.log_path)))
+        return "\n".join(lines)
+
+    def parse(self, output, tail=False):
+        """
+        Reads the output of the command built by poll_command() and moves the log offset.
+
+        :param string output: Standard output of the command.
+        :param bool tail: Whether the command included the log. Default : False.
+
+        :return: A (JobStatus, new log data) tuple.
+        :rtype: tuple
+        """
+        header, _, data = output.partition('\n')
+        running, exit_status, size, _ = header.split(' ')
+        status = JobStatus(self.pid, running == '1', None if exit_status == '-' else int(exit_status), int(size))
+        self.last_status = status
+        if tail:
+            self.offset = status.log_size
+            return status, data
+        return status, ''
+
+    def status(self, timeout=None):
+        """
+        Checks whether the job is still running.
+
+        :param int timeout: Number of seconds allowed for the check. Default : None.
+
+        :return: The status of the job. exit_status is None while it runs (or if the job was killed).
+        :rtype: JobStatus
+        """
+        return self.parse(self.session.run(self.poll_command(), timeout=timeout).stdout)[0]
+
+    def tail(self, timeout=None):
+        """
+        Returns the part of the log written since the previous call.
+
+        :param int timeout: Number of seconds allowed for the check. Default : None.
+
+        :return: The new log data.
+        :rtype: string
+        """
+        return self.parse(self.session.run(self.poll_command(True), timeout=timeout).stdout, True)[1]
+
+
+def poll_jobs(jobs, tail=False, timeout=None):
+    """
+    Checks many jobs at once. The commands of every job are sent to their sessions before any result is read, so the
+    checks of all the nodes are in flight at the same time and cost about one round trip in total.
+
+    :param list jobs: The jobs to check.
+    :param bool tail: Also returns the new bytes of the logs. Default : False.
+    :param int timeout: Number of seconds allowed for each check. Default : None.
+
+    :return: List of (JobStatus, new log data) tuples, in the same order as the jobs.
+    :rtype: list
+    """
+    sessions = list()
+    groups = dict()
+    for job in jobs:
+        if id(job.session) not in groups:
+            sessions.append(job.session)
+            groups[id(job.session)] = list()
+        groups[id(job.session)].append(job)
+        job.session.submit(job.poll_command(tail))
+    polled = dict()
+    for session in sessions:
+        group = groups[id(session)]
+        for job, result in zip(group, session.results(timeout)[-len(group):]):
+            polled[id(job)] = job.parse(result.stdout, tail)
+    return [polled[id(job)] for job in jobs]
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from .connection import connection_set_private, get_instances_by_tags
-from .connection import keypair_exists, security_group_exists, quick_instance
+from .connection import connection_set_private, get_instances_by_tags, get_instances_by_query
+from .connection import keypair_exists, security_group_exists, quick_instance, get_image_catalog
 from .general import wait_for
 from .instance import get_all_attached_volumes, get_all_security_groups, get_all_security_groups_ids
 from .instance import get_single_security_group, instance_set_private, lower_tags, stop_and_wait, terminate_and_clean
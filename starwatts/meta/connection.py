@@ -5,6 +5,10 @@ import logging
 
 from boto.exception import EC2ResponseError
 
+from ..catalog import ImageCatalog
+from ..query import Query
+from ..script import render_user_data
+
 
 def security_group_exists(self, sg_id=None, name=None):
     """
@@ -38,7 +42,7 @@ def keypair_exists(self, name):
 
 def quick_instance(self, name, image, instance_type, env_tag='dev', zone_tag='starwatts', os_tag='debian', sg_id=None,
                    private=True, extra_sg_ids=None, extra_tags=None, terminate_on_shutdown=False,
-                   debug=False):
+                   debug=False, user_data_script=None):
     """
     Quickly create a new instance with Starwatts standards (tags/security group/keypair conventions).
 
@@ -83,6 +87,9 @@ def quick_instance(self, name, image, instance_type, env_tag='dev', zone_tag='st
         Defines whether or not to terminate the machine when it stops. Default : False.
     :param bool debug:
         Defines if the function should be verbose or not about the operation it does. Default : False.
+    :param user_data_script:
+        Steps the instance runs by itself at boot through cloud-init, either a starwatts.script.RemoteScript or a
+        string of shell commands. They are composed with the private_only section. Default : None.
 
     :return: The created boto.ec2.instance.Instance
     :rtype: boto.ec2.instance.Instance
@@ -141,7 +148,7 @@ def quick_instance(self, name, image, instance_type, env_tag='dev', zone_tag='st
         sg_ids.extend(extra_sg_ids)
     logging.debug("Security Groups : {}".format(sg_ids))
 
-    user_data = "-----BEGIN OUTSCALE SECTION-----\nprivate_only=true\n-----END OUTSCALE SECTION-----" if private else ""
+    user_data = render_user_data(user_data_script, private=private)
     logging.debug("Creating keypair.")
     kp = self.create_key_pair(key_name=name)
     fp = os.path.join(os.path.expanduser('~/.ssh'), '%s.pem' % kp.name)
@@ -186,3 +193,44 @@ def get_instances_by_tags(self, tags):
     :rtype: list
     """
     return self.get_only_instances(filters={'tag:{}'.format(key): val for key, val in tags.items()})
+
+
+def get_instances_by_query(self, query):
+    """
+    Get all instances matching a query, such as "env = prod and not name ^= test" (see starwatts.query). The
+    conditions the API can evaluate are sent as filters, the others are evaluated on the instances returned.
+
+    :param boto.ec2.EC2Connection self:
+        Current connection.
+    :param string query:
+        The query.
+
+    :return: List of EC2Object Instance
+    :rtype: list
+    :raises ValueError: If the query is invalid.
+    """
+    query = Query(query)
+    if query.empty:
+        return list()
+    return query.filter(self.get_only_instances(filters=query.filters or None))
+
+
+def get_image_catalog(self, ttl=300):
+    """
+    Get the image catalog of this connection, created on first use. The catalog caches the images by name, see
+    starwatts.catalog.ImageCatalog.
+
+    :param boto.ec2.EC2Connection self:
+        Current connection.
+    :param int ttl:
+        Number of seconds before the catalog is listed again. Default : 300.
+
+    :return: The image catalog of the connection.
+    :rtype: starwatts.catalog.ImageCatalog
+    """
+    catalog = getattr(self, '_image_catalog', None)
+    if catalog is None:
+        catalog = ImageCatalog(self, ttl=ttl)
+        self._image_catalog = catalog
+    catalog.ttl = ttl
+    return catalog
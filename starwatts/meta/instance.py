@@ -2,6 +2,8 @@
 
 from utils import query_yes_no
 
+from ..batch import current_batch
+
 
 def get_single_security_group(self):
     """
@@ -13,6 +15,9 @@ def get_single_security_group(self):
     :return: A single security group applied to this instance.
     :rtype: boto.ec2.securitygroup.SecurityGroup
     """
+    batch = current_batch(self.connection)
+    if batch is not None:
+        return next(iter(batch.security_groups(self.id, self.connection)), None)
     for sg in self.connection.get_all_security_groups():
         for inst in sg.instances():
             if inst.id == self.id:
@@ -29,6 +34,9 @@ def get_all_security_groups(self):
     :return: list of boto.ec2.securitygroup.SecurityGroup
     :rtype: list
     """
+    batch = current_batch(self.connection)
+    if batch is not None:
+        return batch.security_groups(self.id, self.connection)
     sgs = list()
     for sg in self.connection.get_all_security_groups():
         for inst in sg.instances():
@@ -47,6 +55,9 @@ def get_all_security_groups_ids(self):
     :return: list of SecurityGroup.id (string)
     :rtype: list
     """
+    batch = current_batch(self.connection)
+    if batch is not None:
+        return [sg.id for sg in batch.security_groups(self.id, self.connection)]
     sgs = list()
     for sg in self.connection.get_all_security_groups():
         for inst in sg.instances():
@@ -65,6 +76,9 @@ def get_all_attached_volumes(self):
     :return: List of attached boto.ec2.volume.Volume
     :rtype: list
     """
+    batch = current_batch(self.connection)
+    if batch is not None:
+        return batch.attached_volumes(self.id, self.connection)
     return [v for v in self.connection.get_all_volumes() if v.attach_data.instance_id == self.id]
 
 
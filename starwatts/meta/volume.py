@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from ..batch import current_batch
+
 
 def get_attached_instance(self):
     """
@@ -13,6 +15,9 @@ def get_attached_instance(self):
     :rtype: boto.ec2.instance.Instance
     """
     if self.attachment_state() == 'attached':
+        batch = current_batch(self.connection)
+        if batch is not None:
+            return batch.instance(self.attach_data.instance_id, self.connection)
         return self.connection.get_only_instances(self.attach_data.instance_id)[0]
     else:
         print("{} volume isn't attached to an instance".format(self))
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Warm pool of pre-launched instances, claimed by CloudApps instead of booting new VMs.
+"""
+
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from boto.exception import EC2ResponseError
+
+POOL_TAG = 'pool'
+
+
+class WarmPool:
+    """
+    Keeps a number of pre-launched and pre-tagged instances for each (AMI, instance type) couple. A claimed instance is
+    renamed and retagged for its new owner, and the pool is replenished in the background. Pool instances are
+    recognized by their 'pool' tag, so a pool picks up the instances left by a previous run.
+
+    :param boto.ec2.EC2Connection connection:
+        The connection used to launch the instances.
+    :param int size:
+        Number of instances kept for each (AMI, instance type). Default : 2.
+    :param string state:
+        State in which the instances wait, 'stopped' (cheaper) or 'running' (faster). Default : 'stopped'.
+    :param string sg_id:
+        Security group applied to the pool instances. Default : 'sg-9b5adf25'.
+    :param bool terminate_on_shutdown:
+        Defines whether or not to terminate the instances when they shutdown. Default : True.
+    :param int workers:
+        Number of instances launched at the same time in the background. Default : 4.
+    """
+
+    def __init__(self, connection, size=2, state='stopped', sg_id='sg-9b5adf25', terminate_on_shutdown=True,
+                 workers=4):
+        if state not in ('stopped', 'running'):
+            raise ValueError("state must be 'stopped' or 'running', not {}".format(state))
+        self.connection = connection
+        self.size = size
+        self.state = state
+        self.sg_id = sg_id
+        self.terminate_on_shutdown = terminate_on_shutdown
+        self.sizes = dict()
+        self.hits = 0
+        self.misses = 0
+        self.launched = 0
+        self._available = dict()
+        self._launching = dict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    @staticmethod
+    def key(ami_id, instance_type):
+        """
+        Value of the pool tag for an (AMI, instance type) couple.
+
+        :rtype: string
+        """
+        return "{}/{}".format(ami_id, instance_type)
+
+    def configure(self, ami_id, instance_type, size):
+        """
+        Sets the number of instances kept for an (AMI, instance type) couple.
+
+        :param string ami_id: ID of the AMI.
+        :param string instance_type: The type of the instances.
+        :param int size: Number of instances to keep.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: WarmPool
+        """
+        self.sizes[self.key(ami_id, instance_type)] = size
+        return self
+
+    def discover(self, ami_id, instance_type):
+        """
+        Loads the pool instances already present on the account for an (AMI, instance type) couple.
+
+        :param string ami_id: ID of the AMI.
+        :param string instance_type: The type of the instances.
+
+        :return: The number of available instances.
+        :rtype: int
+        """
+        key = self.key(ami_id, instance_type)
+        instances = self.connection.get_only_instances(filters={
+            'tag:{}'.format(POOL_TAG): key,
+            'instance-state-name': ['pending', 'running', 'stopping', 'stopped'],
+        })
+        with self._lock:
+            self._available[key] = instances
+            return len(instances)
+
+    def available(self, ami_id, instance_type):
+        """
+        Number of instances ready to be claimed for an (AMI, instance type) couple.
+
+        :rtype: int
+        """
+        return len(self._available.get(self.key(ami_id, instance_type), []))
+
+    def _launch(self, ami_id, instance_type, key):
+        name = "pool-{}".format(uuid.uuid4().hex[:12])
+        inst = None
+        try:
+            inst = self.connection.quick_instance(
+                name=name, image=ami_id, instance_type=instance_type, sg_id=self.sg_id,
+                extra_tags={POOL_TAG: key}, terminate_on_shutdown=self.terminate_on_shutdown,
+            )
+            if inst is None:
+                raise RuntimeError("quick_instance refused to create {}".format(name))
+            inst.wait_for('running')
+            if self.state == 'stopped':
+                inst.stop_and_wait()
+        except (EC2ResponseError, RuntimeError, TimeoutError) as e:
+            logging.error("Could not launch pool instance {} for {} : {}".format(name, key, e))
+            inst = None
+        finally:
+            # Even on an unexpected error, otherwise the pool would never launch this instance again
+            with self._lock:
+                self._launching[key] -= 1
+                if inst is not None:
+                    self.launched += 1
+                    self._available.setdefault(key, []).append(inst)
+        return inst
+
+    def replenish(self, ami_id, instance_type, wait=False):
+        """
+        Launches the instances missing for an (AMI, instance type) couple.
+
+        :param string ami_id: ID of the AMI.
+        :param string instance_type: The type of the instances.
+        :param bool wait: Waits for the instances to be ready instead of launching them in the background.
+
+        :return: The number of instances launched.
+        :rtype: int
+        """
+        key = self.key(ami_id, instance_type)
+        size = self.sizes.get(key, self.size)
+        with self._lock:
+            missing = size - len(self._available.get(key, [])) - self._launching.get(key, 0)
+            if missing <= 0:
+                return 0
+            self._launching[key] = self._launching.get(key, 0) + missing
+        futures = [self._executor.submit(self._launch, ami_id, instance_type, key) for _ in range(missing)]
+        if wait:
+            for future in futures:
+                future.result()
+        return missing
+
+    def fill(self, ami_id, instance_type):
+        """
+        Picks up the existing pool instances and launches the missing ones, waiting until they are ready.
+
+        :param string ami_id: ID of the AMI.
+        :param string instance_type: The type of the instances.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: WarmPool
+        """
+        self.discover(ami_id, instance_type)
+        self.replenish(ami_id, instance_type, wait=True)
+        return self
+
+    def claim(self, ami_id, instance_type, name, tags=None):
+        """
+        Takes an instance from the pool, renames and retags it and makes sure it is running. The pool is replenished in
+        the background.
+
+        :param string ami_id: ID of the AMI.
+        :param string instance_type: The type of the instance.
+        :param string name: New name tag of the instance.
+        :param dict tags: Extra tags to apply to the instance. Default : None.
+
+        :return: The claimed instance, or None if the pool was empty.
+        :rtype: boto.ec2.instance.Instance
+        """
+        key = self.key(ami_id, instance_type)
+        with self._lock:
+            instances = self._available.get(key, [])
+            inst = instances.pop(0) if instances else None
+            if inst is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.replenish(ami_id, instance_type)
+        if inst is None:
+            return None
+        new_tags = dict(tags or {}, name=name)
+        inst.remove_tags({POOL_TAG: None})
+        inst.add_tags(new_tags)
+        inst.update()
+        if inst.state in ('stopping', 'stopped'):
+            if inst.state == 'stopping':
+                inst.wait_for('stopped')
+            inst.start()
+        inst.wait_for('running')
+        return inst
+
+    def drain(self):
+        """
+        Terminates every available instance of the pool.
+
+        :return: The number of terminated instances.
+        :rtype: int
+        """
+        with self._lock:
+            instances = [inst for insts in self._available.values() for inst in insts]
+            self._available = dict()
+        for inst in instances:
+            inst.terminate()
+        return len(instances)
+
+    def __str__(self):
+        return "WarmPool : {} available, {} hit(s), {} miss(es), {} launched".format(
+            sum(len(insts) for insts in self._available.values()), self.hits, self.misses, self.launched
+        )
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Active readiness probe for the SSH daemon of a freshly booted VM.
+"""
+
+import time
+import socket
+
+import paramiko
+
+
+def read_banner(sock, timeout=3.0):
+    """
+    Reads the identification line an SSH server sends upon connection.
+
+    :param sock: A connected socket or paramiko.Channel.
+    :param float timeout: Number of seconds to wait for the banner. Default : 3.
+
+    :return: The banner (e.g : 'SSH-2.0-OpenSSH_6.7p1 Debian-5') or None if none was received or the connection failed.
+    :rtype: string
+    """
+    sock.settimeout(timeout)
+    data = b''
+    try:
+        while b'\n' not in data and len(data) < 256:
+            chunk = sock.recv(256)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    except OSError:
+        # Reset by a daemon that is still starting
+        return None
+    line = data.split(b'\n')[0].strip().decode('utf-8', 'replace')
+    return line if line.startswith('SSH-') else None
+
+
+def probe_ssh(host, port=22, timeout=3.0, transport=None):
+    """
+    Makes a single attempt at reaching an SSH server and reading its banner.
+
+    :param string host: IP or hostname of the server.
+    :param int port: Port of the server. Default : 22.
+    :param float timeout: Number of seconds allowed for the connection and the banner. Default : 3.
+    :param paramiko.Transport transport:
+        Transport to a bastion. If set, the connection is opened from the bastion through a direct-tcpip channel.
+        Default : None.
+
+    :return: The banner or None if the server isn't ready.
+    :rtype: string
+    """
+    try:
+        if transport is not None:
+            sock = transport.open_channel('direct-tcpip', (host, port), ('127.0.0.1', 0), timeout=timeout)
+        else:
+            sock = socket.create_connection((host, port), timeout=timeout)
+    except (socket.error, paramiko.SSHException):
+        return None
+    try:
+        return read_banner(sock, timeout)
+    finally:
+        sock.close()
+
+
+def wait_for_ssh(host, port=22, timeout=300, delay=0.1, max_delay=2.0, transport=None):
+    """
+    Probes an SSH server until it answers, waiting a little longer after each failed attempt.
+
+    :param string host: IP or hostname of the server.
+    :param int port: Port of the server. Default : 22.
+    :param int timeout: Number of seconds before the function throws an exception. Default : 300.
+    :param float delay: Number of seconds to wait after the first failed attempt, doubled after each one. Default : 0.1.
+    :param float max_delay: Maximum number of seconds between two attempts. Default : 2.
+    :param paramiko.Transport transport: Transport to a bastion to probe from. Default : None.
+
+    :raises TimeoutError: If the server didn't answer in time.
+    :return: A (banner, seconds waited, number of attempts) tuple.
+    :rtype: tuple
+    """
+    start = time.time()
+    limit = start + timeout
+    attempts = 0
+    while True:
+        attempts += 1
+        banner = probe_ssh(host, port, timeout=min(3.0, max(0.1, limit - time.time())), transport=transport)
+        if banner is not None:
+            return banner, time.time() - start, attempts
+        if time.time() + delay > limit:
+            raise TimeoutError("SSH on {}:{} didn't answer after {} attempt(s).".format(host, port, attempts))
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
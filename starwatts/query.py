@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+Small query language on the instances, planned into the filters of the describe call and a client-side predicate.
+
+Examples : ``env = prod and type in (m1.xlarge, m1.large)``, ``name ^= web and not state = stopped``,
+``missing privacy or os ~ 'centos[67]'``.
+
+* ``state`` and ``type`` are the state and the type of the instances, any other field is a tag (``tag:state`` for a
+  tag named state),
+* operators : ``=``, ``!=``, ``in (a, b)``, ``^=`` (prefix), ``~`` (regex search), ``has tag`` and ``missing tag``,
+* ``and``, ``or``, ``not`` and parentheses, ``and`` binding tighter than ``or``,
+* values are words or quoted strings. A missing tag is None : it matches ``!=`` but none of the other operators.
+"""
+
+import re
+from collections import namedtuple
+
+from .records import describe_instances
+
+Compare = namedtuple('Compare', ['field', 'op', 'values'])
+Has = namedtuple('Has', ['field'])
+And = namedtuple('And', ['items'])
+Or = namedtuple('Or', ['items'])
+Not = namedtuple('Not', ['item'])
+
+KEYWORDS = {'and', 'or', 'not', 'in', 'has', 'missing'}
+
+# Fields that aren't tags, with their attribute and the name of their describe filter
+ATTRIBUTES = {
+    'state': ('state', 'instance-state-name'),
+    'type': ('instance_type', 'instance-type'),
+}
+
+TOKEN = re.compile(r"""\s*(?:(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|(?P<op>!=|\^=|=|~|\(|\)|,)|"""
+                   r"""(?P<word>[^\s=!~^(),'"]+))""")
+
+
+def tokenize(text):
+    """
+    :param string text: A query.
+
+    :return: The (kind, value, position) of the tokens, kind being string, op, word or keyword.
+    :rtype: list
+    :raises ValueError: On a character that can't start a token.
+    """
+    tokens = list()
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            position += len(text[position:]) - len(text[position:].lstrip())
+            raise ValueError("Unexpected character at {} in query : {}".format(position, text))
+        kind = match.lastgroup
+        value = match.group(kind)
+        start = match.start(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'word' and value.lower() in KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value, start))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def error(self, expected):
+        if self.position < len(self.tokens):
+            found = "'{}' at {}".format(*self.tokens[self.position][1:])
+        else:
+            found = "the end"
+        return ValueError("Expected {}, found {} in query : {}".format(expected, found, self.text))
+
+    def peek(self, kind, value=None):
+        if self.position < len(self.tokens):
+            token = self.tokens[self.position]
+            return token[0] == kind and (value is None or token[1] == value)
+        return False
+
+    def accept(self, kind, value=None):
+        if self.peek(kind, value):
+            self.position += 1
+            return self.tokens[self.position - 1][1]
+        return None
+
+    def expect(self, kind, value=None, expected=None):
+        token = self.accept(kind, value)
+        if token is None:
+            raise self.error(expected or value or kind)
+        return token
+
+    def parse(self):
+        tree = self.parse_or()
+        if self.position < len(self.tokens):
+            raise self.error("'and', 'or' or the end")
+        return tree
+
+    def parse_or(self):
+        items = [self.parse_and()]
+        while self.accept('keyword', 'or'):
+            items.append(self.parse_and())
+        return items[0] if len(items) == 1 else Or(tuple(items))
+
+    def parse_and(self):
+        items = [self.parse_not()]
+        while self.accept('keyword', 'and'):
+            items.append(self.parse_not())
+        return items[0] if len(items) == 1 else And(tuple(items))
+
+    def parse_not(self):
+        if self.accept('keyword', 'not'):
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        if self.accept('op', '('):
+            tree = self.parse_or()
+            self.expect('op', ')', "')'")
+            return tree
+        if self.accept('keyword', 'has'):
+            return Has(self.field())
+        if self.accept('keyword', 'missing'):
+            return Not(Has(self.field()))
+        field = self.field()
+        if self.accept('keyword', 'in'):
+            self.expect('op', '(', "'('")
+            values = [self.value()]
+            while self.accept('op', ','):
+                values.append(self.value())
+            self.expect('op', ')', "')'")
+            return Compare(field, 'in', tuple(values))
+        op = self.accept('op')
+        if op not in ('=', '!=', '^=', '~'):
+            if op is not None:
+                self.position -= 1
+            raise self.error("an operator")
+        value = self.value()
+        if op == '~':
+            try:
+                re.compile(value)
+            except re.error as e:
+                raise ValueError("Invalid regex '{}' in query : {} ({})".format(value, self.text, e))
+        return Compare(field, op, (value,))
+
+    def field(self):
+        name = self.expect('word', expected='a field')
+        return name if name in ATTRIBUTES or name.startswith('tag:') else 'tag:' + name
+
+    def value(self):
+        value = self.accept('string')
+        if value is None:
+            value = self.accept('word')
+        if value is None:
+            raise self.error("a value")
+        return value
+
+
+def parse_query(text):
+    """
+    Parses a query into its tree of Compare, Has, And, Or and Not tuples. The fields are state, type or tag:<key>.
+
+    :param string text: The query.
+
+    :rtype: tuple
+    :raises ValueError: If the query is invalid, with the position of the error.
+    """
+    return _Parser(text).parse()
+
+
+def format_query(tree):
+    """
+    :param tuple tree: A tree returned by parse_query().
+
+    :return: The query, in its canonical form.
+    :rtype: string
+    """
+    if isinstance(tree, Compare):
+        values = ["'{}'".format(v.replace('\\', '\\\\').replace("'", "\\'")) for v in tree.values]
+        if tree.op == 'in':
+            return "{} in ({})".format(tree.field, ', '.join(values))
+        return "{} {} {}".format(tree.field, tree.op, values[0])
+    if isinstance(tree, Has):
+        return "has {}".format(tree.field)
+    if isinstance(tree, Not):
+        if isinstance(tree.item, Has):
+            return "missing {}".format(tree.item.field)
+        return "not {}".format(format_query(tree.item) if isinstance(tree.item, (Compare, Has, Not))
+                               else "({})".format(format_query(tree.item)))
+    if isinstance(tree, And):
+        return ' and '.join(format_query(i) if not isinstance(i, Or) else "({})".format(format_query(i))
+                            for i in tree.items)
+    return ' or '.join(format_query(i) for i in tree.items)
+
+
+def compile_query(tree):
+    """
+    Compiles a tree into a predicate on the instances, boto instances or starwatts.records.InstanceRecord.
+
+    :param tuple tree: A tree returned by parse_query().
+
+    :return: A function taking an instance and returning a bool.
+    :rtype: function
+    """
+    if isinstance(tree, (Compare, Has)):
+        if tree.field in ATTRIBUTES:
+            attribute = ATTRIBUTES[tree.field][0]
+
+            def get(inst):
+                return getattr(inst, attribute)
+        else:
+            key = tree.field[4:]
+
+            def get(inst):
+                return inst.tags.get(key)
+        if isinstance(tree, Has):
+            return lambda inst: get(inst) is not None
+        if tree.op == '!=':
+            value = tree.values[0]
+            return lambda inst: get(inst) != value
+        if tree.op in ('^=', '~'):
+            regex = re.compile(re.escape(tree.values[0]) if tree.op == '^=' else tree.values[0])
+            method = regex.match if tree.op == '^=' else regex.search
+
+            def search(inst):
+                value = get(inst)
+                return value is not None and method(value) is not None
+            return search
+        values = frozenset(tree.values)
+        return lambda inst: get(inst) in values
+    if isinstance(tree, Not):
+        item = compile_query(tree.item)
+        return lambda inst: not item(inst)
+    items = tuple(compile_query(i) for i in tree.items)
+    if isinstance(tree, And):
+        return lambda inst: all(item(inst) for item in items)
+    return lambda inst: any(item(inst) for item in items)
+
+
+def escape(value):
+    """
+    Escapes the wildcards of a filter value.
+    """
+    return value.replace('\\', '\\\\').replace('*', '\\*').replace('?', '\\?')
+
+
+def _pushable(tree):
+    """
+    :return: The (filter name, values) of a condition the API evaluates itself, None otherwise.
+    """
+    if isinstance(tree, Has):
+        return ('tag-key', [tree.field[4:]]) if tree.field not in ATTRIBUTES else None
+    if isinstance(tree, Compare) and tree.op in ('=', 'in', '^='):
+        name = ATTRIBUTES[tree.field][1] if tree.field in ATTRIBUTES else tree.field
+        return name, [escape(v) + ('*' if tree.op == '^=' else '') for v in tree.values]
+    if isinstance(tree, Or):
+        # The values of a filter are alternatives
+        pushed = [_pushable(i) for i in tree.items]
+        if all(p is not None for p in pushed) and len({p[0] for p in pushed}) == 1:
+            return pushed[0][0], [v for p in pushed for v in p[1]]
+    return None
+
+
+class Query:
+    """
+    A query planned for the describe calls : the top-level conditions the API can evaluate (equality, in, prefix and has
+    on the tags, the state and the type) are sent as filters, the rest is compiled into a predicate evaluated on the
+    instances returned. Selective queries transfer and parse a fraction of the inventory.
+
+    :param string text: The query, see the module documentation. Default : None (all the instances).
+    :param tuple tree: The tree of the query, instead of its text. Default : None.
+
+    :raises ValueError: If the query is invalid.
+    """
+
+    def __init__(self, text=None, tree=None):
+        self.tree = tree if tree is not None else parse_query(text) if text and text.strip() else None
+        self.filters = dict()
+        self.empty = False
+        residual = list()
+        conditions = self.tree.items if isinstance(self.tree, And) else (self.tree,) if self.tree else ()
+        for condition in conditions:
+            pushed = _pushable(condition)
+            if pushed is None:
+                residual.append(condition)
+                continue
+            name, values = pushed
+            if name not in self.filters:
+                self.filters[name] = values
+            elif name != 'tag-key' and not any('*' in v for v in values + self.filters[name]):
+                # A single value for each instance : both conditions hold on the common values
+                self.filters[name] = [v for v in self.filters[name] if v in values]
+                self.empty = self.empty or not self.filters[name]
+            else:
+                residual.append(condition)
+        self.residual = residual[0] if len(residual) == 1 else And(tuple(residual)) if residual else None
+        self.predicate = compile_query(self.residual) if self.residual is not None else None
+        self._matches = compile_query(self.tree) if self.tree is not None else None
+
+    @classmethod
+    def from_tags(cls, tags, text=None):
+        """
+        Builds the query of the instances with the given tags, and matching a query.
+
+        :param dict tags: Values of the tags, the empty ones being ignored.
+        :param string text: The query. Default : None.
+
+        :rtype: Query
+        """
+        items = [Compare('tag:' + k, '=', (v,)) for k, v in sorted(tags.items()) if v]
+        if text and text.strip():
+            tree = parse_query(text)
+            items.extend(tree.items if isinstance(tree, And) else (tree,))
+        return cls(tree=(items[0] if len(items) == 1 else And(tuple(items))) if items else None)
+
+    def matches(self, inst):
+        """
+        Evaluates the whole query on an instance.
+
+        :param inst: A boto instance or a starwatts.records.InstanceRecord.
+
+        :rtype: bool
+        """
+        return self._matches is None or self._matches(inst)
+
+    def filter(self, instances):
+        """
+        Keeps the instances, returned by a describe call with the filters of the query, that match its client-side part.
+
+        :param list instances: The instances.
+
+        :rtype: list
+        """
+        if self.predicate is None:
+            return list(instances)
+        return [inst for inst in instances if self.predicate(inst)]
+
+    def select(self, connection):
+        """
+        Lists the instances matching the query, through the fast path.
+
+        :param boto.ec2.EC2Connection connection: The connection.
+
+        :return: A list of starwatts.records.InstanceRecord.
+        :rtype: list
+        """
+        if self.empty:
+            return list()
+        return self.filter(describe_instances(connection, filters=self.filters or None))
+
+    def explain(self):
+        """
+        :return: How the query is evaluated.
+        :rtype: string
+        """
+        if self.empty:
+            return "Nothing : the conditions contradict each other"
+        return "Filters :     {}\nClient side : {}".format(
+            ', '.join("{}={}".format(k, ','.join(v)) for k, v in sorted(self.filters.items())) or '-',
+            format_query(self.residual) if self.residual is not None else '-',
+        )
+
+    def __str__(self):
+        return format_query(self.tree) if self.tree is not None else ''
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Fast read-only path for the inventory : the describe responses are parsed incrementally into compact records instead of
+boto objects.
+"""
+
+import sys
+from xml.etree.ElementTree import XMLPullParser
+
+import boto
+from boto.ec2.instance import Instance
+from boto.ec2.volume import Volume, AttachmentSet
+from boto.ec2.securitygroup import SecurityGroup
+
+# Size of the chunks fed to the parser
+CHUNK_SIZE = 64 * 1024
+
+TAG_PATH = ('tagSet', 'item')
+
+
+class Record:
+    """
+    Base of the records : the attributes are declared in the __slots__ of the subclasses, set to None until parsed,
+    except for the tags.
+    """
+    __slots__ = ()
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.tags = dict()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self):
+        return "{}:{}".format(self.__class__.__name__.replace('Record', ''), self.id)
+
+
+class InstanceRecord(Record):
+    """
+    The attributes of an instance used by the reports, named as in boto.ec2.instance.Instance.
+    """
+    __slots__ = ('tags', 'id', 'image_id', 'state', 'instance_type', 'private_ip_address', 'ip_address', 'placement',
+                 'launch_time', 'key_name', 'vpc_id', 'subnet_id')
+
+    def to_boto(self, connection, refresh=False):
+        """
+        Converts the record to a boto instance, on which the helpers can be used.
+
+        :param boto.ec2.EC2Connection connection: Connection of the instance.
+        :param bool refresh: Loads all the attributes of the instance with an API call. Default : False.
+
+        :rtype: boto.ec2.instance.Instance
+        """
+        inst = Instance(connection)
+        for name in ('id', 'image_id', 'instance_type', 'private_ip_address', 'ip_address', 'launch_time', 'key_name',
+                     'vpc_id', 'subnet_id'):
+            setattr(inst, name, getattr(self, name))
+        inst._state.name = self.state
+        inst._placement.zone = self.placement
+        inst.tags.update(self.tags)
+        if refresh:
+            inst.update(validate=True)
+        return inst
+
+
+class VolumeRecord(Record):
+    """
+    The attributes of a volume, named as in boto.ec2.volume.Volume. The attachment is flattened into instance_id,
+    device and attachment_state.
+    """
+    __slots__ = ('tags', 'id', 'size', 'status', 'zone', 'snapshot_id', 'create_time', 'type', 'instance_id', 'device',
+                 'attachment_state')
+
+    def to_boto(self, connection, refresh=False):
+        """
+        Converts the record to a boto volume, on which the helpers can be used.
+
+        :param boto.ec2.EC2Connection connection: Connection of the volume.
+        :param bool refresh: Loads all the attributes of the volume with an API call. Default : False.
+
+        :rtype: boto.ec2.volume.Volume
+        """
+        volume = Volume(connection)
+        for name in ('id', 'size', 'status', 'zone', 'snapshot_id', 'create_time', 'type'):
+            setattr(volume, name, getattr(self, name))
+        volume.attach_data = AttachmentSet()
+        volume.attach_data.instance_id = self.instance_id
+        volume.attach_data.device = self.device
+        volume.attach_data.status = self.attachment_state
+        volume.tags.update(self.tags)
+        if refresh:
+            volume.update(validate=True)
+        return volume
+
+
+class SecurityGroupRecord(Record):
+    """
+    The attributes of a security group, named as in boto.ec2.securitygroup.SecurityGroup, without its rules.
+    """
+    __slots__ = ('tags', 'id', 'name', 'description', 'vpc_id', 'owner_id')
+
+    def to_boto(self, connection, refresh=False):
+        """
+        Converts the record to a boto security group.
+
+        :param boto.ec2.EC2Connection connection: Connection of the security group.
+        :param bool refresh: Loads the rules of the group with an API call. Default : False.
+
+        :rtype: boto.ec2.securitygroup.SecurityGroup
+        """
+        if refresh:
+            return connection.get_all_security_groups(group_ids=[self.id])[0]
+        group = SecurityGroup(connection, self.owner_id, self.name, self.description, self.id)
+        group.vpc_id = self.vpc_id
+        group.tags.update(self.tags)
+        return group
+
+
+# Path of the record elements under the root of the response, and attribute set from each element under them
+INSTANCE_FORMAT = (InstanceRecord, ('reservationSet', 'item', 'instancesSet', 'item'), {
+    ('instanceId',): 'id',
+    ('imageId',): 'image_id',
+    ('instanceState', 'name'): 'state',
+    ('instanceType',): 'instance_type',
+    ('privateIpAddress',): 'private_ip_address',
+    ('ipAddress',): 'ip_address',
+    ('placement', 'availabilityZone'): 'placement',
+    ('launchTime',): 'launch_time',
+    ('keyName',): 'key_name',
+    ('vpcId',): 'vpc_id',
+    ('subnetId',): 'subnet_id',
+})
+
+VOLUME_FORMAT = (VolumeRecord, ('volumeSet', 'item'), {
+    ('volumeId',): 'id',
+    ('size',): 'size',
+    ('status',): 'status',
+    ('availabilityZone',): 'zone',
+    ('snapshotId',): 'snapshot_id',
+    ('createTime',): 'create_time',
+    ('volumeType',): 'type',
+    ('attachmentSet', 'item', 'instanceId'): 'instance_id',
+    ('attachmentSet', 'item', 'device'): 'device',
+    ('attachmentSet', 'item', 'status'): 'attachment_state',
+})
+
+SECURITY_GROUP_FORMAT = (SecurityGroupRecord, ('securityGroupInfo', 'item'), {
+    ('groupId',): 'id',
+    ('groupName',): 'name',
+    ('groupDescription',): 'description',
+    ('vpcId',): 'vpc_id',
+    ('ownerId',): 'owner_id',
+})
+
+# Attributes whose values repeat across records, interned like the tags
+INTERNED = {'state', 'instance_type', 'placement', 'image_id', 'key_name', 'vpc_id', 'subnet_id', 'status', 'zone',
+            'type', 'attachment_state', 'owner_id'}
+
+INTEGERS = {'size'}
+
+
+def parse(body, record_format):
+    """
+    Parses a describe response into records, incrementally : each record element is freed once parsed.
+
+    :param bytes body: The response.
+    :param tuple record_format: INSTANCE_FORMAT, VOLUME_FORMAT or SECURITY_GROUP_FORMAT.
+
+    :return: A (records, next_token) tuple, next_token being None on the last page.
+    :rtype: tuple
+    """
+    cls, item_path, fields = record_format
+    depth = len(item_path) + 1
+    parser = XMLPullParser(events=('start', 'end'))
+    records = list()
+    next_token = None
+    path = list()
+    record = None
+    key = None
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    for offset in range(0, len(body) or 1, CHUNK_SIZE):
+        parser.feed(body[offset:offset + CHUNK_SIZE])
+        for event, elem in parser.read_events():
+            if event == 'start':
+                path.append(elem.tag.rpartition('}')[2])
+                if len(path) == depth and tuple(path[1:]) == item_path:
+                    record = cls()
+                continue
+            relative = tuple(path[depth:])
+            if record is not None and len(path) == depth:
+                records.append(record)
+                record = None
+                elem.clear()
+            elif record is not None:
+                if relative[:2] == TAG_PATH and len(relative) == 3:
+                    text = sys.intern(elem.text or '')
+                    if relative[2] == 'key':
+                        key = text
+                    elif relative[2] == 'value' and key is not None:
+                        record.tags[key] = text
+                        key = None
+                elif relative in fields:
+                    name = fields[relative]
+                    # An empty element is an empty string, as in boto
+                    value = elem.text or ''
+                    if value and name in INTEGERS:
+                        value = int(value)
+                    elif name in INTERNED:
+                        value = sys.intern(value)
+                    setattr(record, name, value)
+            elif len(path) == 2 and path[1] == 'nextToken':
+                next_token = elem.text
+            path.pop()
+    parser.close()
+    return records, next_token
+
+
+def describe(connection, action, record_format, params=None):
+    """
+    Makes a describe call, following the pages of the response, and parses it into records.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+    :param string action: The API action.
+    :param tuple record_format: The format of the records.
+    :param dict params: Parameters of the call. Default : None.
+
+    :raises boto.exception.EC2ResponseError: If the call fails.
+    :rtype: list
+    """
+    params = dict(params or dict())
+    records = list()
+    while True:
+        response = connection.make_request(action, dict(params), '/', 'POST')
+        body = response.read()
+        if response.status != 200:
+            boto.log.error('{} {}'.format(response.status, response.reason))
+            raise connection.ResponseError(response.status, response.reason, body)
+        page, next_token = parse(body, record_format)
+        records.extend(page)
+        if not next_token:
+            return records
+        params['NextToken'] = next_token
+
+
+def describe_instances(connection, instance_ids=None, filters=None):
+    """
+    Lists the instances as InstanceRecord, several times faster and lighter than get_only_instances().
+
+    :param boto.ec2.EC2Connection connection: The connection.
+    :param list instance_ids: Only lists these instances. Default : None.
+    :param dict filters: Filters of the call, as in boto. Default : None.
+
+    :rtype: list
+    """
+    params = dict()
+    if instance_ids:
+        connection.build_list_params(params, instance_ids, 'InstanceId')
+    if filters:
+        connection.build_filter_params(params, filters)
+    return describe(connection, 'DescribeInstances', INSTANCE_FORMAT, params)
+
+
+def describe_volumes(connection, volume_ids=None, filters=None):
+    """
+    Lists the volumes as VolumeRecord.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+    :param list volume_ids: Only lists these volumes. Default : None.
+    :param dict filters: Filters of the call, as in boto. Default : None.
+
+    :rtype: list
+    """
+    params = dict()
+    if volume_ids:
+        connection.build_list_params(params, volume_ids, 'VolumeId')
+    if filters:
+        connection.build_filter_params(params, filters)
+    return describe(connection, 'DescribeVolumes', VOLUME_FORMAT, params)
+
+
+def describe_security_groups(connection, group_ids=None, filters=None):
+    """
+    Lists the security groups as SecurityGroupRecord, without their rules.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+    :param list group_ids: Only lists these groups. Default : None.
+    :param dict filters: Filters of the call, as in boto. Default : None.
+
+    :rtype: list
+    """
+    params = dict()
+    if group_ids:
+        connection.build_list_params(params, group_ids, 'GroupId')
+    if filters:
+        connection.build_filter_params(params, filters)
+    return describe(connection, 'DescribeSecurityGroups', SECURITY_GROUP_FORMAT, params)
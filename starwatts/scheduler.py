@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Packs jobs onto the running nodes according to their core and RAM requirements, launching new nodes only when needed.
+"""
+
+import time
+import uuid
+import logging
+from collections import namedtuple
+
+from boto.exception import EC2ResponseError
+
+from .constants import instance_types as default_instance_types
+
+JobRequest = namedtuple('JobRequest', ['name', 'cores', 'ram'])
+
+Placement = namedtuple('Placement', ['request', 'node', 'waited', 'launched'])
+
+# Tolerance on the RAM sums, which are floats
+EPSILON = 1e-9
+
+
+class Node:
+    """
+    A VM and the jobs placed on it.
+
+    :param string name: Name of the node.
+    :param string instance_type: Type of the instance.
+    :param int cores: Number of cores of the instance.
+    :param float ram: RAM of the instance, in GB.
+    :param boto.ec2.instance.Instance instance: The instance. Default : None.
+    """
+
+    def __init__(self, name, instance_type, cores, ram, instance=None):
+        self.name = name
+        self.instance_type = instance_type
+        self.cores = cores
+        self.ram = ram
+        self.instance = instance
+        self.jobs = list()
+
+    @property
+    def free_cores(self):
+        return self.cores - sum(job.cores for job in self.jobs)
+
+    @property
+    def free_ram(self):
+        return self.ram - sum(job.ram for job in self.jobs)
+
+    def fits(self, request):
+        """
+        Whether a job fits in the remaining capacity of the node.
+
+        :param JobRequest request: The job.
+
+        :rtype: bool
+        """
+        return request.cores <= self.free_cores and request.ram <= self.free_ram + EPSILON
+
+    def __str__(self):
+        return "{} ({}) : {} job(s), {}/{} core(s), {:.1f}/{:.1f}GB of RAM used".format(
+            self.name, self.instance_type, len(self.jobs), self.cores - self.free_cores, self.cores,
+            self.ram - self.free_ram, self.ram,
+        )
+
+
+class BinPackingScheduler:
+    """
+    Places queued jobs on nodes. The biggest jobs are placed first, each on the node it fills the most (best fit
+    decreasing). A job that fits on no node gets a new one, of the instance type that is the most used once the job and
+    the following queued jobs that fit in it are placed.
+
+    New nodes are obtained through the launcher, called as ``launcher(instance_type, name)`` and returning the instance
+    (or None if it couldn't be launched). Without a launcher, the scheduler only plans the nodes.
+
+    :param dict instance_types:
+        Capacities of the instance types, as {type: {'core': cores, 'ram': GB}}. Default : constants.instance_types.
+    :param callable launcher:
+        Launches a new node. Default : None.
+    :param int max_nodes:
+        Maximum number of nodes. Jobs that don't fit once it is reached stay in the queue. Default : None.
+    :param callable clock:
+        Returns the current time, used to measure how long the jobs waited. Default : time.time.
+    """
+
+    def __init__(self, instance_types=None, launcher=None, max_nodes=None, clock=time.time):
+        self.instance_types = instance_types if instance_types is not None else default_instance_types
+        self.launcher = launcher
+        self.max_nodes = max_nodes
+        self.clock = clock
+        self.nodes = list()
+        self.queue = list()
+        self.placements = list()
+        self._submitted = dict()
+        self._max_cores = max(t['core'] for t in self.instance_types.values())
+        self._max_ram = max(t['ram'] for t in self.instance_types.values())
+
+    def add_node(self, name, instance_type, instance=None):
+        """
+        Adds an existing node.
+
+        :param string name: Name of the node.
+        :param string instance_type: Type of the instance, one of instance_types.
+        :param boto.ec2.instance.Instance instance: The instance. Default : None.
+
+        :raises ValueError: If the instance type is unknown.
+        :rtype: Node
+        """
+        if instance_type not in self.instance_types:
+            raise ValueError("Unknown instance type {}.".format(instance_type))
+        capacity = self.instance_types[instance_type]
+        node = Node(name, instance_type, capacity['core'], capacity['ram'], instance)
+        self.nodes.append(node)
+        return node
+
+    def add_instances(self, instances):
+        """
+        Adds running instances as nodes. Instances of an unknown type are ignored.
+
+        :param list instances: boto.ec2.instance.Instance objects.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: BinPackingScheduler
+        """
+        for inst in instances:
+            if inst.instance_type in self.instance_types:
+                self.add_node(inst.tags.get('name', inst.id), inst.instance_type, inst)
+        return self
+
+    def submit(self, request):
+        """
+        Queues a job.
+
+        :param JobRequest request: The job, whose name identifies it until it completes.
+
+        :raises ValueError:
+            If no instance type is big enough for the job, or if a job with the same name is queued or running.
+        :return: This instance. Allows to chain methods.
+        :rtype: BinPackingScheduler
+        """
+        if request.name in self._submitted or any(r.name == request.name for n in self.nodes for r in n.jobs):
+            raise ValueError("A job named {} is already queued or running.".format(request.name))
+        if not any(self._type_fits(t, request) for t in self.instance_types):
+            raise ValueError("No instance type can hold {} ({} core(s), {}GB).".format(
+                request.name, request.cores, request.ram))
+        self.queue.append(request)
+        self._submitted[request.name] = self.clock()
+        return self
+
+    def _type_fits(self, instance_type, request):
+        capacity = self.instance_types[instance_type]
+        return request.cores <= capacity['core'] and request.ram <= capacity['ram'] + EPSILON
+
+    def _size(self, request):
+        return max(request.cores / self._max_cores, request.ram / self._max_ram)
+
+    def _leftover(self, node, request):
+        return (node.free_cores - request.cores) / self._max_cores + (node.free_ram - request.ram) / self._max_ram
+
+    def best_node(self, request):
+        """
+        The node the job fills the most.
+
+        :param JobRequest request: The job.
+
+        :return: The node or None if the job fits on none.
+        :rtype: Node
+        """
+        candidates = [node for node in self.nodes if node.fits(request)]
+        return min(candidates, key=lambda node: self._leftover(node, request)) if candidates else None
+
+    def best_type(self, request, following=()):
+        """
+        The instance type to launch for a job, the one that is the most used once the job and the following jobs that
+        fit in it are placed. Smaller types win ties.
+
+        :param JobRequest request: The job.
+        :param list following: Jobs waiting after this one.
+
+        :rtype: string
+        """
+        best, best_score = None, None
+        for instance_type, capacity in self.instance_types.items():
+            if not self._type_fits(instance_type, request):
+                continue
+            free_cores, free_ram = capacity['core'] - request.cores, capacity['ram'] - request.ram
+            for other in following:
+                if other.cores <= free_cores and other.ram <= free_ram + EPSILON:
+                    free_cores -= other.cores
+                    free_ram -= other.ram
+            score = (1 - free_cores / capacity['core'] + 1 - free_ram / capacity['ram']) / 2
+            rank = (-score, capacity['core'], capacity['ram'])
+            if best_score is None or rank < best_score:
+                best, best_score = instance_type, rank
+        return best
+
+    def _launch(self, instance_type):
+        name = "node-{}".format(uuid.uuid4().hex[:8])
+        instance = None
+        if self.launcher is not None:
+            try:
+                instance = self.launcher(instance_type, name)
+            except (EC2ResponseError, RuntimeError, TimeoutError) as e:
+                logging.error("Could not launch {} ({}) : {}".format(name, instance_type, e))
+            if instance is None:
+                return None
+        return self.add_node(name, instance_type, instance)
+
+    def schedule(self):
+        """
+        Places the queued jobs, launching nodes when needed.
+
+        :return: List of the new Placement.
+        :rtype: list
+        """
+        pending = sorted(self.queue, key=self._size, reverse=True)
+        placed = list()
+        waiting = list()
+        for i, request in enumerate(pending):
+            launched = False
+            node = self.best_node(request)
+            if node is None and (self.max_nodes is None or len(self.nodes) < self.max_nodes):
+                node = self._launch(self.best_type(request, pending[i + 1:]))
+                launched = node is not None
+            if node is None:
+                waiting.append(request)
+                continue
+            node.jobs.append(request)
+            placement = Placement(request, node, self.clock() - self._submitted.pop(request.name), launched)
+            placed.append(placement)
+        self.queue = waiting
+        self.placements.extend(placed)
+        return placed
+
+    def complete(self, name):
+        """
+        Frees the resources of a finished job.
+
+        :param string name: Name of the job.
+
+        :return: The node the job ran on, or None if it wasn't placed.
+        :rtype: Node
+        """
+        for node in self.nodes:
+            for request in node.jobs:
+                if request.name == name:
+                    node.jobs.remove(request)
+                    return node
+        return None
+
+    def idle_nodes(self):
+        """
+        The nodes without any job.
+
+        :rtype: list
+        """
+        return [node for node in self.nodes if not node.jobs]
+
+    def remove_node(self, node):
+        """
+        Forgets a node, e.g : once it was terminated.
+
+        :param Node node: The node.
+        """
+        self.nodes.remove(node)
+
+    def utilisation(self):
+        """
+        Share of the cores and of the RAM of the nodes used by the jobs.
+
+        :return: A (cores, ram) tuple of fractions.
+        :rtype: tuple
+        """
+        cores = sum(node.cores for node in self.nodes)
+        ram = sum(node.ram for node in self.nodes)
+        if not cores:
+            return 0.0, 0.0
+        return (sum(n.cores - n.free_cores for n in self.nodes) / cores,
+                sum(n.ram - n.free_ram for n in self.nodes) / ram)
+
+    def mean_wait(self):
+        """
+        Mean number of seconds the placed jobs waited in the queue.
+
+        :rtype: float
+        """
+        if not self.placements:
+            return 0.0
+        return sum(p.waited for p in self.placements) / len(self.placements)
+
+    def __str__(self):
+        cores, ram = self.utilisation()
+        return "Scheduler : {} node(s), {} queued, {:.0%} of the cores and {:.0%} of the RAM used".format(
+            len(self.nodes), len(self.queue), cores, ram)
+
+
+def instance_launcher(connection, ami_id, sg_id='sg-9b5adf25', terminate_on_shutdown=True, pool=None):
+    """
+    Builds a launcher for BinPackingScheduler that starts the nodes with quick_instance(), or claims them from a warm
+    pool when one is given.
+
+    :param boto.ec2.EC2Connection connection: The connection used to launch the instances.
+    :param string ami_id: ID of the AMI of the nodes.
+    :param string sg_id: Security group applied to the nodes. Default : 'sg-9b5adf25'.
+    :param bool terminate_on_shutdown: Terminates the nodes when they shutdown. Default : True.
+    :param starwatts.pool.WarmPool pool: Pool the nodes are claimed from first. Default : None.
+
+    :return: The launcher.
+    :rtype: callable
+    """
+    def launcher(instance_type, name):
+        inst = pool.claim(ami_id, instance_type, name) if pool is not None else None
+        if inst is None:
+            inst = connection.quick_instance(name=name, image=ami_id, instance_type=instance_type, sg_id=sg_id,
+                                             terminate_on_shutdown=terminate_on_shutdown)
+            if inst is None:
+                return None
+            inst.wait_for('running')
+        return inst
+    return launcher
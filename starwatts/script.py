@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Batches a sequence of shell steps into a single script run in one exec on the remote host.
+"""
+
+import shlex
+from collections import namedtuple
+
+MARKER = '__STARWATTS_STEP__'
+
+StepResult = namedtuple('StepResult', ['name', 'status', 'seconds', 'output'])
+
+
+class RemoteScript:
+    """
+    A list of named shell steps rendered as a single script. The script is piped to ``sh -s`` so running it costs a
+    single exec, whatever the number of steps. After each step a marker line reports its exit status and timing, and
+    the script stops at the first failing step. Each step runs in its own subshell, so a step may call exit but
+    doesn't share variables or working directory with the next ones. Its stdin is /dev/null so that it can't swallow
+    the rest of the script.
+
+    :param string name: Name of the script, used in the reports. Default : 'script'.
+    """
+
+    def __init__(self, name='script'):
+        self.name = name
+        self.steps = list()
+
+    def add(self, name, command):
+        """
+        Appends a step.
+
+        :param string name: Name of the step.
+        :param string command: Shell command(s) of the step.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: RemoteScript
+        """
+        self.steps.append((name, command))
+        return self
+
+    def extend(self, other):
+        """
+        Appends the steps of another script.
+
+        :param RemoteScript other: The script to append.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: RemoteScript
+        """
+        self.steps.extend(other.steps)
+        return self
+
+    def render(self):
+        """
+        Renders the script.
+
+        :return: The shell script.
+        :rtype: string
+        """
+        lines = ["_sw_now() { date +%s%N 2>/dev/null || date +%s000000000; }"]
+        for i, (name, command) in enumerate(self.steps):
+            lines.append("_sw_start=$(_sw_now)")
+            lines.append("(\n{}\n) </dev/null 2>&1".format(command))
+            lines.append("_sw_rc=$?")
+            lines.append("printf '\\n{} %s %s %s %s %s\\n' {} \"$_sw_rc\" \"$_sw_start\" \"$(_sw_now)\" {}".format(
+                MARKER, i, shlex.quote(name)))
+            lines.append('[ "$_sw_rc" -eq 0 ] || exit "$_sw_rc"')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def parse(output):
+        """
+        Splits the output of a rendered script into the results of its steps. Marker lines that can't be parsed, e.g :
+        printed by a step, are kept in the output of the step.
+
+        :param string output: Standard output of the script.
+
+        :return: List of StepResult, one for each step that ran.
+        :rtype: list
+        """
+        results = list()
+        current = list()
+        for line in output.split('\n'):
+            fields = line.split(' ')
+            if fields[0] == MARKER and len(fields) >= 6 and fields[1].isdigit() and fields[2].isdigit():
+                status = int(fields[2])
+                try:
+                    seconds = (int(fields[4]) - int(fields[3])) / 1e9
+                except ValueError:
+                    # date without nanoseconds support
+                    seconds = None
+                name = " ".join(fields[5:])
+                # The marker is preceded by a newline in case the step output didn't end with one.
+                text = "\n".join(current)
+                results.append(StepResult(name, status, seconds, text[:-1] if text.endswith('\n') else text))
+                current = list()
+            else:
+                current.append(line)
+        return results
+
+    def run(self, client, timeout=None):
+        """
+        Runs the script on a remote host in a single exec.
+
+        :param paramiko.SSHClient client: A connected client.
+        :param int timeout: Timeout of the exec. Default : None.
+
+        :return: A (exit status, list of StepResult, stderr) tuple.
+        :rtype: tuple
+        """
+        (stdin, stdout, stderr) = client.exec_command('sh -s', timeout=timeout)
+        stdin.write(self.render())
+        stdin.channel.shutdown_write()
+        out = stdout.read().decode()
+        err = stderr.read().decode()
+        return stdout.channel.recv_exit_status(), self.parse(out), err
+
+
+OUTSCALE_SECTION = "-----BEGIN OUTSCALE SECTION-----\nprivate_only=true\n-----END OUTSCALE SECTION-----"
+
+
+def render_user_data(script=None, private=True, log='/var/log/starwatts-bootstrap.log'):
+    """
+    Renders the user data of a new instance. Without a script, the user data is the Outscale private_only section (or
+    nothing for public instances). With a script, the user data is a shell script run by cloud-init at boot, and the
+    Outscale section is kept inside a no-op heredoc so that the shell ignores it.
+
+    :param script:
+        Steps to run at boot, either a RemoteScript or a string of shell commands. Default : None.
+    :param bool private:
+        Adds the Outscale private_only section. Default : True.
+    :param string log:
+        File on the instance in which the output of the steps is appended. It is also written to the console so that
+        the step markers can be read with the GetConsoleOutput API. Default : '/var/log/starwatts-bootstrap.log'.
+
+    :return: The user data.
+    :rtype: string
+    """
+    if script is None:
+        return OUTSCALE_SECTION if private else ""
+    body = script.render() if isinstance(script, RemoteScript) else script
+    lines = ["#!/bin/sh", "(", body.rstrip("\n"), ") 2>&1 | tee -a {} /dev/console".format(shlex.quote(log))]
+    if private:
+        lines.extend([": <<'OUTSCALE'", OUTSCALE_SECTION, "OUTSCALE"])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent shell sessions that pipeline many small commands over a single channel.
+"""
+
+import time
+import uuid
+import select
+from collections import namedtuple
+
+CommandResult = namedtuple('CommandResult', ['command', 'status', 'stdout', 'stderr'])
+
+
+class ShellSession:
+    """
+    Keeps a single shell open on the remote host and sends commands to it without waiting for the previous ones to
+    finish. After each command the shell prints a unique sentinel on stdout (with the exit status) and on stderr, which
+    is used to split both streams into the results of each command. N commands sent with run_many() cost about one
+    round trip instead of N channel openings and exit status waits.
+
+    Commands run one after the other in the same shell, so variables and the working directory are kept between them.
+    Their stdin is /dev/null so that they can't swallow the commands that follow. A command that exits the shell ends
+    the session.
+
+    :param paramiko.SSHClient client: A connected client.
+    :param string shell: The shell to run. Default : 'sh'.
+    """
+
+    def __init__(self, client, shell='sh'):
+        self.client = client
+        self.channel = client.get_transport().open_session()
+        self.channel.exec_command(shell)
+        self._token = uuid.uuid4().hex
+        self._count = 0
+        self._out = b''
+        self._err = b''
+        self._pending = list()
+
+    def _sentinel(self, n):
+        return '__STARWATTS_{}_{}__'.format(self._token, n)
+
+    def submit(self, command):
+        """
+        Sends a command without waiting for its result.
+
+        :param string command: The command to run.
+
+        :return: This instance. Allows to chain methods.
+        :rtype: ShellSession
+        """
+        sentinel = self._sentinel(self._count)
+        self._count += 1
+        script = "{{\n{command}\n}} </dev/null\nprintf '\\n{s} %s\\n' \"$?\"\nprintf '\\n{s}\\n' >&2\n"
+        self.channel.sendall(script.format(command=command, s=sentinel).encode())
+        self._pending.append((command, sentinel))
+        return self
+
+    def _read(self, deadline):
+        timeout = None if deadline is None else max(0.0, deadline - time.time())
+        if not (self.channel.recv_ready() or self.channel.recv_stderr_ready()):
+            select.select([self.channel], [], [], timeout)
+        got = False
+        while self.channel.recv_ready():
+            data = self.channel.recv(65536)
+            if not data:
+                break
+            self._out += data
+            got = True
+        while self.channel.recv_stderr_ready():
+            self._err += self.channel.recv_stderr(65536)
+            got = True
+        if not got and (self.channel.exit_status_ready() or self.channel.closed):
+            raise EOFError("The remote shell exited.")
+        if deadline is not None and time.time() > deadline:
+            raise TimeoutError("The command took too long to finish.")
+
+    def _next(self, timeout=None):
+        command, sentinel = self._pending[0]
+        marker = ('\n' + sentinel).encode()
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            out_end = self._out.find(marker + b' ')
+            err_end = self._err.find(marker + b'\n')
+            if out_end >= 0 and self._out.find(b'\n', out_end + len(marker) + 1) >= 0 and err_end >= 0:
+                break
+            self._read(deadline)
+        status_end = self._out.find(b'\n', out_end + len(marker) + 1)
+        status = int(self._out[out_end + len(marker) + 1:status_end])
+        stdout, self._out = self._out[:out_end], self._out[status_end + 1:]
+        stderr, self._err = self._err[:err_end], self._err[err_end + len(marker) + 1:]
+        self._pending.pop(0)
+        return CommandResult(command, status, stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace'))
+
+    def results(self, timeout=None):
+        """
+        Waits for every submitted command.
+
+        :param int timeout: Number of seconds allowed for each command. Default : None.
+
+        :return: List of CommandResult, in the order the commands were submitted.
+        :rtype: list
+        """
+        return [self._next(timeout) for _ in range(len(self._pending))]
+
+    def run(self, command, timeout=None):
+        """
+        Runs a single command and waits for its result. The results of the commands submitted before and not
+        collected yet are discarded.
+
+        :param string command: The command to run.
+        :param int timeout: Number of seconds allowed for the command. Default : None.
+
+        :rtype: CommandResult
+        """
+        self.submit(command)
+        return self.results(timeout)[-1]
+
+    def run_many(self, commands, timeout=None):
+        """
+        Sends all the commands at once, then collects their results.
+
+        :param list commands: The commands to run.
+        :param int timeout: Number of seconds allowed for each command. Default : None.
+
+        :return: List of CommandResult, in the same order as the commands.
+        :rtype: list
+        """
+        for command in commands:
+            self.submit(command)
+        return self.results(timeout)
+
+    def close(self):
+        """
+        Exits the shell and closes the channel.
+        """
+        if not self.channel.closed:
+            try:
+                self.channel.sendall(b"exit\n")
+            except (EOFError, OSError):
+                pass
+            self.channel.close()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Process wide caches of the parsed SSH configuration, known hosts and private keys. Files are parsed once and parsed
+again only when their modification time or size changes.
+"""
+
+import os
+import threading
+
+import paramiko
+
+SSH_CONFIG = '~/.ssh/config'
+KNOWN_HOSTS = '~/.ssh/known_hosts'
+
+
+class FileCache:
+    """
+    Caches the result of parsing files, keyed by path (and extra arguments). An entry is reloaded when the modification
+    time or the size of its file changes.
+
+    :param callable loader: Called as loader(path, \\*args) to parse a file.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.loads = 0
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get(self, path, *args):
+        """
+        Returns the parsed content of a file.
+
+        :param string path: Path of the file, ~ is expanded.
+
+        :raises FileNotFoundError: If the file doesn't exist.
+        :return: The result of the loader.
+        """
+        path = os.path.expanduser(path)
+        st = os.stat(path)
+        stamp = (st.st_mtime, st.st_size)
+        key = (path,) + args
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                entry = (stamp, self.loader(path, *args))
+                self._entries[key] = entry
+                self.loads += 1
+            return entry[1]
+
+    def clear(self):
+        """
+        Forgets every entry.
+        """
+        with self._lock:
+            self._entries = dict()
+
+
+def _load_ssh_config(path):
+    conf = paramiko.SSHConfig()
+    with open(path) as f:
+        conf.parse(f)
+    return conf
+
+
+def _load_host_keys(path):
+    return paramiko.HostKeys(path)
+
+
+# DSS keys are gone from paramiko 4
+KEY_CLASSES = tuple(c for c in (paramiko.RSAKey, getattr(paramiko, 'DSSKey', None), paramiko.ECDSAKey,
+                                paramiko.Ed25519Key) if c is not None)
+
+
+def _load_private_key(path, password=None):
+    for key_class in KEY_CLASSES:
+        try:
+            return key_class.from_private_key_file(path, password=password)
+        except paramiko.SSHException:
+            continue
+    raise paramiko.SSHException("Could not load the private key {}.".format(path))
+
+
+_ssh_configs = FileCache(_load_ssh_config)
+_host_keys = FileCache(_load_host_keys)
+_private_keys = FileCache(_load_private_key)
+
+
+def ssh_config(path=SSH_CONFIG):
+    """
+    The parsed SSH configuration.
+
+    :param string path: Path of the configuration. Default : '~/.ssh/config'.
+
+    :raises FileNotFoundError: If the file doesn't exist.
+    :rtype: paramiko.SSHConfig
+    """
+    return _ssh_configs.get(path)
+
+
+def host_keys(path=KNOWN_HOSTS):
+    """
+    The parsed known hosts, shared by every client of the process. It must not be modified.
+
+    :param string path: Path of the known hosts file. Default : '~/.ssh/known_hosts'.
+
+    :return: The known hosts, empty if the file doesn't exist.
+    :rtype: paramiko.HostKeys
+    """
+    try:
+        return _host_keys.get(path)
+    except FileNotFoundError:
+        return paramiko.HostKeys()
+
+
+def private_key(path, password=None):
+    """
+    The loaded private key stored in a file.
+
+    :param string path: Path of the key (e.g : '~/.ssh/project.pem').
+    :param string password: Password of the key if it is encrypted. Default : None.
+
+    :raises FileNotFoundError: If the file doesn't exist.
+    :raises paramiko.SSHException: If the key can't be loaded.
+    :rtype: paramiko.PKey
+    """
+    return _private_keys.get(path, password)
+
+
+class CachedHostKeyPolicy(paramiko.MissingHostKeyPolicy):
+    """
+    Checks the key of a server against the cached known hosts, and accepts the servers that aren't in it, as
+    paramiko.AutoAddPolicy does. The known hosts are neither parsed again nor copied for every client.
+
+    :param string path: Path of the known hosts file. Default : '~/.ssh/known_hosts'.
+    """
+
+    def __init__(self, path=KNOWN_HOSTS):
+        self.path = path
+
+    def missing_host_key(self, client, hostname, key):
+        known = host_keys(self.path).lookup(hostname)
+        if known is not None and key.get_name() in known and known[key.get_name()].asbytes() != key.asbytes():
+            raise paramiko.BadHostKeyException(hostname, key, known[key.get_name()])
+        client.get_host_keys().add(hostname, key.get_name(), key)
+
+
+def new_client():
+    """
+    Creates an SSH client that checks the servers against the cached known hosts and adds unknown hosts automatically.
+
+    :rtype: paramiko.SSHClient
+    """
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(CachedHostKeyPolicy())
+    return client
+
+
+def clear():
+    """
+    Empties every cache.
+    """
+    for cache in (_ssh_configs, _host_keys, _private_keys):
+        cache.clear()
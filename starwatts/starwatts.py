@@ -3,12 +3,22 @@
 Provides an object and an interface to work with the Outscale cloud.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 import yaml
 import boto
 from colorama import Fore, Style
 
 from .cloud_app import CloudApp
 from .constants import ENDPOINT, instance_types
+from .instrument import ApiInstrumentation, instrument
+from .connections import ConnectionPool, accept_gzip, keep_alive
+from .coalesce import SingleFlight, coalesce
+from .hedge import hedge
+from .query import Query
+from .records import describe_instances
+from .batch import BatchScope
+from .throttle import RateLimiter, throttle, BACKGROUND
 
 
 class StarWatts:
@@ -24,17 +34,43 @@ class StarWatts:
     :param string secret_key: A string representing the secret_key (required if using ak/sk method)
     :param string proxy: Address of the proxy to use
     :param string proxy_port: Port of the proxy to use
+    :param string endpoint: URL of the API. Default : constants.ENDPOINT.
+    :param float rate: Maximum number of API calls per second, for all the threads. Default : 10.
+    :param int burst: Number of API calls that can be made at once after an idle period. Default : 20.
+    :param dict budgets: Rate and burst of some actions, as {action: (rate, burst)}. Default : None.
+    :param int pool_size: Maximum number of connections of self.pool checked out at the same time. Default : 8.
+    :param int prewarm: Number of connections opened in the background upon initialization, so that the first calls
+        don't wait for the TLS handshake. The first one is self.conn, the others go to self.pool. Default : 0.
+    :param bool single_flight: Identical read-only calls made at the same time by several threads share a single
+        call (see starwatts.coalesce). Default : True.
+    :param float hedge: Describe calls that didn't answer after this percentile of the recent latencies of their
+        action are sent a second time, the first response being used (see starwatts.hedge). Default : None (disabled).
+
+    The API calls made through the connection are recorded in self.instrumentation (see starwatts.instrument) and go
+    through self.limiter, which retries the throttled ones (see starwatts.throttle). Threads working in parallel take
+    their own connection from self.pool (see starwatts.connections) rather than sharing self.conn.
     """
     conn = None
+    pool = None
 
-    def __init__(self, configuration=None, access_key=None, secret_key=None, proxy=None, proxy_port=None):
+    def __init__(self, configuration=None, access_key=None, secret_key=None, proxy=None, proxy_port=None,
+                 endpoint=ENDPOINT, rate=10, burst=20, budgets=None, pool_size=8, prewarm=0, single_flight=True,
+                 hedge=None):
         self.proxy = proxy
         self.proxy_port = proxy_port
+        self.endpoint = endpoint
+        self.pool_size = pool_size
+        self.prewarm = prewarm
+        self.instrumentation = ApiInstrumentation()
+        self.limiter = RateLimiter(rate, burst, budgets)
+        self.flight = SingleFlight() if single_flight else None
+        self.batch_scope = BatchScope()
+        self.hedge = hedge
+        self._hedge_executor = ThreadPoolExecutor(max_workers=2 * pool_size) if hedge is not None else None
         if configuration is not None:
             self.load_configuration(configuration)
         elif access_key is not None and secret_key is not None:
-            self.conn = boto.connect_ec2_endpoint(ENDPOINT, access_key, secret_key, proxy=self.proxy,
-                                                  proxy_port=self.proxy_port)
+            self.connect(access_key, secret_key)
         elif access_key is not None and secret_key is None:
             raise ValueError("access_key is set but not secret_key")
         elif access_key is None and secret_key is not None:
@@ -51,11 +87,80 @@ class StarWatts:
         with open(fp, 'r') as stream:
             cnf = yaml.load(stream)
             if 'access_key' in cnf and 'secret_key' in cnf:
-                self.conn = boto.connect_ec2_endpoint(ENDPOINT, cnf['access_key'], cnf['secret_key'], proxy=self.proxy,
-                                                      proxy_port=self.proxy_port)
+                self.connect(cnf['access_key'], cnf['secret_key'])
             else:
                 raise ValueError("Need access_key and secret_key in {} configuration file".format(fp))
 
+    def new_connection(self, access_key, secret_key):
+        """
+        Creates a connection to the API. Its calls are recorded in self.instrumentation and rate limited by
+        self.limiter, its responses are compressed and its HTTP connections kept alive. Its identical read-only calls
+        are coalesced with the ones of the other connections through self.flight, and its slow describe calls hedged
+        on the connections of self.pool if self.hedge is set. Its batching contexts are shared with the other
+        connections through self.batch_scope.
+
+        :param string access_key: The access_key.
+        :param string secret_key: The secret_key.
+
+        :rtype: boto.ec2.EC2Connection
+        """
+        conn = boto.connect_ec2_endpoint(self.endpoint, access_key, secret_key, proxy=self.proxy,
+                                         proxy_port=self.proxy_port)
+        conn = instrument(accept_gzip(keep_alive(conn)), self.instrumentation)
+        if self.hedge is not None:
+            conn = hedge(conn, self.instrumentation, self.hedge, limiter=self.limiter, executor=self._hedge_executor,
+                         pool=self.pool)
+        conn = throttle(conn, self.limiter, self.instrumentation)
+        if self.flight is not None:
+            conn = coalesce(conn, self.flight, self.instrumentation)
+        conn.batch_scope = self.batch_scope
+        return conn
+
+    def connect(self, access_key, secret_key):
+        """
+        Creates self.conn and the pool of connections for the threads.
+
+        :param string access_key: The access_key.
+        :param string secret_key: The secret_key.
+
+        :return: The connection.
+        :rtype: boto.ec2.EC2Connection
+        """
+        # Created first, the duplicates of the hedged calls are sent on its connections
+        self.pool = ConnectionPool(lambda: self.new_connection(access_key, secret_key), self.pool_size)
+        self.conn = self.new_connection(access_key, secret_key)
+        if self.prewarm:
+            self.pool.prewarm(self.prewarm - 1, [self.conn])
+        return self.conn
+
+    def connection(self, timeout=None):
+        """
+        Checks out a connection of the pool for the duration of a with block, e.g : in a thread of a ThreadPoolExecutor.
+
+        :param float timeout: Number of seconds to wait for a connection when the pool is full. Default : None.
+
+        :rtype: boto.ec2.EC2Connection
+        """
+        return self.pool.connection(timeout)
+
+    def background(self):
+        """
+        Makes the API calls of the current thread in the background lane of the limiter, so that they give way to the
+        interactive ones. To be used as a context manager, e.g : ``with s.background(): s.list_ressources()``.
+        """
+        return self.limiter.lane(BACKGROUND)
+
+    def batching(self, objects=()):
+        """
+        Resolves the per-object helpers (get_all_attached_volumes(), get_attached_instance()...) of the objects of the
+        connections of the instance (self.conn and the ones of self.pool) together, with one describe call for all of
+        them. To be used as a context manager, e.g :
+        ``with s.batching(instances): for inst in instances: inst.get_all_attached_volumes()``.
+
+        :param list objects: Instances and volumes whose helpers will be called. Default : ().
+        """
+        return self.conn.batching(objects)
+
     def get_connection(self):
         """
         Get the connection of the StarWatts instance.
@@ -65,16 +170,47 @@ class StarWatts:
         """
         return self.conn
 
-    def all_vms(self):
+    def all_vms(self, fast=False):
         """
         Shows all the VMs with tags that are in the outscale cloud
 
+        :param bool fast: Returns light records instead of boto instances (see inventory()). Default : False.
+
         :return: A list of tuple (tags, instance object)
         :rtype: tuple
         """
+        if fast:
+            return [(i.tags, i) for i in self.inventory()]
         return [(i.tags, i) for i in self.conn.get_only_instances()]
 
-    def pretty_report(self, name=None, zone=None, os=None, env=None, privacy=None):
+    def inventory(self, filters=None):
+        """
+        Lists the instances through the fast path : the response is parsed straight into InstanceRecord objects (id,
+        tags, type, state, IPs...), several times faster and lighter than boto instances, and convertible to them with
+        to_boto().
+
+        :param dict filters: Filters of the call, as in boto. Default : None.
+
+        :return: A list of starwatts.records.InstanceRecord.
+        :rtype: list
+        """
+        return describe_instances(self.conn, filters=filters)
+
+    def query(self, query):
+        """
+        Lists the instances matching a query such as "env = prod and (type in (m1.large, m1.xlarge) or name ^= web)" :
+        the conditions the API can evaluate are sent as filters of the describe call, the rest is evaluated on the
+        instances returned. See starwatts.query for the language.
+
+        :param string query: The query.
+
+        :return: A list of starwatts.records.InstanceRecord.
+        :rtype: list
+        :raises ValueError: If the query is invalid.
+        """
+        return Query(query).select(self.conn)
+
+    def pretty_report(self, name=None, zone=None, os=None, env=None, privacy=None, query=None):
         """
         Prints out a pretty report of all the VMs if no argument is passed or filter by a single/multiple tags.
 
@@ -83,8 +219,11 @@ class StarWatts:
         :param string os: Include only the VMs that have the corresponding os tag.
         :param string env: Include only the VMs that have the corresponding env tag.
         :param string privacy: Include only the VMs that have the corresponding privacy tag.
+        :param string query: Include only the VMs matching the query (see query()). Default : None.
         """
-        for tags, inst in self.all_vms():
+        query = Query.from_tags({'name': name, 'zone': zone, 'os': os, 'env': env, 'privacy': privacy}, query)
+        for inst in query.select(self.conn):
+            tags = inst.tags
             missing = not all(key in tags for key in ['name', 'os', 'zone', 'env', 'privacy'])
             vm_name = tags.get('name', None)
             vm_zone = tags.get('zone', None)
@@ -92,43 +231,31 @@ class StarWatts:
             vm_env = tags.get('env', None)
             vm_privacy = tags.get('privacy', None)
             vm_type = inst.instance_type
-            include = True
-            if name:
-                include = vm_name == name
-            if zone and include:
-                include = vm_zone == zone
-            if os and include:
-                include = vm_os == os
-            if env and include:
-                include = vm_env == env
-            if privacy and include:
-                include = vm_privacy == privacy
-            if include:
-                print("VM :           {}{}{}".format(
-                    Fore.RED if missing else Fore.GREEN,
-                    vm_name if vm_name else Fore.RED+"MISSING"+Style.RESET_ALL,
-                    Style.RESET_ALL,
-                ))
-                print("OS :           {}".format(vm_os if vm_os else Fore.RED+'MISSING'+Style.RESET_ALL))
-                print("Env :          {}".format(vm_env if vm_env else Fore.RED+'MISSING'+Style.RESET_ALL))
-                print("Zone :         {}".format(vm_zone if vm_zone else Fore.RED+'MISSING'+Style.RESET_ALL))
-                print("Private IP :   {}".format(inst.private_ip_address))
-                print("Private Only : {}{}{}".format(
-                    Fore.YELLOW if vm_privacy and vm_privacy == 'false' else Fore.GREEN,
-                    vm_privacy if vm_privacy else Fore.RED+'MISSING',
-                    Style.RESET_ALL,
-                ))
-                print("Type :         {}{}".format(
-                    vm_type,
-                    " - {} Core(s), {}GB of RAM".format(instance_types[vm_type]['core'], instance_types[vm_type]['ram'])
-                    if vm_type in instance_types else "",
-                ))
-                print("State :        {}{}{}".format(
-                    Fore.GREEN if inst.state == 'running' else Fore.RED,
-                    inst.state,
-                    Style.RESET_ALL,
-                ))
-                print()
+            print("VM :           {}{}{}".format(
+                Fore.RED if missing else Fore.GREEN,
+                vm_name if vm_name else Fore.RED+"MISSING"+Style.RESET_ALL,
+                Style.RESET_ALL,
+            ))
+            print("OS :           {}".format(vm_os if vm_os else Fore.RED+'MISSING'+Style.RESET_ALL))
+            print("Env :          {}".format(vm_env if vm_env else Fore.RED+'MISSING'+Style.RESET_ALL))
+            print("Zone :         {}".format(vm_zone if vm_zone else Fore.RED+'MISSING'+Style.RESET_ALL))
+            print("Private IP :   {}".format(inst.private_ip_address))
+            print("Private Only : {}{}{}".format(
+                Fore.YELLOW if vm_privacy and vm_privacy == 'false' else Fore.GREEN,
+                vm_privacy if vm_privacy else Fore.RED+'MISSING',
+                Style.RESET_ALL,
+            ))
+            print("Type :         {}{}".format(
+                vm_type,
+                " - {} Core(s), {}GB of RAM".format(instance_types[vm_type]['core'], instance_types[vm_type]['ram'])
+                if vm_type in instance_types else "",
+            ))
+            print("State :        {}{}{}".format(
+                Fore.GREEN if inst.state == 'running' else Fore.RED,
+                inst.state,
+                Style.RESET_ALL,
+            ))
+            print()
 
     def list_ressources(self):
         """
@@ -136,14 +263,14 @@ class StarWatts:
         """
         core = 0
         ram = 0.0
-        for instance in self.conn.get_only_instances():
+        for instance in self.inventory():
             i_t = instance.instance_type
             if i_t in instance_types:
                 core += instance_types[i_t]['core']
                 ram += instance_types[i_t]['ram']
         print("CPU: {}, RAM: {}".format(core, ram))
 
-    def generate_ansible_hosts_file(self, grain=None, local=False):
+    def generate_ansible_hosts_file(self, grain=None, local=False, vms=None):
         """
         Generate an ansible hosts file (should be stored in /etc/ansible/hosts) according to the grain you define.
         Basically the grain's default is to generate groups for 'env' and 'zone' tags, but you can remove/add some if
@@ -162,6 +289,8 @@ class StarWatts:
             List of tags to generate the hosts file from
         :param bool local:
             Tells if the inventory file describes an inventory used inside the cloud or on a local machine
+        :param list vms:
+            The (tags, instance) tuples to describe, as returned by all_vms(). Default : None (listed).
 
         :return: Content of the hosts file
         :rtype: string
@@ -170,7 +299,8 @@ class StarWatts:
             grain = ['env', 'zone']
         matrix = {k: [] for k in grain}
         s = ""
-        for tags, inst in self.all_vms():
+        all_vms = self.all_vms(fast=True) if vms is None else vms
+        for tags, inst in all_vms:
             name = tags.get('name', None)
             if name:
                 s += "[{name}]\n{ip}\n\n".format(name=name, ip=name if local else inst.private_ip_address)
@@ -183,24 +313,26 @@ class StarWatts:
         for k, v in matrix.items():
             for group in v:
                 s += "[{}_{}:children]\n".format(k, group)
-                for inst in self.conn.get_instances_by_tags({k: group}):
-                    if 'name' in inst.tags:
-                        s += "{}\n".format(inst.tags['name'])
+                # The members are taken from the listing, rather than listed again for each group
+                for tags, inst in all_vms:
+                    if tags.get(k) == group and 'name' in tags:
+                        s += "{}\n".format(tags['name'])
                 s += "\n"
         return s
 
-    def generate_ssh_config(self, local=False):
+    def generate_ssh_config(self, local=False, vms=None):
         """
         Generate a local or distant ssh config. If local is set to True, then it will also generate a ProxyCommand for
         each entry, forwarding the connections through the bastion.
 
         :param bool local: Defines whether or not to generate a ProxyCommand for each VM.
+        :param list vms: The (tags, instance) tuples to describe, as returned by all_vms(). Default : None (listed).
 
         :return: A formatted string representing a full ssh configuration
         :rtype: string
         """
         s = ""
-        all_vms = self.all_vms()
+        all_vms = self.all_vms(fast=True) if vms is None else vms
         for i, (tags, inst) in enumerate(all_vms):
             name = tags.get('name', None)
             if name and name == 'bastion':
@@ -220,7 +352,7 @@ class StarWatts:
         return s
 
     def new_cloud_app(self, application, version, environment, project, instance_type='m1.xlarge', user='root',
-                      instance=None, ami=None, debug=False):
+                      instance=None, ami=None, debug=False, profile='default'):
         """
         Creates a new CloudApp instance from within the StarWatts instance. Applies the connection of the StarWatts
         instance on the CloudApp.
@@ -248,9 +380,12 @@ class StarWatts:
             None.
         :param bool debug:
             Set to True in case you want to enable debug logging. Default : False.
+        :param string profile:
+            Name of the transport profile applied when connecting ('default', 'bulk' or 'wan'). Default : 'default'.
 
         :return: A new CloudApp instance.
         :rtype: CloudApp
         """
         return CloudApp(self.conn, application=application, version=version, environment=environment, project=project,
-                        instance_type=instance_type, user=user, instance=instance, ami=ami, debug=debug)
+                        instance_type=instance_type, user=user, instance=instance, ami=ami, debug=debug,
+                        profile=profile)
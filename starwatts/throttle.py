@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Client side rate limiting of the API calls, and retries of the throttled ones.
+"""
+
+import gzip
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+from boto.exception import BotoServerError
+
+from .instrument import error_code, register_internal
+
+register_internal(__name__)
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# Error codes returned by the API when the calls are too frequent
+THROTTLING_CODES = {'RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'RequestThrottled'}
+
+
+def decorrelated_jitter(base, cap, previous):
+    """
+    Next delay of a decorrelated jitter backoff : random between base and three times the previous delay, capped.
+
+    :param float base: Minimum delay, in seconds.
+    :param float cap: Maximum delay, in seconds.
+    :param float previous: The previous delay (base for the first retry).
+
+    :rtype: float
+    """
+    return min(cap, random.uniform(base, previous * 3))
+
+
+class TokenBucket:
+    """
+    Holds up to burst tokens, refilled at rate tokens per second.
+
+    :param float rate: Number of tokens added per second.
+    :param float burst: Maximum number of tokens.
+    :param callable clock: Returns the current time. Default : time.monotonic.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError("The rate must be positive and the burst at least 1.")
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, reserve=0.0):
+        """
+        Number of seconds until a token can be taken while leaving reserve tokens in the bucket.
+
+        :param float reserve: Number of tokens that must stay in the bucket. Default : 0.
+
+        :rtype: float
+        """
+        self.refill()
+        missing = 1 + min(reserve, self.burst - 1) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def drain(self):
+        """
+        Empties the bucket, e.g : when the API reports that the calls are too frequent.
+        """
+        self.refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    """
+    Limits the rate of the API calls made by all the threads sharing it. Every call takes a token from a global bucket,
+    and from the bucket of its action when the action has its own budget.
+
+    The calls are made in one of two lanes. Interactive calls (the default) always go first : background calls wait
+    while interactive ones are waiting, and leave a reserve of tokens in the global bucket so that an interactive call
+    arriving during a background sweep doesn't wait for it. The lane of the calls made by a thread is set with lane().
+
+    :param float rate: Number of calls per second. Default : 10.
+    :param int burst: Number of calls that can be made at once after an idle period. Default : 20.
+    :param dict budgets: Budgets of some actions, as {action: (rate, burst)}. Default : None.
+    :param float reserve: Share of the global burst the background calls can't use. Default : 0.25.
+    :param callable clock: Returns the current time. Default : time.monotonic.
+    """
+
+    def __init__(self, rate=10, burst=20, budgets=None, reserve=0.25, clock=time.monotonic):
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.budgets = {action: TokenBucket(r, b, clock) for action, (r, b) in (budgets or dict()).items()}
+        self.reserve = reserve * burst
+        self.waited = 0.0
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def current_lane(self):
+        """
+        Lane of the calls made by the current thread.
+
+        :rtype: string
+        """
+        return getattr(self._local, 'lane', INTERACTIVE)
+
+    @contextmanager
+    def lane(self, name):
+        """
+        Makes the calls of the current thread in a lane.
+
+        :param string name: INTERACTIVE or BACKGROUND.
+
+        :raises ValueError: If the lane is unknown.
+        """
+        if name not in self._waiting:
+            raise ValueError("Unknown lane {}.".format(name))
+        previous = self.current_lane()
+        self._local.lane = name
+        try:
+            yield
+        finally:
+            self._local.lane = previous
+
+    def acquire(self, action, lane=None):
+        """
+        Waits until a call can be made.
+
+        :param string action: The API action.
+        :param string lane: The lane. Default : None (the lane of the current thread).
+
+        :return: Number of seconds waited.
+        :rtype: float
+        """
+        lane = lane or self.current_lane()
+        buckets = [self.bucket] + ([self.budgets[action]] if action in self.budgets else [])
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[lane] += 1
+            try:
+                while True:
+                    if lane == BACKGROUND and self._waiting[INTERACTIVE]:
+                        wait = 1 / self.bucket.rate
+                    else:
+                        reserve = self.reserve if lane == BACKGROUND else 0.0
+                        wait = max([self.bucket.delay(reserve)] + [bucket.delay() for bucket in buckets[1:]])
+                        if wait <= 0:
+                            for bucket in buckets:
+                                bucket.take()
+                            break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[lane] -= 1
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self.waited += waited
+        return waited
+
+    def try_acquire(self, action):
+        """
+        Takes the tokens of a call only if they are available right away, without using the reserve of the interactive
+        calls nor overtaking the calls waiting, e.g : for optional calls.
+
+        :param string action: The API action.
+
+        :return: True if the call can be made.
+        :rtype: bool
+        """
+        buckets = [self.bucket] + ([self.budgets[action]] if action in self.budgets else [])
+        with self._cond:
+            if any(self._waiting.values()):
+                return False
+            if max([self.bucket.delay(self.reserve)] + [bucket.delay() for bucket in buckets[1:]]) > 0:
+                return False
+            for bucket in buckets:
+                bucket.take()
+            return True
+
+    def backoff(self, action=None):
+        """
+        Empties the global bucket, and the bucket of the action if it has its own budget, so that every thread slows
+        down after a throttling error.
+
+        :param string action: The throttled action. Default : None.
+        """
+        with self._cond:
+            self.bucket.drain()
+            if action in self.budgets:
+                self.budgets[action].drain()
+
+
+def _raise_server_errors(response, attempt, next_sleep):
+    # Retry handler of boto : the server errors are raised at once instead of being retried by boto
+    if response.status >= 500:
+        body = response.read()
+        if (response.getheader('content-encoding') or '').lower() == 'gzip':
+            # Called below accept_gzip, the body is still compressed
+            body = gzip.decompress(body)
+        raise BotoServerError(response.status, response.reason, body)
+
+
+def throttle(connection, limiter, instrumentation=None, retries=8, base=0.2, cap=20.0):
+    """
+    Makes the API calls of a connection go through a rate limiter, and retries the throttled calls with a decorrelated
+    jitter backoff. Server errors (5xx) are retried the same way instead of by boto, so that every attempt goes through
+    the limiter and the retries are reported to the instrumentation. Network errors are still retried by boto.
+
+    :param boto.ec2.EC2Connection connection: The connection.
+    :param RateLimiter limiter: The limiter, usually shared by several connections.
+    :param starwatts.instrument.ApiInstrumentation instrumentation: Where the retries are recorded. Default : None.
+    :param int retries: Maximum number of retries of a call. Default : 8.
+    :param float base: Minimum delay between two attempts, in seconds. Default : 0.2.
+    :param float cap: Maximum delay between two attempts, in seconds. Default : 20.
+
+    :return: The connection.
+    :rtype: boto.ec2.EC2Connection
+    """
+    inner = connection.make_request
+    mexe = connection._mexe
+
+    def _mexe(request, sender=None, override_num_retries=None, retry_handler=None):
+        return mexe(request, sender, override_num_retries, retry_handler=retry_handler or _raise_server_errors)
+
+    def make_request(action, params=None, path='/', verb='GET'):
+        delay = base
+        for attempt in range(retries + 1):
+            waited = limiter.acquire(action)
+            if instrumentation is not None and waited > 0:
+                instrumentation.increment(action, 'limiter_wait_seconds', waited)
+            try:
+                response = inner(action, params, path, verb)
+            except BotoServerError as e:
+                throttled = e.error_code in THROTTLING_CODES
+                if attempt == retries or not (throttled or e.status >= 500):
+                    raise
+                reason = e.error_code or e.status
+            else:
+                if response.status < 400 or attempt == retries:
+                    return response
+                reason = error_code(response.read())
+                throttled = reason in THROTTLING_CODES
+                if not throttled:
+                    return response
+            if throttled:
+                limiter.backoff(action)
+            if instrumentation is not None:
+                instrumentation.record_retry(action)
+            delay = decorrelated_jitter(base, cap, delay)
+            logging.debug("{} failed ({}), retrying in {:.2f}s.".format(action, reason, delay))
+            time.sleep(delay)
+
+    connection._mexe = _mexe
+    connection.make_request = make_request
+    connection.limiter = limiter
+    return connection
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+Native file transfers over an already authenticated paramiko Transport.
+"""
+
+import os
+import mmap
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+# Size of a single SFTP read/write request, matches paramiko.SFTPFile.MAX_REQUEST_SIZE
+CHUNK_SIZE = 32768
+
+
+def human_size(nbytes):
+    """
+    Formats a number of bytes in a human readable way.
+
+    :param int nbytes: Number of bytes.
+
+    :return: The formatted size (e.g : "12.3 MB")
+    :rtype: string
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(nbytes) < 1024.0:
+            return "{:.1f} {}".format(nbytes, unit)
+        nbytes /= 1024.0
+    return "{:.1f} TB".format(nbytes)
+
+
+class TransferStats:
+    """
+    Keeps track of the amount of data moved by a TransferEngine and of the time it took. Safe to share between the
+    worker threads of an engine.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.reused = 0
+        self.errors = list()
+        self.start = time.time()
+        self.end = None
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        """
+        Accounts for a chunk of transferred data.
+
+        :param int nbytes: Size of the chunk.
+        """
+        with self._lock:
+            self.bytes += nbytes
+
+    def reuse(self, nbytes):
+        """
+        Accounts for data that didn't have to be sent because the destination already held it.
+
+        :param int nbytes: Size of the data.
+        """
+        with self._lock:
+            self.reused += nbytes
+
+    def file_done(self, skipped=False):
+        """
+        Accounts for a finished file.
+
+        :param bool skipped: True if the file was already complete at the destination. Default : False.
+        """
+        with self._lock:
+            self.files += 1
+            if skipped:
+                self.skipped += 1
+
+    def error(self, path, exc):
+        """
+        Records a failed file.
+
+        :param string path: The file that failed.
+        :param Exception exc: The raised exception.
+        """
+        logging.error("Transfer of {} failed : {}".format(path, exc))
+        with self._lock:
+            self.errors.append((path, exc))
+
+    def stop(self):
+        """
+        Marks the end of the transfer.
+
+        :return: This instance.
+        :rtype: TransferStats
+        """
+        self.end = time.time()
+        return self
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def throughput(self):
+        """
+        Average throughput in bytes per second.
+        """
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return "{} file(s) ({} skipped, {} failed), {} in {:.2f}s ({}/s){}".format(
+            self.files, self.skipped, len(self.errors), human_size(self.bytes), self.elapsed,
+            human_size(self.throughput), ", {} reused".format(human_size(self.reused)) if self.reused else "",
+        )
+
+
+class TransferEngine:
+    """
+    Moves files over an existing paramiko Transport using SFTP. Remote reads are prefetched and remote writes are
+    pipelined so that many requests are in flight on the channel, several files are transferred at the same time (one
+    SFTP channel per worker thread, all on the same Transport) and partial files are resumed from the size already
+    present at the destination, once checked against the source (see resume_point). Local files are memory mapped and
+    sent by slices of a memoryview, without copying them into intermediate buffers.
+
+    :param paramiko.Transport transport:
+        An authenticated transport, e.g : ``CloudApp.ssh_client.get_transport()``.
+    :param int workers:
+        Number of files transferred at the same time. Default : 4.
+    :param int chunk_size:
+        Size of each read/write request. Default : 32768.
+    :param callable callback:
+        Called as ``callback(path, transferred, total)`` after each chunk. Default : None.
+    """
+
+    def __init__(self, transport, workers=4, chunk_size=CHUNK_SIZE, callback=None):
+        self.transport = transport
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self._local = threading.local()
+        self._clients = list()
+        self._lock = threading.Lock()
+
+    @property
+    def sftp(self):
+        """
+        The SFTP client of the calling thread, opened on first use.
+
+        :rtype: paramiko.SFTPClient
+        """
+        client = getattr(self._local, 'sftp', None)
+        if client is None:
+            client = paramiko.SFTPClient.from_transport(self.transport)
+            self._local.sftp = client
+            with self._lock:
+                self._clients.append(client)
+        return client
+
+    def close(self):
+        """
+        Closes every SFTP channel opened by this engine. The transport itself is left open.
+        """
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = list()
+        self._local = threading.local()
+
+    def remote_size(self, path):
+        """
+        Size of a remote file.
+
+        :param string path: Absolute path of the remote file.
+
+        :return: The size in bytes or None if the file doesn't exist.
+        :rtype: int
+        """
+        try:
+            return self.sftp.stat(path).st_size
+        except IOError:
+            return None
+
+    @staticmethod
+    def resume_offset(done, total):
+        """
+        Computes where a transfer should start given what is already at the destination. A destination larger than the
+        source can't be a partial copy and is rewritten from the start.
+
+        :param int done: Size already present at the destination, None if there is nothing.
+        :param int total: Size of the source.
+
+        :return: The offset to start from.
+        :rtype: int
+        """
+        if done is None or done > total:
+            return 0
+        return done
+
+    @staticmethod
+    def _remote_stat(sftp, path):
+        try:
+            return sftp.stat(path)
+        except IOError:
+            return None
+
+    @staticmethod
+    def _read_local(path, offset, size):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    @staticmethod
+    def _read_remote(sftp, path, offset, size):
+        with sftp.open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def resume_point(self, done, total, src_mtime, dest_mtime, read_src, read_dest):
+        """
+        Checks that a file at the destination is a copy of the start of the source before resuming it : it must not be
+        larger than the source nor older than its last modification, and its first and last blocks must match the same
+        blocks of the source. Otherwise, the transfer starts over.
+
+        :param int done: Size already present at the destination, None if there is nothing.
+        :param int total: Size of the source.
+        :param float src_mtime: Modification time of the source.
+        :param float dest_mtime: Modification time of the destination.
+        :param callable read_src: Called as ``read_src(offset, size)``, returns bytes of the source.
+        :param callable read_dest: Called as ``read_dest(offset, size)``, returns bytes of the destination.
+
+        :return: The offset to start from, the total size if the destination is already complete.
+        :rtype: int
+        """
+        offset = self.resume_offset(done, total)
+        if not offset:
+            return 0
+        # SFTP only keeps whole seconds, and may not send them
+        if src_mtime is None or dest_mtime is None or int(dest_mtime) < int(src_mtime):
+            return 0
+        for start in {0, max(0, offset - self.chunk_size)}:
+            size = min(self.chunk_size, offset - start)
+            if read_src(start, size) != read_dest(start, size):
+                return 0
+        return offset
+
+    def _progress(self, path, transferred, total, nbytes, stats):
+        stats.add(nbytes)
+        if self.callback is not None:
+            self.callback(path, transferred, total)
+
+    def put(self, local_path, remote_path, resume=True, stats=None):
+        """
+        Uploads a local file.
+
+        :param string local_path: Path of the local file.
+        :param string remote_path: Absolute path of the destination file.
+        :param bool resume: Resume a partial upload, once checked, instead of starting over. Default : True.
+        :param TransferStats stats: Statistics to update. Default : None (a new object is created).
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        stats = stats if stats is not None else TransferStats()
+        local_stat = os.stat(local_path)
+        total = local_stat.st_size
+        remote_stat = self._remote_stat(self.sftp, remote_path) if resume else None
+        offset = 0
+        if remote_stat is not None:
+            offset = self.resume_point(remote_stat.st_size, total, local_stat.st_mtime, remote_stat.st_mtime,
+                                       lambda pos, size: self._read_local(local_path, pos, size),
+                                       lambda pos, size: self._read_remote(self.sftp, remote_path, pos, size))
+        if offset and offset == total:
+            stats.file_done(skipped=True)
+            return stats
+        with open(local_path, 'rb') as local_file, \
+                self.sftp.open(remote_path, 'r+b' if offset else 'wb', bufsize=0) as remote_file:
+            remote_file.set_pipelined(True)
+            remote_file.seek(offset)
+            if total:
+                mapped = mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mapped)
+                try:
+                    for pos in range(offset, total, self.chunk_size):
+                        end = min(pos + self.chunk_size, total)
+                        remote_file.write(view[pos:end])
+                        self._progress(remote_path, end, total, end - pos, stats)
+                finally:
+                    view.release()
+                    mapped.close()
+        stats.file_done()
+        return stats
+
+    def get(self, remote_path, local_path, resume=True, stats=None):
+        """
+        Downloads a remote file.
+
+        :param string remote_path: Absolute path of the remote file.
+        :param string local_path: Path of the local destination file.
+        :param bool resume: Resume a partial download, once checked, instead of starting over. Default : True.
+        :param TransferStats stats: Statistics to update. Default : None (a new object is created).
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        stats = stats if stats is not None else TransferStats()
+        remote_stat = self.sftp.stat(remote_path)
+        total = remote_stat.st_size
+        offset = 0
+        if resume and os.path.exists(local_path):
+            local_stat = os.stat(local_path)
+            offset = self.resume_point(local_stat.st_size, total, remote_stat.st_mtime, local_stat.st_mtime,
+                                       lambda pos, size: self._read_remote(self.sftp, remote_path, pos, size),
+                                       lambda pos, size: self._read_local(local_path, pos, size))
+        if offset and offset == total:
+            stats.file_done(skipped=True)
+            return stats
+        with self.sftp.open(remote_path, 'rb') as remote_file, \
+                open(local_path, 'r+b' if offset else 'wb') as local_file:
+            remote_file.seek(offset)
+            remote_file.prefetch(total)
+            local_file.seek(offset)
+            self._pump(remote_file, local_file, remote_path, offset, total, stats)
+        stats.file_done()
+        return stats
+
+    def relay(self, source, src_path, dest_path, resume=True, stats=None):
+        """
+        Streams a file from the host of another engine to the host of this one, without writing it locally.
+
+        :param TransferEngine source: Engine connected to the host holding the file.
+        :param string src_path: Absolute path of the file on the source host.
+        :param string dest_path: Absolute path of the destination file on this host.
+        :param bool resume: Resume a partial copy, once checked, instead of starting over. Default : True.
+        :param TransferStats stats: Statistics to update. Default : None (a new object is created).
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        stats = stats if stats is not None else TransferStats()
+        src_stat = source.sftp.stat(src_path)
+        total = src_stat.st_size
+        dest_stat = self._remote_stat(self.sftp, dest_path) if resume else None
+        offset = 0
+        if dest_stat is not None:
+            offset = self.resume_point(dest_stat.st_size, total, src_stat.st_mtime, dest_stat.st_mtime,
+                                       lambda pos, size: self._read_remote(source.sftp, src_path, pos, size),
+                                       lambda pos, size: self._read_remote(self.sftp, dest_path, pos, size))
+        if offset and offset == total:
+            stats.file_done(skipped=True)
+            return stats
+        with source.sftp.open(src_path, 'rb') as src_file, \
+                self.sftp.open(dest_path, 'r+b' if offset else 'wb', bufsize=0) as dest_file:
+            src_file.seek(offset)
+            src_file.prefetch(total)
+            dest_file.set_pipelined(True)
+            dest_file.seek(offset)
+            self._pump(src_file, dest_file, dest_path, offset, total, stats)
+        stats.file_done()
+        return stats
+
+    def _pump(self, reader, writer, path, offset, total, stats):
+        transferred = offset
+        while transferred < total:
+            data = reader.read(self.chunk_size)
+            if not data:
+                break
+            writer.write(data)
+            transferred += len(data)
+            self._progress(path, transferred, total, len(data), stats)
+
+    def _run_many(self, func, jobs, resume):
+        stats = TransferStats()
+
+        def worker(job):
+            try:
+                func(*job, resume=resume, stats=stats)
+            except (IOError, OSError, paramiko.SSHException) as e:
+                stats.error(job[-1], e)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(worker, jobs))
+        return stats.stop()
+
+    def put_many(self, pairs, resume=True):
+        """
+        Uploads several files concurrently. Failures are recorded in the returned statistics instead of being raised.
+
+        :param list pairs: List of (local_path, remote_path) tuples.
+        :param bool resume: Resume partial uploads. Default : True.
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        return self._run_many(self.put, list(pairs), resume)
+
+    def get_many(self, pairs, resume=True):
+        """
+        Downloads several files concurrently. Failures are recorded in the returned statistics instead of being raised.
+
+        :param list pairs: List of (remote_path, local_path) tuples.
+        :param bool resume: Resume partial downloads. Default : True.
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        return self._run_many(self.get, list(pairs), resume)
+
+    def relay_many(self, source, pairs, resume=True):
+        """
+        Streams several files concurrently from the host of another engine. Failures are recorded in the returned
+        statistics instead of being raised.
+
+        :param TransferEngine source: Engine connected to the host holding the files.
+        :param list pairs: List of (src_path, dest_path) tuples.
+        :param bool resume: Resume partial copies. Default : True.
+
+        :return: The transfer statistics.
+        :rtype: TransferStats
+        """
+        return self._run_many(self.relay, [(source, src, dest) for src, dest in pairs], resume)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Named tuning profiles for SSH transports and a throughput self-test.
+"""
+
+import os
+import time
+from collections import namedtuple
+
+import paramiko
+
+from .transfer import human_size
+
+TransportProfile = namedtuple('TransportProfile', ['name', 'window_size', 'max_packet_size', 'ciphers', 'compress',
+                                                   'rekey_bytes'])
+
+PROFILES = {
+    # paramiko defaults
+    'default': TransportProfile('default', None, None, (), False, None),
+    # Large window and packets so that the link isn't idle waiting for window adjustments, AEAD ciphers (GCM is
+    # offloaded by AES-NI) and no compression, which costs more CPU than it saves on a fast network.
+    'bulk': TransportProfile('bulk', 64 * 1024 * 1024, 256 * 1024,
+                             ('aes128-gcm@openssh.com', 'aes256-gcm@openssh.com'), False, 2 ** 34),
+    # Slow or metered links, where compression pays off.
+    'wan': TransportProfile('wan', 8 * 1024 * 1024, 32 * 1024, (), True, None),
+}
+
+
+def get_profile(profile):
+    """
+    Returns a profile from its name.
+
+    :param profile: Name of a profile (one of PROFILES) or a TransportProfile.
+
+    :raises ValueError: If the profile doesn't exist.
+    :rtype: TransportProfile
+    """
+    if isinstance(profile, TransportProfile):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError("Unknown transport profile {}. Available : {}.".format(profile, ", ".join(sorted(PROFILES))))
+
+
+def connect_kwargs(profile):
+    """
+    Keyword arguments of paramiko.SSHClient.connect() negotiating the cipher and compression of a profile. The other
+    ciphers are disabled, unless this version of paramiko supports none of the ciphers of the profile (AES-GCM needs
+    paramiko 3.3), in which case paramiko negotiates its usual ones.
+
+    :param profile: Name of a profile or a TransportProfile.
+
+    :rtype: dict
+    """
+    profile = get_profile(profile)
+    kwargs = dict(compress=profile.compress)
+    supported = paramiko.Transport._preferred_ciphers
+    if any(cipher in supported for cipher in profile.ciphers):
+        kwargs['disabled_algorithms'] = {'ciphers': [c for c in supported if c not in profile.ciphers]}
+    return kwargs
+
+
+def apply_profile(transport, profile):
+    """
+    Applies the window and packet sizes of a profile to a connected transport. They are used by every channel opened
+    afterwards (exec, SFTP…).
+
+    :param paramiko.Transport transport: A connected transport.
+    :param profile: Name of a profile or a TransportProfile.
+
+    :return: The transport.
+    :rtype: paramiko.Transport
+    """
+    profile = get_profile(profile)
+    if profile.window_size is not None:
+        transport.default_window_size = profile.window_size
+    if profile.max_packet_size is not None:
+        transport.default_max_packet_size = profile.max_packet_size
+    if profile.rekey_bytes is not None:
+        transport.packetizer.REKEY_BYTES = profile.rekey_bytes
+    return transport
+
+
+def self_test(client, size=64 * 1024 * 1024, chunk_size=1024 * 1024):
+    """
+    Measures the raw throughput of a connection in both directions, without touching the disks : random data is sent
+    to ``cat > /dev/null`` and read from ``head -c /dev/urandom``.
+
+    :param paramiko.SSHClient client: A connected client.
+    :param int size: Number of bytes sent in each direction. Default : 64 MiB.
+    :param int chunk_size: Size of the writes and reads. Default : 1 MiB.
+
+    :raises RuntimeError: If a remote command failed.
+    :return: A dict with the upload and download throughputs (bytes/s) and the negotiated cipher and compression.
+    :rtype: dict
+    """
+    transport = client.get_transport()
+    data = os.urandom(chunk_size)
+
+    channel = transport.open_session()
+    channel.exec_command('cat > /dev/null')
+    start = time.time()
+    sent = 0
+    while sent < size:
+        sent += channel.send(data[:size - sent])
+    channel.shutdown_write()
+    status = channel.recv_exit_status()
+    upload = sent / max(time.time() - start, 1e-9)
+    channel.close()
+    if status != 0:
+        raise RuntimeError("Upload test exited with status {}.".format(status))
+
+    channel = transport.open_session()
+    channel.exec_command('head -c {} /dev/urandom'.format(size))
+    start = time.time()
+    received = 0
+    while True:
+        chunk = channel.recv(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+    status = channel.recv_exit_status()
+    download = received / max(time.time() - start, 1e-9)
+    channel.close()
+    if status != 0 or received != size:
+        raise RuntimeError("Download test exited with status {} after {} bytes.".format(status, received))
+
+    return dict(
+        upload=upload,
+        download=download,
+        cipher=transport.remote_cipher,
+        compression=transport.remote_compression,
+        window_size=transport.default_window_size,
+        max_packet_size=transport.default_max_packet_size,
+    )
+
+
+def format_self_test(result):
+    """
+    Formats the result of self_test().
+
+    :param dict result: The result of self_test().
+
+    :rtype: string
+    """
+    return "upload {}/s, download {}/s ({}, compression {}, window {}, packets {})".format(
+        human_size(result['upload']), human_size(result['download']), result['cipher'], result['compression'],
+        human_size(result['window_size']), human_size(result['max_packet_size']),
+    )
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import signal
+
+import click
+from starwatts import StarWatts
+from starwatts.daemon import Daemon
+from daemon_client import DEFAULT_SOCKET
+
+
+@click.command()
+@click.option('--conf', default='conf.yml', type=click.Path(exists=True))
+@click.option('--socket', 'path', default=DEFAULT_SOCKET)
+@click.option('--refresh', default=60.0, help="Seconds between two refreshes of the inventory.")
+def cli(conf, path, refresh):
+    daemon = Daemon(StarWatts(conf), path, refresh, conf).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    click.secho("Serving {} instance(s) on {}".format(len(daemon.inventory), path), fg='green')
+    try:
+        daemon.wait()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+if __name__ == '__main__':
+    cli()
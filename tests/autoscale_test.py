@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from starwatts.autoscale import Autoscaler, JobQueue, SimulatedClock
+
+
+class FakeInstance:
+    def __init__(self, backend, name, instance_type):
+        self.backend = backend
+        self.name = name
+        self.instance_type = instance_type
+        self.state = 'running'
+
+    def terminate_and_clean(self, confirm=True):
+        self.state = 'terminated'
+
+
+class FakeEC2:
+    """
+    Stand-in for the EC2 API launching instances instantly.
+    """
+
+    def __init__(self):
+        self.instances = list()
+
+    def launch(self, instance_type, name):
+        inst = FakeInstance(self, name, instance_type)
+        self.instances.append(inst)
+        return inst
+
+    def running(self):
+        return [i for i in self.instances if i.state == 'running']
+
+
+class Simulation:
+    def __init__(self, job_seconds=100, **kwargs):
+        self.clock = SimulatedClock()
+        self.ec2 = FakeEC2()
+        self.queue = JobQueue(clock=self.clock)
+        self.job_seconds = job_seconds
+        self.finishing = list()
+        self.scaler = Autoscaler(self.queue, self.ec2.launch, runner=self.run_job, clock=self.clock,
+                                 job_seconds=job_seconds, **kwargs)
+
+    def run_job(self, name, instance, job):
+        assert instance.state == 'running'
+        self.finishing.append((self.clock() + self.job_seconds, job.id))
+
+    def tick(self, seconds=10):
+        for end, job_id in [f for f in self.finishing if f[0] <= self.clock()]:
+            self.queue.complete(job_id)
+            self.finishing.remove((end, job_id))
+        decision = self.scaler.step()
+        self.scaler.wait_launches()
+        self.clock.sleep(seconds)
+        return decision
+
+
+def test_job_queue():
+    clock = SimulatedClock()
+    queue = JobQueue(clock=clock)
+    first = queue.put('a', 'render a')
+    queue.put('b')
+    clock.sleep(5)
+    assert queue.counts() == (2, 0)
+    assert queue.oldest_wait() == 5
+    job = queue.claim('w1')
+    assert (job.id, job.payload) == (first, 'render a')
+    clock.sleep(10)
+    queue.complete(job.id)
+    assert queue.mean_duration() == 10
+    assert queue.claim('w1').name == 'b'
+    assert queue.requeue('w1') == 1
+    assert queue.counts() == (1, 0)
+
+
+def test_claims_from_two_connections(tmpdir):
+    path = str(tmpdir.join('jobs.db'))
+    queues = [JobQueue(path), JobQueue(path)]
+    for i in range(200):
+        queues[0].put('job{}'.format(i))
+    claimed = [list(), list()]
+    start = threading.Barrier(2)
+
+    def worker(i):
+        start.wait()
+        for job in iter(lambda: queues[i].claim('w{}'.format(i)), None):
+            claimed[i].append(job.id)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed[0] + claimed[1]) == list(range(1, 201))
+    assert queues[1].running('w0') == len(claimed[0])
+
+
+def test_scales_up_and_down():
+    sim = Simulation(target_latency=200, max_nodes=5, scale_up_cooldown=30, scale_down_cooldown=100)
+    for i in range(20):
+        sim.queue.put('job{}'.format(i))
+    decision = sim.tick()
+    assert decision.desired == 5 and decision.launched == 5
+    sim.tick()
+    assert len(sim.scaler.nodes) == 5
+    for _ in range(100):
+        sim.tick()
+    assert sim.queue.counts() == (0, 0)
+    assert len(sim.ec2.running()) == 0
+    assert sim.scaler.launched == sim.scaler.terminated == 5
+
+
+def test_cooldown_and_max_nodes():
+    sim = Simulation(target_latency=50, max_nodes=3, scale_up_cooldown=60)
+    sim.queue.put('job0')
+    assert sim.tick().launched == 1
+    for i in range(1, 10):
+        sim.queue.put('job{}'.format(i))
+    assert sim.tick().launched == 0
+    for _ in range(5):
+        sim.tick()
+    assert len(sim.ec2.instances) == 3
+    sim.scaler.shutdown()
+    assert len(sim.ec2.running()) == 0
+    assert sim.queue.counts()[1] == 0
+
+
+def test_lower_latency_with_more_nodes():
+    waits = list()
+    for max_nodes in (1, 4):
+        sim = Simulation(target_latency=60, max_nodes=max_nodes)
+        for i in range(12):
+            sim.queue.put('job{}'.format(i))
+        for _ in range(200):
+            sim.tick()
+        waits.append(sim.queue.mean_wait())
+    assert waits[1] < waits[0] / 2
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import threading
+
+import boto
+import pytest
+
+from starwatts import StarWatts
+from starwatts.batch import Loader, current_batch
+
+VOLUME = (
+    '<item><volumeId>vol-{n}</volumeId><size>10</size><snapshotId/><availabilityZone>eu-west-2a</availabilityZone>'
+    '<status>in-use</status><createTime>2016-02-04T14:15:42.000Z</createTime><attachmentSet><item>'
+    '<volumeId>vol-{n}</volumeId><instanceId>i-{n:08x}</instanceId><device>/dev/sd{device}</device>'
+    '<status>attached</status></item></attachmentSet><volumeType>standard</volumeType></item>'
+)
+
+DESCRIBE_VOLUMES = (
+    '<?xml version="1.0" encoding="UTF-8"?><DescribeVolumesResponse><requestId>r</requestId><volumeSet>{}</volumeSet>'
+    '</DescribeVolumesResponse>'
+)
+
+# Instances i-00000000 to i-00000007, with two volumes each but the last one
+FLEET = 8
+VOLUMES = [(n, device) for n in range(FLEET - 1) for device in 'ab']
+
+
+def filter_values(params, name):
+    for key, value in params.items():
+        match = re.match(r'Filter\.(\d+)\.Name$', key)
+        if match and value[0] == name:
+            return {v[0] for k, v in params.items() if k.startswith('Filter.{}.Value.'.format(match.group(1)))}
+    return None
+
+
+def describe_volumes(params):
+    ids = filter_values(params, 'attachment.instance-id')
+    return 200, DESCRIBE_VOLUMES.format(''.join(VOLUME.format(n=n, device=d) for n, d in VOLUMES
+                                                if ids is None or 'i-{:08x}'.format(n) in ids))
+
+
+@pytest.fixture
+def fleet(ec2, instances_xml):
+    def describe_instances(params):
+        ids = filter_values(params, 'instance-id')
+        return 200, instances_xml(numbers=[n for n in range(FLEET) if ids is None or 'i-{:08x}'.format(n) in ids])
+    ec2.handlers['DescribeInstances'] = describe_instances
+    ec2.handlers['DescribeVolumes'] = describe_volumes
+    ec2.handlers['DescribeSecurityGroups'] = ec2.describe_security_groups
+    return ec2
+
+
+def test_loader():
+    fetched = list()
+
+    def fetch(keys):
+        fetched.append(sorted(keys))
+        time.sleep(0.05)
+        return {k: k * 2 for k in keys if k != 3}
+    loader = Loader(fetch, list, tick=0.05, max_keys=4)
+    loader.enqueue([1, 2])
+    assert loader.load(1) == 2
+    assert loader.load(2) == 4
+    assert fetched == [[1, 2]]
+    # The keys asked for by other threads during the tick are fetched together, by batches of max_keys
+    loader.clear()
+    results = list()
+    threads = [threading.Thread(target=lambda k=k: results.append(loader.load(k))) for k in range(3, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(map(str, results)) == sorted(map(str, [[], 8, 10, 12, 14, 16]))
+    assert [len(keys) for keys in fetched[-2:]] == [4, 2]
+    assert loader.hits == 1
+
+    def fail(keys):
+        raise ValueError("failed")
+    loader = Loader(fail, tick=0)
+    with pytest.raises(ValueError):
+        loader.load(1)
+    with pytest.raises(ValueError):
+        loader.load(1)
+
+
+def test_attached_volumes(fleet):
+    conn = boto.connect_ec2_endpoint(fleet.url, 'ak', 'sk')
+    instances = conn.get_only_instances()
+    expected = {i.id: sorted(v.id for v in i.get_all_attached_volumes()) for i in instances}
+    assert fleet.calls.count('DescribeVolumes') == FLEET
+    del fleet.calls[:]
+    with conn.batching(instances) as batch:
+        volumes = {i.id: sorted(v.id for v in i.get_all_attached_volumes()) for i in instances}
+        assert instances[0].get_all_attached_volumes()[0].attach_data.device == '/dev/sda'
+    assert volumes == expected and volumes['i-00000007'] == []
+    assert fleet.calls == ['DescribeVolumes']
+    assert str(batch) == "Batch : volumes 1 call(s) for 9 load(s), instances 0 call(s) for 0 load(s), " \
+                         "groups 0 call(s) for 0 load(s)"
+    # Outside of the context, the helpers make their own calls
+    instances[0].get_all_attached_volumes()
+    assert fleet.calls == ['DescribeVolumes'] * 2
+    assert current_batch(conn) is None
+
+
+def test_objects_listed_inside(fleet):
+    conn = boto.connect_ec2_endpoint(fleet.url, 'ak', 'sk')
+    with conn.batching():
+        for inst in conn.get_only_instances():
+            inst.get_all_security_groups_ids()
+            inst.get_single_security_group()
+            inst.get_all_attached_volumes()
+        # The instances attached to the volumes listed are loaded together too
+        for volume in conn.get_all_volumes():
+            assert volume.get_attached_instance().id == volume.attach_data.instance_id
+        # Listing, then the security groups, the volumes and the instances of the volumes, for all the objects at once
+        assert sorted(fleet.calls) == ['DescribeInstances'] * 3 + ['DescribeSecurityGroups'] + ['DescribeVolumes'] * 2
+        with conn.batching() as nested:
+            assert nested is current_batch(conn)
+            assert inst.get_all_security_groups()[0].name == 'standard'
+    assert len(fleet.calls) == 6
+
+
+def test_threads(fleet):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=fleet.url, single_flight=False)
+    volumes = s.conn.get_all_volumes()
+    del fleet.calls[:]
+    barrier = threading.Barrier(len(volumes))
+    with s.conn.batching(tick=0.05):
+        def attached(volume):
+            barrier.wait()
+            return volume.get_attached_instance().id
+        threads = list()
+        results = list()
+        for volume in volumes:
+            threads.append(threading.Thread(target=lambda v=volume: results.append(attached(v))))
+            threads[-1].start()
+        for t in threads:
+            t.join()
+    assert sorted(set(results)) == ['i-{:08x}'.format(n) for n in range(FLEET - 1)]
+    assert fleet.calls == ['DescribeInstances']
+
+
+def test_starwatts(fleet):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=fleet.url)
+    instances = s.conn.get_only_instances()
+    with s.batching(instances):
+        assert sum(len(i.get_all_attached_volumes()) for i in instances) == len(VOLUMES)
+    assert fleet.calls == ['DescribeInstances', 'DescribeVolumes']
+
+
+def test_pool_connections(fleet):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=fleet.url)
+    with s.batching():
+        with s.connection() as conn:
+            instances = conn.get_only_instances()
+        with s.connection() as conn:
+            # Rebound to the other connection, in the same context
+            volumes = {i.id: len(i.get_all_attached_volumes()) for i in conn.get_only_instances()}
+    assert sum(volumes.values()) == len(VOLUMES) and len(instances) == FLEET
+    assert fleet.calls.count('DescribeVolumes') == 1
+
+
+def test_shared_context(fleet):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=fleet.url)
+    instances = s.conn.get_only_instances()
+    entered = threading.Barrier(2)
+    first_left = threading.Event()
+    seen = list()
+
+    def first():
+        with s.batching(instances):
+            entered.wait()
+        first_left.set()
+
+    def second():
+        with s.batching(instances) as batch:
+            entered.wait()
+            first_left.wait()
+            # Still inside : the batch outlives the context that created it
+            seen.append(current_batch(s.conn) is batch)
+            with s.connection() as conn:
+                seen.append(current_batch(conn) is batch)
+            seen.append(sum(len(i.get_all_attached_volumes()) for i in instances))
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert seen == [True, True, len(VOLUMES)]
+    assert current_batch(s.conn) is None
+    assert fleet.calls.count('DescribeVolumes') == 1
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from starwatts.catalog import ImageCatalog, invalidating
+
+
+class FakeImage:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeConnection:
+    def __init__(self, names):
+        self.names = names
+        self.calls = list()
+
+    def get_all_images(self, owners=None, filters=None):
+        self.calls.append((owners, filters))
+        time.sleep(0.05)
+        if filters:
+            return [FakeImage(n) for n in self.names if n == filters['name']]
+        return [FakeImage(n) for n in self.names]
+
+    @invalidating
+    def deregister_image(self, image_id):
+        self.names.remove(image_id)
+
+
+def test_lookup_cached():
+    conn = FakeConnection(['blender-2.72-prod', 'guerilla-1.3.2-prod'])
+    catalog = ImageCatalog(conn)
+    conn._image_catalog = catalog
+    for _ in range(10):
+        assert catalog.lookup('blender-2.72-prod')[0].name == 'blender-2.72-prod'
+    assert len(conn.calls) == 1
+    assert len(catalog.lookup('*-prod')) == 2
+    assert catalog.lookup('unknown') == []
+    assert catalog.lookup('unknown') == []
+    assert len(conn.calls) == 2
+
+
+def test_lookup_coalesced():
+    conn = FakeConnection(['blender-2.72-prod'])
+    catalog = ImageCatalog(conn)
+    threads = [threading.Thread(target=catalog.lookup, args=('blender-2.72-prod',)) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(conn.calls) == 1
+
+
+def test_invalidation():
+    conn = FakeConnection(['blender-2.72-prod'])
+    catalog = ImageCatalog(conn, ttl=0.1)
+    conn._image_catalog = catalog
+    catalog.lookup('blender-2.72-prod')
+    conn.deregister_image('blender-2.72-prod')
+    assert catalog.lookup('blender-2.72-prod') == []
+    time.sleep(0.15)
+    catalog.lookup('blender-2.72-prod')
+    assert len(conn.calls) == 5
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from boto.exception import EC2ResponseError
+
+from starwatts import StarWatts
+from starwatts.coalesce import SingleFlight
+
+
+def slow(server, seconds=0.3):
+    answer = server.describe_instances
+
+    def handler(params):
+        time.sleep(seconds)
+        return answer(params)
+    server.handlers['DescribeInstances'] = handler
+
+
+def concurrently(function, n=8):
+    barrier = threading.Barrier(n)
+
+    def call(_):
+        barrier.wait()
+        return function()
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        return list(executor.map(call, range(n)))
+
+
+def test_single_flight():
+    flight = SingleFlight()
+    calls = list()
+
+    def function():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+    results = concurrently(lambda: flight.do('key', function))
+    assert [r for r, _ in results] == [42] * 8
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert flight.in_flight() == 0
+    assert str(flight) == "SingleFlight : 1 call(s), 7 shared"
+    assert flight.do('key', function) == (42, False)
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("failed")
+    with pytest.raises(ValueError):
+        concurrently(lambda: flight.do('other', fail), 4)
+    assert flight.in_flight() == 0
+
+
+def test_coalesces_describe_calls(ec2):
+    slow(ec2)
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url, rate=100, burst=20)
+
+    def describe():
+        with s.connection() as conn:
+            return conn.get_instances_by_tags({'name': 'files'})
+    results = concurrently(describe)
+    assert ec2.calls == ['DescribeInstances']
+    assert all(len(r) == 3 for r in results)
+    # Each caller has its own list
+    assert len({id(r) for r in results}) == 8
+    snap = s.instrumentation.snapshot()['DescribeInstances']
+    assert snap['count'] == 1
+    assert snap['extra']['coalesced'] == 7
+
+    # Other parameters make another call
+    concurrently(lambda: s.conn.get_only_instances(filters={'tag:env': 'dev'}), 2)
+    concurrently(lambda: s.conn.get_only_instances(filters={'tag:env': 'prod'}), 2)
+    assert ec2.calls.count('DescribeInstances') == 3
+
+
+def test_objects_bound_to_the_caller(ec2):
+    slow(ec2)
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url, rate=100, burst=20)
+
+    def describe():
+        with s.connection() as conn:
+            return conn, conn.get_only_instances()
+    results = concurrently(describe, 2)
+    assert ec2.calls == ['DescribeInstances']
+    (first, leader), (second, follower) = results
+    assert first is not second
+    assert all(i.connection is first for i in leader) and all(i.connection is second for i in follower)
+    assert [i.id for i in leader] == [i.id for i in follower]
+    assert not {id(i) for i in leader} & {id(i) for i in follower}
+
+
+def test_errors_are_shared(ec2):
+    def handler(params):
+        time.sleep(0.2)
+        return ec2.error('InvalidParameterValue')
+    ec2.handlers['DescribeInstances'] = handler
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url)
+    errors = list()
+
+    def describe():
+        try:
+            s.conn.get_only_instances()
+        except EC2ResponseError as e:
+            errors.append(e.error_code)
+    concurrently(describe, 4)
+    assert errors == ['InvalidParameterValue'] * 4
+    assert ec2.calls == ['DescribeInstances']
+
+
+def test_writes_are_not_coalesced(ec2):
+    def handler(params):
+        time.sleep(0.1)
+        return 200, '<TerminateInstancesResponse><requestId>r</requestId><instancesSet/></TerminateInstancesResponse>'
+    ec2.handlers['TerminateInstances'] = handler
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url)
+    concurrently(lambda: s.conn.terminate_instances(['i-00000000']), 3)
+    assert ec2.calls == ['TerminateInstances'] * 3
+
+
+def test_disabled(ec2):
+    slow(ec2, 0.1)
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url, single_flight=False)
+    concurrently(s.all_vms, 3)
+    assert ec2.calls == ['DescribeInstances'] * 3
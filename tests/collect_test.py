@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+
+import paramiko
+
+from starwatts.collect import ResultCollector, file_sha1
+
+
+class LocalSFTP:
+    def listdir_attr(self, path):
+        return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name) for name in os.listdir(path)]
+
+
+class LocalEngine:
+    """
+    Stand-in for a TransferEngine working on the local filesystem.
+    """
+
+    def __init__(self):
+        self.sftp = LocalSFTP()
+        self.copied = list()
+
+    def get(self, remote_path, local_path, resume=True, stats=None):
+        shutil.copyfile(remote_path, local_path)
+        self.copied.append(os.path.basename(remote_path))
+        stats.file_done()
+        return stats
+
+    def close(self):
+        pass
+
+
+class LocalOutput:
+    def __init__(self, command):
+        self.proc = subprocess.Popen(['sh', '-c', command], stdout=subprocess.PIPE)
+        self.channel = self
+
+    def read(self):
+        return self.proc.stdout.read()
+
+    def recv_exit_status(self):
+        return self.proc.wait()
+
+
+class LocalClient:
+    def exec_command(self, command):
+        return None, LocalOutput(command), None
+
+
+def make_collector(tmpdir):
+    remote = tmpdir.mkdir('remote')
+    collector = ResultCollector(LocalClient(), str(remote), str(tmpdir.join('local')), pattern='*.exr',
+                                engine=LocalEngine())
+    return remote, collector
+
+
+def test_waits_for_stable_files(tmpdir):
+    remote, collector = make_collector(tmpdir)
+    remote.join('frame_1.exr').write('one')
+    remote.mkdir('sub').join('frame_2.exr').write('two')
+    remote.join('render.log').write('ignored')
+    assert collector.collect().files == 0
+    stats = collector.collect()
+    assert stats.files == 2 and not stats.errors
+    assert tmpdir.join('local', 'sub', 'frame_2.exr').read() == 'two'
+    assert collector.collect().files == 0
+    remote.join('frame_3.exr').write('three')
+    assert collector.collect(final=True).files == 1
+    assert sorted(collector.engine.copied) == ['frame_1.exr', 'frame_2.exr', 'frame_3.exr']
+
+
+def test_checksum_mismatch(tmpdir):
+    remote, collector = make_collector(tmpdir)
+    remote.join('frame_1.exr').write('one')
+    collector.engine.get = lambda remote_path, local_path, resume=True, stats=None: open(local_path, 'w').write('bad')
+    stats = collector.collect(final=True)
+    assert len(stats.errors) == 1
+    assert not tmpdir.join('local', 'frame_1.exr').exists()
+    assert collector.done == dict()
+
+
+def test_file_sha1(tmpdir):
+    path = tmpdir.join('f')
+    path.write('abc')
+    assert file_sha1(str(path)) == 'a9993e364706816aba3e25717850c26c9cd0d89d'
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import boto
+import pytest
+
+from starwatts.columnar import ColumnarInventory, shared_memory
+from starwatts.records import parse, INSTANCE_FORMAT
+
+
+@pytest.fixture
+def records(instances_xml):
+    return parse(instances_xml(50), INSTANCE_FORMAT)[0]
+
+
+def running_prod(inventory):
+    return [inventory[row].id for row in inventory.select(tags={'env': 'prod'}, state='running')]
+
+
+def test_round_trip(records):
+    inventory = ColumnarInventory.from_records(records)
+    assert len(inventory) == 50
+    assert list(inventory) == records
+    assert inventory[-1] == records[-1]
+    with pytest.raises(IndexError):
+        inventory[50]
+    assert inventory.column('ip_address') == ['1.2.3.0'] + [None] * 49
+    assert inventory.tags(7) == {'name': 'node7', 'env': 'prod'}
+    assert inventory.count_by('instance_type') == {'t1.micro': 25, 'm1.xlarge': 25}
+    assert running_prod(inventory) == [r.id for r in records if r.tags['env'] == 'prod' and r.state == 'running']
+    assert inventory.select(state='pending') == []
+    assert inventory.select(tags={'env': 'staging'}) == []
+    assert len(inventory.select()) == 50
+    # Decoded from the buffer only
+    copy = pickle.loads(pickle.dumps(inventory))
+    assert copy._codes is None and list(copy) == records
+    assert str(inventory) == "ColumnarInventory : 50 instance(s), 100 tag(s), {} bytes".format(inventory.nbytes)
+
+    with pytest.raises(ValueError):
+        ColumnarInventory(b'\0' * 64)
+
+
+def test_memory(instances_xml):
+    conn = boto.connect_ec2_endpoint('http://localhost:1', 'ak', 'sk')
+    records = parse(instances_xml(5000), INSTANCE_FORMAT)[0]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        instances = [r.to_boto(conn) for r in records]
+        boto_size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    inventory = ColumnarInventory.from_records(records)
+    assert len(instances) == 5000
+    assert inventory.nbytes * 10 < boto_size
+
+
+@pytest.mark.skipif(shared_memory is None, reason="Shared memory requires Python 3.8")
+def test_shared_memory(records):
+    inventory = ColumnarInventory.from_records(records).share()
+    try:
+        # Workers receive the name of the block only
+        assert len(pickle.dumps(inventory)) < 200
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            assert list(executor.map(running_prod, [inventory] * 2)) == [running_prod(inventory)] * 2
+    finally:
+        inventory.unlink()
+
+
+def test_file(records, tmpdir):
+    path = str(tmpdir.join('inventory'))
+    inventory = ColumnarInventory.from_records(records).save(path)
+    assert os.path.getsize(path) == inventory.nbytes
+    assert pickle.dumps(inventory).count(path.encode('utf-8')) == 1
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        assert list(executor.map(running_prod, [inventory] * 2)) == [running_prod(inventory)] * 2
+    with ColumnarInventory.open(path) as mapped:
+        assert list(mapped) == records
+    inventory.unlink()
+    assert not os.path.exists(path)
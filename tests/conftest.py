@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import os
+import gzip
+import select
+import threading
+import subprocess
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
 
 import pytest
 from boto.exception import EC2ResponseError
@@ -68,3 +75,306 @@ def instance():
     from starwatts import StarWatts
     s = StarWatts(access_key=os.environ['ACCESS_KEY'], secret_key=os.environ['PRIVATE_KEY'])
     return s.conn.get_only_instances()[0]
+
+
+class LocalChannel:
+    """
+    Minimal stand-in for a paramiko.Channel running a local shell.
+    """
+
+    def __init__(self):
+        self.proc = subprocess.Popen(['sh'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.closed = False
+        self._out = b''
+        self._err = b''
+
+    def exec_command(self, command):
+        pass
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def fileno(self):
+        return self.proc.stdout.fileno()
+
+    def _poll(self):
+        readable, _, _ = select.select([self.proc.stdout, self.proc.stderr], [], [], 0.05)
+        for stream in readable:
+            data = os.read(stream.fileno(), 65536)
+            if stream is self.proc.stdout:
+                self._out += data
+            else:
+                self._err += data
+
+    def recv_ready(self):
+        self._poll()
+        return bool(self._out)
+
+    def recv_stderr_ready(self):
+        self._poll()
+        return bool(self._err)
+
+    def recv(self, size):
+        data, self._out = self._out, b''
+        return data
+
+    def recv_stderr(self, size):
+        data, self._err = self._err, b''
+        return data
+
+    def exit_status_ready(self):
+        return self.proc.poll() is not None
+
+    def close(self):
+        self.closed = True
+        self.proc.kill()
+
+
+class LocalClient:
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        return LocalChannel()
+
+
+@pytest.fixture
+def shell(request):
+    from starwatts.session import ShellSession
+    session = ShellSession(LocalClient())
+    request.addfinalizer(session.close)
+    return session
+
+
+INSTANCE = (
+    '<item><instanceId>{id}</instanceId><instanceType>m1.xlarge</instanceType>'
+    '<instanceState><code>16</code><name>running</name></instanceState>'
+    '<tagSet><item><key>name</key><value>{name}</value></item>'
+    '<item><key>env</key><value>{env}</value></item></tagSet></item>'
+)
+
+DESCRIBE_INSTANCES = (
+    '<?xml version="1.0"?><DescribeInstancesResponse xmlns="http://ec2.amazonaws.com/doc/2014-10-01/">'
+    '<requestId>r</requestId><reservationSet><item><reservationId>r-1</reservationId><ownerId>1</ownerId><groupSet/>'
+    '<instancesSet>{}</instancesSet></item></reservationSet></DescribeInstancesResponse>'
+)
+
+ERROR = (
+    '<?xml version="1.0"?><Response><Errors><Error><Code>{}</Code><Message>Error</Message></Error></Errors>'
+    '<RequestID>r</RequestID></Response>'
+)
+
+
+NAMESPACE = 'xmlns="http://ec2.amazonaws.com/doc/2014-10-01/"'
+
+FULL_INSTANCE = (
+    '<item><instanceId>{id}</instanceId><imageId>ami-14506474</imageId>'
+    '<instanceState><code>16</code><name>{state}</name></instanceState>'
+    '<privateDnsName/><dnsName/><reason/><keyName>starwatts</keyName><amiLaunchIndex>0</amiLaunchIndex>'
+    '<productCodes/><instanceType>{type}</instanceType><launchTime>2016-02-04T14:15:42.000Z</launchTime>'
+    '<placement><availabilityZone>eu-west-2a</availabilityZone><groupName/><tenancy>default</tenancy></placement>'
+    '<monitoring><state>disabled</state></monitoring>'
+    '<privateIpAddress>10.0.0.{n}</privateIpAddress>{public}'
+    '<groupSet><item><groupId>sg-9b5adf25</groupId><groupName>standard</groupName></item></groupSet>'
+    '<networkInterfaceSet><item><networkInterfaceId>eni-{n}</networkInterfaceId><status>in-use</status>'
+    '<privateIpAddress>192.168.0.{n}</privateIpAddress>'
+    '<tagSet><item><key>eni</key><value>nested</value></item></tagSet></item></networkInterfaceSet>'
+    '<blockDeviceMapping><item><deviceName>/dev/sda1</deviceName><ebs><volumeId>vol-{n}</volumeId>'
+    '<status>attached</status></ebs></item></blockDeviceMapping>'
+    '<tagSet><item><key>name</key><value>node{n}</value></item><item><key>env</key><value>{env}</value></item>'
+    '</tagSet></item>'
+)
+
+DESCRIBE_RESERVATIONS = (
+    '<?xml version="1.0" encoding="UTF-8"?><DescribeInstancesResponse ' + NAMESPACE + '><requestId>r</requestId>'
+    '<reservationSet>{}</reservationSet>{}</DescribeInstancesResponse>'
+)
+
+RESERVATION = (
+    '<item><reservationId>r-{n}</reservationId><ownerId>1</ownerId>'
+    '<groupSet><item><groupId>sg-1</groupId></item></groupSet><instancesSet>{}</instancesSet></item>'
+)
+
+DESCRIBE_SECURITY_GROUPS = (
+    '<?xml version="1.0" encoding="UTF-8"?><DescribeSecurityGroupsResponse ' + NAMESPACE + '>'
+    '<requestId>r</requestId><securityGroupInfo><item><ownerId>1</ownerId><groupId>sg-9b5adf25</groupId>'
+    '<groupName>standard</groupName><groupDescription>Standard group</groupDescription>'
+    '<ipPermissions><item><ipProtocol>tcp</ipProtocol><fromPort>22</fromPort><toPort>22</toPort><groups/>'
+    '<ipRanges><item><cidrIp>0.0.0.0/0</cidrIp></item></ipRanges></item></ipPermissions>'
+    '<tagSet><item><key>zone</key><value>starwatts</value></item></tagSet></item></securityGroupInfo>'
+    '</DescribeSecurityGroupsResponse>'
+)
+
+
+class FakeEC2(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP server answering the EC2 API calls. Each action is answered by a handler returning (status, body), the
+    received calls are kept in self.calls.
+    """
+    daemon_threads = True
+
+    def __init__(self, instances=3):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.calls = list()
+        self.headers = list()
+        self.connections = 0
+        self.gzip = False
+        self.lock = threading.Lock()
+        self.instances = [('i-{:08x}'.format(i), 'node{}'.format(i), 'prod' if i % 2 else 'dev')
+                          for i in range(instances)]
+        self.handlers = {'DescribeInstances': self.describe_instances}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def describe_instances(self, params):
+        return 200, DESCRIBE_INSTANCES.format(
+            ''.join(INSTANCE.format(id=i, name=n, env=e) for i, n, e in self.instances))
+
+    def answer(self, params, headers):
+        action = params.get('Action', [''])[0]
+        with self.lock:
+            self.calls.append(action)
+            self.headers.append(headers)
+        handler = self.handlers.get(action)
+        if handler is None:
+            return self.error('InvalidAction')
+        return handler(params)
+
+    def describe_security_groups(self, params):
+        return 200, DESCRIBE_SECURITY_GROUPS
+
+    @staticmethod
+    def error(code, status=400):
+        """
+        :return: The (status, body) of an error answer.
+        """
+        return status, ERROR.format(code)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        params = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        status, body = self.server.answer(params, dict(self.headers))
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        if self.server.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ec2():
+    server = FakeEC2()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def instances_xml():
+    """
+    Builds DescribeInstances responses with complete instances node<n> (i-<n in hex>), alternately dev t1.micro and prod
+    m1.xlarge ones.
+    """
+    def build(count=0, per_reservation=2, next_token=None, offset=0, numbers=None):
+        numbers = range(offset, offset + count) if numbers is None else numbers
+        items = [FULL_INSTANCE.format(id='i-{:08x}'.format(n), n=n, state='running' if i % 3 else 'stopped',
+                                      type='m1.xlarge' if i % 2 else 't1.micro', env='prod' if i % 2 else 'dev',
+                                      public='<ipAddress>1.2.3.{}</ipAddress>'.format(i) if i == 0 else '')
+                 for i, n in enumerate(numbers)]
+        reservations = [RESERVATION.format(''.join(items[i:i + per_reservation]), n=i)
+                        for i in range(0, len(items), per_reservation)]
+        return DESCRIBE_RESERVATIONS.format(''.join(reservations),
+                                            '<nextToken>{}</nextToken>'.format(next_token) if next_token else '')
+    return build
+
+
+class LocalSFTPFile:
+    """
+    Local file with the methods of a paramiko.SFTPFile used by the transfers, binary whatever its mode.
+    """
+
+    def __init__(self, path, mode):
+        self.f = open(path, mode if 'b' in mode else mode + 'b')
+
+    def write(self, data):
+        self.f.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+    def stat(self):
+        return os.fstat(self.f.fileno())
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def prefetch(self, size):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.f.close()
+
+
+class LocalSFTP:
+    """
+    Minimal stand-in for a paramiko.SFTPClient on a local directory.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def stat(self, path):
+        return os.stat(self.path(path))
+
+    def open(self, path, mode='r', bufsize=-1):
+        return LocalSFTPFile(self.path(path), mode)
+
+    def remove(self, path):
+        os.remove(self.path(path))
+
+
+@pytest.fixture
+def sftp_engine():
+    """
+    Builds transfer engines whose SFTP clients work on a local directory.
+    """
+    from starwatts.transfer import TransferEngine
+
+    class LocalEngine(TransferEngine):
+        @property
+        def sftp(self):
+            return self.local_sftp
+
+    def build(root='/', chunk_size=1024):
+        engine = LocalEngine(None, chunk_size=chunk_size)
+        engine.local_sftp = LocalSFTP(root)
+        return engine
+    return build
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto
+import pytest
+
+from starwatts import StarWatts
+from starwatts.connections import ConnectionPool, accept_gzip, keep_alive, warm
+
+
+def fake_starwatts(server, **kwargs):
+    return StarWatts(access_key='ak', secret_key='sk', endpoint=server.url, **kwargs)
+
+
+def connections(server, expected, timeout=5):
+    """
+    Number of connections accepted by the server, once it reached the expected number or after the timeout.
+    """
+    deadline = time.time() + timeout
+    while server.connections < expected and time.time() < deadline:
+        time.sleep(0.01)
+    return server.connections
+
+
+def test_keep_alive(ec2):
+    s = fake_starwatts(ec2)
+    for _ in range(5):
+        s.all_vms()
+    assert ec2.connections == 1
+    http_connection = s.conn.get_http_connection(s.conn.host, s.conn.port, s.conn.is_secure)
+    assert http_connection.sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+
+def test_gzip(ec2):
+    ec2.gzip = True
+    s = fake_starwatts(ec2)
+    assert sorted(inst.tags['name'] for inst in s.conn.get_only_instances()) == ['node0', 'node1', 'node2']
+    assert ec2.headers[0]['Accept-Encoding'] == 'gzip'
+    plain = boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk')
+    assert len(plain.get_only_instances()) == 3
+    assert 'gzip' not in ec2.headers[1].get('Accept-Encoding', '')
+
+
+def test_warm(ec2):
+    conn = keep_alive(accept_gzip(boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk')))
+    assert warm(conn)
+    assert connections(ec2, 1) == 1
+    conn.get_only_instances()
+    assert ec2.connections == 1
+    closed = boto.connect_ec2_endpoint('http://127.0.0.1:1', 'ak', 'sk')
+    assert not warm(closed)
+
+
+def test_prewarm(ec2):
+    s = fake_starwatts(ec2, prewarm=3)
+    s.pool.wait_warm()
+    assert connections(ec2, 3) == 3
+    assert s.pool.created == 2
+    s.all_vms()
+    with s.connection() as a, s.connection() as b:
+        a.get_only_instances()
+        b.get_only_instances()
+    assert ec2.connections == 3
+    assert ec2.calls == ['DescribeInstances'] * 3
+
+
+def test_checkout():
+    created = list()
+    pool = ConnectionPool(lambda: created.append(object()) or created[-1], size=2)
+    a = pool.checkout()
+    b = pool.checkout()
+    assert a is not b and pool.created == 2
+    with pytest.raises(TimeoutError):
+        pool.checkout(timeout=0.05)
+    threading.Timer(0.05, pool.checkin, args=(a,)).start()
+    assert pool.checkout(timeout=5) is a
+    assert pool.waits == 2
+    pool.checkin(a)
+    pool.checkin(b)
+    with pool.connection() as c:
+        assert c in (a, b)
+    assert len(created) == 2
+    assert str(pool) == "ConnectionPool : 2 connection(s), 2 idle, 5 checkout(s), 2 wait(s)"
+
+
+def test_local():
+    pool = ConnectionPool(object, size=4)
+    seen = list()
+
+    def work(_):
+        conn = pool.local()
+        assert pool.local() is conn
+        seen.append(conn)
+        time.sleep(0.01)
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(map(id, seen))) == 4
+    conn = pool.local()
+    pool.release()
+    assert pool.checkout() is conn
+
+
+def test_threads_use_their_own_connection(ec2):
+    s = fake_starwatts(ec2, pool_size=4, single_flight=False)
+
+    def work(_):
+        with s.connection() as conn:
+            return id(conn), len(conn.get_only_instances())
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(work, range(16)))
+    assert all(n == 3 for _, n in results)
+    assert len({conn for conn, _ in results}) <= 4
+    assert ec2.connections <= 4
+    assert s.instrumentation.snapshot()['DescribeInstances']['count'] == 16
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import time
+import threading
+
+import pytest
+
+from starwatts import StarWatts
+from starwatts.daemon import Daemon
+from daemon_client import request, call, default_socket
+
+
+@pytest.fixture
+def daemon(ec2, tmpdir):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url)
+    daemon = Daemon(s, str(tmpdir.join('starwatts.sock')), refresh=0.2).start()
+    yield daemon
+    daemon.stop()
+
+
+def test_commands(daemon, ec2):
+    s = daemon.starwatts
+    assert request('ping', daemon.path)['generation'] >= 1
+    calls = len(ec2.calls)
+    assert request('ssh_config', daemon.path, local=True) == s.generate_ssh_config(local=True)
+    hosts = request('ansible_hosts', daemon.path)
+    assert hosts == s.generate_ansible_hosts_file(vms=s.all_vms(fast=True))
+    assert '[env_dev:children]\nnode0\nnode2\n' in hosts and '[env_prod:children]\nnode1\n' in hosts
+    assert [i['tags']['name'] for i in request('query', daemon.path, query="env = prod")] == ['node1']
+    assert request('instance', daemon.path, instance_id='i-00000002')['tags'] == {'name': 'node2', 'env': 'dev'}
+    # The commands are answered from the inventory in memory
+    assert len(ec2.calls) == calls + 2
+    with pytest.raises(RuntimeError) as e:
+        request('reboot', daemon.path)
+    assert str(e.value) == "ValueError: Unknown command reboot"
+    with pytest.raises(RuntimeError) as e:
+        request('query', daemon.path, query="env =")
+    assert str(e.value).startswith("ValueError: Expected a value")
+    assert stat.S_IMODE(os.stat(daemon.path).st_mode) == 0o600
+
+
+def test_refresh(daemon, ec2):
+    generation = daemon.generation
+    ec2.instances.append(('i-00000003', 'node3', 'prod'))
+    time.sleep(0.5)
+    assert daemon.generation > generation
+    assert 'Host node3' in request('ssh_config', daemon.path)
+    # A failed refresh keeps the previous inventory
+    ec2.handlers['DescribeInstances'] = lambda params: (400, '')
+    time.sleep(0.5)
+    assert daemon.errors > 0
+    assert len(request('query', daemon.path)) == 4
+
+
+def test_pool_connections(daemon, ec2):
+    # The handler and refresh threads don't share the connection of the StarWatts instance
+    daemon.starwatts.conn = None
+    assert request('refresh', daemon.path) > 1
+    calls = len(ec2.calls)
+    # Not in the inventory : listed
+    request('instance', daemon.path, instance_id='i-00000009')
+    assert len(ec2.calls) > calls
+    assert len(request('security_groups', daemon.path)) == 3
+    assert daemon.errors == 0
+
+
+def test_configuration(ec2, tmpdir):
+    conf = tmpdir.join('conf.yml')
+    conf.write("access_key: ak\nsecret_key: sk\n")
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url)
+    daemon = Daemon(s, str(tmpdir.join('starwatts.sock')), conf=str(conf)).start()
+    try:
+        ping = request('ping', daemon.path)
+        assert ping['conf'] == str(conf) and ping['access_key'] == 'ak'
+        assert call('ping', lambda: 'direct', daemon.path, conf=str(conf))['pid'] == os.getpid()
+        # Started with another configuration file
+        assert call('ping', lambda: 'direct', daemon.path, conf=str(tmpdir.join('other.yml'))) == 'direct'
+        with pytest.raises(RuntimeError) as e:
+            request('set_private', daemon.path, instance_id='i-00000000')
+        assert str(e.value) == "ValueError: Unknown command set_private"
+    finally:
+        daemon.stop()
+
+
+def test_fallback(daemon, tmpdir):
+    assert call('ping', lambda: 'direct', daemon.path)['pid'] == os.getpid()
+    assert call('ping', lambda: 'direct', str(tmpdir.join('none.sock'))) == 'direct'
+    with pytest.raises(ConnectionError):
+        request('ping', str(tmpdir.join('none.sock')))
+
+
+def test_default_socket(monkeypatch, tmpdir):
+    monkeypatch.delenv('STARWATTS_SOCKET', raising=False)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmpdir))
+    assert default_socket() == str(tmpdir.join('starwatts.sock'))
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    monkeypatch.setenv('HOME', str(tmpdir))
+    assert default_socket() == str(tmpdir.join('.starwatts', 'starwatts.sock'))
+    monkeypatch.setenv('STARWATTS_SOCKET', '/run/starwatts.sock')
+    assert default_socket() == '/run/starwatts.sock'
+
+
+def test_daemon_of_another_user(daemon, monkeypatch):
+    requests = daemon.requests
+    monkeypatch.setattr(os, 'getuid', lambda: os.geteuid() + 1)
+    with pytest.raises(PermissionError):
+        request('ping', daemon.path)
+    assert call('ssh_config', lambda: 'direct', daemon.path) == 'direct'
+    # Nothing was sent
+    assert daemon.requests == requests
+
+
+def test_wedged_daemon(daemon):
+    stuck = threading.Event()
+    daemon.commands['security_groups'] = lambda: stuck.wait(5)
+    try:
+        assert call('security_groups', lambda: 'direct', daemon.path, timeout=0.2) == 'direct'
+    finally:
+        stuck.set()
+
+
+def test_socket_directory(ec2, tmpdir):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url)
+    daemon = Daemon(s, str(tmpdir.join('run', 'starwatts.sock'))).start()
+    try:
+        assert stat.S_IMODE(os.stat(str(tmpdir.join('run'))).st_mode) == 0o700
+        assert request('ping', daemon.path)['generation'] == 1
+    finally:
+        daemon.stop()
+
+
+def test_socket(daemon, ec2):
+    with pytest.raises(RuntimeError):
+        Daemon(daemon.starwatts, daemon.path).start()
+    daemon.stop()
+    assert not os.path.exists(daemon.path)
+    # A socket left by a daemon that was killed is replaced
+    with open(daemon.path, 'w'):
+        pass
+    other = Daemon(daemon.starwatts, daemon.path).start()
+    try:
+        assert request('ping', daemon.path)['generation'] == 1
+        assert str(other) == "Daemon on {} : 3 instance(s), generation 1, 1 request(s), 0 error(s)".format(daemon.path)
+    finally:
+        other.stop()
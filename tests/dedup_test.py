@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from starwatts import dedup
+from starwatts.dedup import BlockHasher, DeltaTransfer, Manifest, compute_delta, REMOTE_ASSEMBLE, REMOTE_SIGNATURE
+
+BLOCK = 4096
+
+
+def run_local(script, args):
+    proc = subprocess.run([sys.executable, '-'] + [str(a) for a in args], input=script.encode(),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return proc.returncode, proc.stdout.decode()
+
+
+def delta_roundtrip(tmpdir, old, new, weak_type=dict, **kwargs):
+    old_path = str(tmpdir.join('old.bin'))
+    with open(old_path, 'wb') as f:
+        f.write(old)
+    status, out = run_local(REMOTE_SIGNATURE, [BLOCK, old_path])
+    assert status == 0
+    manifest = Manifest(BLOCK, json.loads(out))
+    weak, strong = manifest.index()
+    weak = weak_type(weak)
+
+    literal = io.BytesIO()
+    hasher = BlockHasher(BLOCK)
+    ops = compute_delta(io.BytesIO(new), BLOCK, weak, strong, literal.write, hasher, **kwargs)
+
+    ops_path, data_path, dest = [str(tmpdir.join(n)) for n in ('new.ops', 'new.delta', 'new.bin')]
+    with open(ops_path, 'w') as f:
+        json.dump(ops, f)
+    with open(data_path, 'wb') as f:
+        f.write(literal.getvalue())
+    status, out = run_local(REMOTE_ASSEMBLE, [ops_path, data_path, dest, hasher.entry()['sha1']])
+    assert status == 0
+    with open(dest, 'rb') as f:
+        assert f.read() == new
+    return len(literal.getvalue())
+
+
+def test_signature_matches_hasher(tmpdir):
+    data = os.urandom(3 * BLOCK + 100)
+    path = str(tmpdir.join('f.bin'))
+    with open(path, 'wb') as f:
+        f.write(data)
+    hasher = BlockHasher(BLOCK)
+    hasher.update(data[:1000])
+    hasher.update(data[1000:])
+    entry = hasher.entry()
+    status, out = run_local(REMOTE_SIGNATURE, [BLOCK, path])
+    remote = json.loads(out)[path]
+    assert remote['blocks'] == entry['blocks']
+    assert remote['sha1'] == entry['sha1']
+
+
+def test_delta_in_place_change(tmpdir):
+    old = os.urandom(100 * BLOCK)
+    new = bytearray(old)
+    new[50 * BLOCK + 10] ^= 0xff
+    assert delta_roundtrip(tmpdir, old, bytes(new)) == BLOCK
+
+
+def test_delta_insertion(tmpdir):
+    old = os.urandom(64 * BLOCK + 123)
+    new = old[:20 * BLOCK + 7] + b'inserted bytes' + old[20 * BLOCK + 7:30 * BLOCK] + old[31 * BLOCK + 5:]
+    assert delta_roundtrip(tmpdir, old, new) < 4 * BLOCK
+
+
+def test_delta_unrelated(tmpdir):
+    new = os.urandom(10 * BLOCK + 1)
+    assert delta_roundtrip(tmpdir, os.urandom(10 * BLOCK), new) == len(new)
+    assert delta_roundtrip(tmpdir, b'', b'') == 0
+
+
+class CountingIndex(dict):
+    lookups = 0
+
+    def get(self, key, default=None):
+        CountingIndex.lookups += 1
+        return super().get(key, default)
+
+
+def test_delta_bounded_roll(tmpdir):
+    old = os.urandom(16 * BLOCK)
+    new = os.urandom(64 * BLOCK)
+    CountingIndex.lookups = 0
+    assert delta_roundtrip(tmpdir, old, new, CountingIndex, max_roll=2 * BLOCK) == len(new)
+    # Rolled over 2 blocks, then again after 2, 4, 8, 16 and 32 blocks
+    assert CountingIndex.lookups < 6 * 2 * BLOCK
+    # Shifted blocks are still found after an unrelated stretch
+    new = os.urandom(5 * BLOCK) + b'shift' + old
+    assert delta_roundtrip(tmpdir, old, new, max_roll=2 * BLOCK) < 7 * BLOCK
+    assert delta_roundtrip(tmpdir, old, old[7:], max_roll=0) == len(old) - 7
+
+
+@pytest.mark.parametrize('change', ['rewritten', 'removed'])
+def test_copied_file_changed(tmpdir, sftp_engine, monkeypatch, change):
+    base, local, dest = [str(tmpdir.join(n)) for n in ('base.bin', 'local.bin', 'dest.bin')]
+    old = os.urandom(8 * BLOCK)
+    with open(base, 'wb') as f:
+        f.write(old)
+    with open(local, 'wb') as f:
+        f.write(old + b'appended')
+
+    def run_script(client, script, args):
+        if script == REMOTE_ASSEMBLE:
+            # Another transfer rewrites or removes the base file while this one is rebuilt
+            if change == 'rewritten':
+                with open(base, 'wb') as f:
+                    f.write(os.urandom(8 * BLOCK))
+            else:
+                os.remove(base)
+        proc = subprocess.run([sys.executable, '-'] + [str(a) for a in args], input=script.encode(),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return proc.returncode, proc.stdout.decode(), proc.stderr.decode()
+    monkeypatch.setattr(dedup, 'run_script', run_script)
+
+    transfer = DeltaTransfer(sftp_engine(), None, BLOCK, str(tmpdir.join('manifest.json')))
+    transfer.load_manifest([base])
+    stats = transfer.put(local, dest)
+    with open(dest, 'rb') as f:
+        assert f.read() == old + b'appended'
+    assert stats.reused == 0 and stats.bytes >= len(old)
+    assert base not in transfer.manifest.files
+    assert sorted(os.listdir(str(tmpdir))) == sorted(['dest.bin', 'local.bin'] + ['base.bin'] * (change == 'rewritten'))
+
+
+def test_rebuild_failed(tmpdir, sftp_engine, monkeypatch):
+    base, local, dest = [str(tmpdir.join(n)) for n in ('base.bin', 'local.bin', 'dest.bin')]
+    old = os.urandom(8 * BLOCK)
+    with open(base, 'wb') as f:
+        f.write(old)
+    with open(local, 'wb') as f:
+        f.write(old + b'appended')
+
+    def run_script(client, script, args):
+        if script == REMOTE_ASSEMBLE:
+            with open(dest + '.assemble', 'wb') as f:
+                f.write(b'partial')
+            return 1, '', 'No space left on device'
+        return run_local(script, args) + ('',)
+    monkeypatch.setattr(dedup, 'run_script', run_script)
+
+    transfer = DeltaTransfer(sftp_engine(), None, BLOCK, str(tmpdir.join('manifest.json')))
+    transfer.load_manifest([base])
+    with pytest.raises(IOError):
+        transfer.put(local, dest)
+    # The temporary files don't pile up on the node
+    assert sorted(os.listdir(str(tmpdir))) == ['base.bin', 'local.bin']
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+import paramiko
+
+from starwatts import fanout
+from starwatts.fanout import assign_round, distribute, known_hosts_lines
+
+
+class FakeInstance:
+    def __init__(self, ip):
+        self.private_ip_address = ip
+
+
+class FakeKey:
+    def __init__(self, i):
+        self.i = i
+
+    def get_name(self):
+        return 'ssh-ed25519'
+
+    def get_base64(self):
+        return 'KEY{}'.format(self.i)
+
+
+class FakeClient:
+    """
+    Client whose transport presents the host key of a node.
+    """
+
+    def __init__(self, i):
+        self.key = FakeKey(i)
+
+    def get_transport(self):
+        return self
+
+    def get_remote_server_key(self):
+        return self.key
+
+
+class FakeApp:
+    workdir = '/home/starwatts/jobs/'
+
+    def __init__(self, i, fail=0):
+        self.instance_name = 'node{}'.format(i)
+        self.instance = FakeInstance('10.0.0.{}'.format(i))
+        self.ssh_client = FakeClient(i)
+        self.errors = list()
+        self.commands = list()
+        self.fail = fail
+
+    def execute(self, command):
+        self.commands.append(command)
+        if self.fail and command.startswith('scp'):
+            self.fail -= 1
+            return 1, '', 'Connection refused'
+        return 0, '', ''
+
+
+def test_assign_round():
+    assert assign_round(['src'], ['a', 'b']) == [('src', 'a')]
+    assert assign_round(['src', 'a'], ['b', 'c', 'd']) == [('src', 'b'), ('a', 'c')]
+    assert assign_round(['src', 'a'], ['b', 'c', 'd'], fanout=2) == [('src', 'b'), ('a', 'c'), ('src', 'd')]
+
+
+def test_distribute_rounds():
+    apps = [FakeApp(i) for i in range(100)]
+    result = distribute(apps, 'files', '/data/project.tar')
+    rounds = max(rnd for rnd, _ in result.values())
+    assert rounds == math.ceil(math.log2(101))
+    assert "root@files:/data/project.tar" in apps[0].commands[1]
+    assert all("/home/starwatts/jobs/project.tar" in app.commands[1] for app in apps)
+    assert all('StrictHostKeyChecking=yes' in app.commands[1] for app in apps)
+
+
+def test_known_hosts(monkeypatch):
+    monkeypatch.setattr(fanout, 'host_keys', paramiko.HostKeys)
+    apps = [FakeApp(i) for i in range(3)]
+    lines = known_hosts_lines(apps, 'files', ['files ssh-rsa SOURCE'])
+    assert lines == ['files ssh-rsa SOURCE'] + ['10.0.0.{} ssh-ed25519 KEY{}'.format(i, i) for i in range(3)]
+    distribute(apps, 'files', '/data/project.tar', known_hosts=['files ssh-rsa SOURCE'])
+    assert all(app.commands[0].startswith('mkdir -p ~/.ssh && printf %s ') for app in apps)
+    assert all('10.0.0.2 ssh-ed25519 KEY2' in app.commands[0] for app in apps)
+    apps = [FakeApp(i) for i in range(3)]
+    distribute(apps, 'files', '/data/project.tar', insecure=True)
+    assert all(len(app.commands) == 1 and 'StrictHostKeyChecking=no' in app.commands[0] for app in apps)
+
+
+def test_distribute_failures():
+    apps = [FakeApp(0, fail=1), FakeApp(1, fail=5), FakeApp(2)]
+    result = distribute(apps, 'files', '/data/project.tar', retries=1)
+    assert isinstance(result[apps[0]], tuple)
+    assert result[apps[1]] == 'Connection refused'
+    assert apps[1].errors == ['Connection refused']
+    assert isinstance(result[apps[2]], tuple)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import boto
+
+from starwatts import StarWatts
+from starwatts.connections import ConnectionPool
+from starwatts.hedge import hedge, hedge_delay
+from starwatts.instrument import ApiInstrumentation, instrument
+from starwatts.throttle import RateLimiter
+
+
+def stalling(server, first=1.0):
+    """
+    Makes the first DescribeInstances call of the fake server take a while.
+    """
+    answer = server.describe_instances
+    calls = [0]
+    lock = threading.Lock()
+
+    def handler(params):
+        with lock:
+            calls[0] += 1
+            n = calls[0]
+        if n == 1:
+            time.sleep(first)
+        return answer(params)
+    server.handlers['DescribeInstances'] = handler
+
+
+def warmed(instrumentation, action='DescribeInstances', seconds=0.01, n=20):
+    for _ in range(n):
+        instrumentation.record(action, seconds)
+    return instrumentation
+
+
+def saved_seconds(instrumentation, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        extra = instrumentation.snapshot()['DescribeInstances']['extra']
+        if 'hedge_saved_seconds' in extra:
+            return extra['hedge_saved_seconds']
+        time.sleep(0.05)
+    return None
+
+
+def hedged_connection(server, **kwargs):
+    instrumentation = ApiInstrumentation()
+    conn = instrument(boto.connect_ec2_endpoint(server.url, 'ak', 'sk'), instrumentation)
+    return hedge(conn, instrumentation, **kwargs)
+
+
+def test_hedge_delay():
+    instrumentation = ApiInstrumentation()
+    assert hedge_delay(instrumentation, 'DescribeInstances') is None
+    warmed(instrumentation, seconds=0.2, n=19)
+    instrumentation.record('DescribeInstances', 3.0)
+    assert hedge_delay(instrumentation, 'DescribeInstances', 50) == 0.2
+    assert hedge_delay(instrumentation, 'DescribeInstances', 99) == 3.0
+    assert hedge_delay(instrumentation, 'DescribeInstances', 50, min_samples=30) is None
+    assert hedge_delay(warmed(ApiInstrumentation(), seconds=0.001), 'DescribeInstances') == 0.05
+
+
+def test_duplicate_wins(ec2):
+    stalling(ec2)
+    conn = hedged_connection(ec2)
+    warmed(conn.instrumentation)
+    assert len(conn.get_only_instances()) == 3
+    # The original call stalls : answered by the duplicate
+    assert ec2.calls == ['DescribeInstances'] * 2
+    extra = conn.instrumentation.snapshot()['DescribeInstances']['extra']
+    assert extra['hedges'] == 1 and extra['hedge_wins'] == 1
+    callers = conn.instrumentation.snapshot()['DescribeInstances']['callers']
+    assert callers['test_duplicate_wins'] == 2
+    # The savings are known once the abandoned call answered
+    assert saved_seconds(conn.instrumentation) > 0.5
+
+
+def test_original_call_in_calling_thread(ec2):
+    stalling(ec2)
+    conn = hedged_connection(ec2)
+    warmed(conn.instrumentation)
+    threads = list()
+    send = conn._mexe
+
+    def _mexe(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return send(*args, **kwargs)
+    conn._mexe = _mexe
+    conn.get_only_instances()
+    assert threads[0] is threading.current_thread()
+    assert len(threads) == 2 and threads[1] is not threading.current_thread()
+
+
+def test_duplicate_on_pool_connection(ec2):
+    stalling(ec2)
+    instrumentation = ApiInstrumentation()
+    pool = ConnectionPool(lambda: instrument(boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk'), instrumentation), 2)
+    conn = hedge(instrument(boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk'), instrumentation), instrumentation,
+                 pool=pool)
+    warmed(instrumentation)
+    assert len(conn.get_only_instances()) == 3
+    assert instrumentation.snapshot()['DescribeInstances']['extra']['hedge_wins'] == 1
+    assert pool.checkouts == 1 and pool.created == 1
+
+
+def test_pool_exhausted(ec2):
+    stalling(ec2, 0.3)
+    instrumentation = ApiInstrumentation()
+    pool = ConnectionPool(lambda: instrument(boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk'), instrumentation), 1)
+    conn = hedge(instrument(boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk'), instrumentation), instrumentation,
+                 pool=pool)
+    warmed(instrumentation)
+    with pool.connection():
+        conn.get_only_instances()
+    assert ec2.calls == ['DescribeInstances']
+    assert 'hedges' not in instrumentation.snapshot()['DescribeInstances']['extra']
+
+
+def test_fast_calls_are_not_hedged(ec2):
+    conn = hedged_connection(ec2, min_delay=0.5)
+    warmed(conn.instrumentation)
+    for _ in range(3):
+        conn.get_only_instances()
+    assert ec2.calls == ['DescribeInstances'] * 3
+    assert conn.instrumentation.snapshot()['DescribeInstances']['extra'] == {}
+
+
+def test_not_enough_samples(ec2):
+    stalling(ec2, 0.3)
+    conn = hedged_connection(ec2)
+    conn.get_only_instances()
+    assert ec2.calls == ['DescribeInstances']
+
+
+def test_no_token(ec2):
+    stalling(ec2, 0.3)
+    limiter = RateLimiter(rate=1, burst=1)
+    limiter.bucket.drain()
+    conn = hedged_connection(ec2, limiter=limiter)
+    warmed(conn.instrumentation)
+    conn.get_only_instances()
+    assert ec2.calls == ['DescribeInstances']
+
+
+def test_socket_timeout(ec2):
+    # No duplicate is sent : the stalled call times out and is retried by boto
+    stalling(ec2, 2.0)
+    limiter = RateLimiter(rate=1, burst=1)
+    limiter.bucket.drain()
+    conn = hedged_connection(ec2, limiter=limiter)
+    conn.http_connection_kwargs['timeout'] = 0.3
+    warmed(conn.instrumentation)
+    assert len(conn.get_only_instances()) == 3
+    assert ec2.calls == ['DescribeInstances'] * 2
+    assert 'hedges' not in conn.instrumentation.snapshot()['DescribeInstances']['extra']
+
+
+def test_starwatts(ec2):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url, hedge=90)
+    for _ in range(20):
+        s.all_vms()
+    stalling(ec2)
+    s.all_vms()
+    assert s.instrumentation.snapshot()['DescribeInstances']['extra']['hedge_wins'] == 1
+    assert 'starwatts_api_hedges_total{action="DescribeInstances"} 1' in s.instrumentation.to_prometheus()
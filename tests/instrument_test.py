@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+
+import boto
+import pytest
+from boto.exception import BotoServerError, EC2ResponseError
+
+from starwatts import StarWatts
+from starwatts.instrument import ApiInstrumentation, instrument, error_code, LATENCY_BUCKETS
+
+
+def fake_starwatts(server):
+    return StarWatts(access_key='ak', secret_key='sk', endpoint=server.url)
+
+
+def list_names(s):
+    return sorted(inst.tags['name'] for inst in s.conn.get_only_instances())
+
+
+def test_records_calls(ec2):
+    s = fake_starwatts(ec2)
+    assert list_names(s) == ['node0', 'node1', 'node2']
+    s.all_vms()
+    stats = s.instrumentation.snapshot()['DescribeInstances']
+    assert stats['count'] == 2
+    assert stats['bytes'] > 0
+    assert stats['errors'] == {}
+    assert stats['buckets'][-1][1] == 2
+    assert s.instrumentation.percentile('DescribeInstances', 50) is not None
+    assert s.instrumentation.percentile('RunInstances', 50) is None
+
+
+def test_caller_attribution(ec2):
+    s = fake_starwatts(ec2)
+    s.generate_ansible_hosts_file()
+    s.list_ressources()
+    list_names(s)
+    callers = s.instrumentation.snapshot()['DescribeInstances']['callers']
+    # The nested all_vms call is attributed to the outermost library function, the groups don't list again
+    assert callers['generate_ansible_hosts_file'] == 1
+    assert callers['list_ressources'] == 1
+    assert callers['list_names'] == 1
+    with s.instrumentation.attributed('worker'):
+        s.all_vms()
+    assert s.instrumentation.snapshot()['DescribeInstances']['callers']['worker'] == 1
+
+
+def test_errors(ec2):
+    conn = instrument(boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk'), ApiInstrumentation())
+    conn.num_retries = 0
+    ec2.handlers['DescribeInstances'] = lambda params: ec2.error('RequestLimitExceeded', 503)
+    with pytest.raises(BotoServerError):
+        conn.get_only_instances()
+    with pytest.raises(EC2ResponseError):
+        conn.get_all_volumes()
+    snap = conn.instrumentation.snapshot()
+    assert snap['DescribeInstances']['errors'] == {'RequestLimitExceeded': 1}
+    assert snap['DescribeVolumes']['errors'] == {'InvalidAction': 1}
+
+
+def test_error_code(ec2):
+    assert error_code(ec2.error('Throttling')[1]) == 'Throttling'
+    assert error_code(b'<html></html>') is None
+    assert error_code(None) is None
+
+
+def test_dumps():
+    instrumentation = ApiInstrumentation()
+    instrumentation.record('DescribeInstances', 0.07, 1000, caller='all_vms')
+    instrumentation.record('DescribeInstances', 20, 0, error='Throttling', caller='all_vms')
+    instrumentation.record_retry('DescribeInstances')
+    text = instrumentation.to_prometheus()
+    assert 'starwatts_api_calls_total{action="DescribeInstances",caller="all_vms"} 2' in text
+    assert 'starwatts_api_errors_total{action="DescribeInstances",code="Throttling"} 1' in text
+    assert 'starwatts_api_retries_total{action="DescribeInstances"} 1' in text
+    assert 'starwatts_api_latency_seconds_bucket{action="DescribeInstances",le="0.1"} 1' in text
+    assert 'starwatts_api_latency_seconds_bucket{action="DescribeInstances",le="+Inf"} 2' in text
+    dump = json.loads(instrumentation.to_json())['actions']['DescribeInstances']
+    assert dump['count'] == 2 and dump['bytes'] == 1000
+    assert dump['buckets'][str(LATENCY_BUCKETS[-1])] == 1
+    assert 'DescribeInstances : 2 call(s), 1 error(s), 1 retry(ies)' in str(instrumentation)
+    instrumentation.reset()
+    assert instrumentation.snapshot() == {}
+
+
+def test_threads(ec2):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url, single_flight=False)
+    threads = [threading.Thread(target=s.all_vms) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert s.instrumentation.snapshot()['DescribeInstances']['callers'] == {'all_vms': 8}
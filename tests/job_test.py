@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import subprocess
+import time
+
+from starwatts.job import Job, poll_jobs, start_command
+
+
+def start(tmpdir, shell, body):
+    script = str(tmpdir.join('project.sh'))
+    with open(script, 'w') as f:
+        f.write("#!/bin/sh\n" + body)
+    subprocess.check_call(['chmod', '+x', script])
+    pid = subprocess.check_output(['sh', '-c', start_command(script)]).decode().strip()
+    return Job(shell, int(pid), script)
+
+
+def wait_done(job):
+    for _ in range(100):
+        status = job.status()
+        if not status.running and status.exit_status is not None:
+            return status
+        time.sleep(0.05)
+    raise TimeoutError()
+
+
+def test_status_and_tail(tmpdir, shell):
+    job = start(tmpdir, shell, "echo one\nwhile [ ! -e {0} ]; do sleep 0.05; done\necho two\nexit 3\n".format(
+        tmpdir.join('go')))
+    time.sleep(0.2)
+    status = job.status()
+    assert status.running and status.exit_status is None
+    assert job.tail() == 'one\n'
+    assert job.tail() == ''
+    tmpdir.join('go').write('')
+    status = wait_done(job)
+    assert status.exit_status == 3
+    assert job.tail() == 'two\n'
+    assert job.offset == status.log_size == 8
+
+
+def test_truncated_log(tmpdir, shell):
+    job = start(tmpdir, shell, "echo something long\n")
+    wait_done(job)
+    assert job.tail() == 'something long\n'
+    tmpdir.join('project.log').write('new\n')
+    assert job.tail() == 'new\n'
+
+
+def test_poll_jobs(tmpdir, shell):
+    jobs = [start(tmpdir.mkdir(str(i)), shell, "echo {}\n".format(i)) for i in range(5)]
+    for job in jobs:
+        wait_done(job)
+    results = poll_jobs(jobs, tail=True)
+    assert [data for _, data in results] == ['{}\n'.format(i) for i in range(5)]
+    assert all(status.exit_status == 0 for status, _ in results)
+    assert [data for _, data in poll_jobs(jobs, tail=True)] == [''] * 5
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from starwatts.pool import WarmPool, POOL_TAG
+
+
+class FakeInstance:
+    def __init__(self, name, tags):
+        self.id = 'i-{}'.format(name)
+        self.state = 'running'
+        self.tags = dict(tags, name=name)
+        self.started = 0
+
+    def wait_for(self, state):
+        self.state = state
+
+    def stop_and_wait(self):
+        self.state = 'stopped'
+
+    def start(self):
+        self.started += 1
+        self.state = 'pending'
+
+    def update(self):
+        return self.state
+
+    def add_tags(self, tags):
+        self.tags.update(tags)
+
+    def remove_tags(self, tags):
+        for key in tags:
+            self.tags.pop(key, None)
+
+    def terminate(self):
+        self.state = 'terminated'
+
+
+class FakeConnection:
+    def __init__(self):
+        self.launched = list()
+
+    def quick_instance(self, name, image, instance_type, sg_id=None, extra_tags=None, terminate_on_shutdown=False):
+        inst = FakeInstance(name, extra_tags)
+        self.launched.append(inst)
+        return inst
+
+    def get_only_instances(self, filters=None):
+        return [i for i in self.launched if i.tags.get(POOL_TAG) == filters['tag:pool']]
+
+
+def test_wrong_state():
+    with pytest.raises(ValueError):
+        WarmPool(FakeConnection(), state='terminated')
+
+
+def test_claim():
+    conn = FakeConnection()
+    pool = WarmPool(conn, size=2).fill('ami-1', 'm1.xlarge')
+    assert pool.available('ami-1', 'm1.xlarge') == 2
+    assert all(i.state == 'stopped' for i in conn.launched)
+
+    inst = pool.claim('ami-1', 'm1.xlarge', 'node_blender_job0', tags={'env': 'prod'})
+    assert inst.state == 'running' and inst.started == 1
+    assert inst.tags['name'] == 'node_blender_job0' and inst.tags['env'] == 'prod'
+    assert POOL_TAG not in inst.tags
+
+    assert pool.claim('ami-1', 't2.micro', 'node_other') is None
+    assert (pool.hits, pool.misses) == (1, 1)
+    pool._executor.shutdown(wait=True)
+    assert pool.available('ami-1', 'm1.xlarge') == 2
+    assert pool.available('ami-1', 't2.micro') == 2
+
+
+def test_discover_and_drain():
+    conn = FakeConnection()
+    WarmPool(conn, size=3, state='running').fill('ami-1', 'm1.xlarge')
+    pool = WarmPool(conn, size=3)
+    assert pool.discover('ami-1', 'm1.xlarge') == 3
+    assert pool.replenish('ami-1', 'm1.xlarge') == 0
+    assert pool.drain() == 3
+    assert all(i.state == 'terminated' for i in conn.launched)
+
+
+def test_unexpected_launch_error():
+    conn = FakeConnection()
+    launch = conn.quick_instance
+
+    def broken(*args, **kwargs):
+        conn.quick_instance = launch
+        raise ValueError("Unexpected")
+    conn.quick_instance = broken
+    pool = WarmPool(conn, size=1)
+    with pytest.raises(ValueError):
+        pool.replenish('ami-1', 'm1.xlarge', wait=True)
+    assert pool.replenish('ami-1', 'm1.xlarge', wait=True) == 1
+    assert pool.available('ami-1', 'm1.xlarge') == 1
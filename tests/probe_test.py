@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import time
+import socket
+import threading
+
+import pytest
+
+from starwatts.probe import probe_ssh, read_banner, wait_for_ssh
+
+
+def fake_sshd(delay=0.0, banner=b'SSH-2.0-OpenSSH_6.7p1 Debian-5\r\n'):
+    """
+    Listens on a random port and starts sending the banner after the given delay.
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+    ready_at = time.time() + delay
+
+    def serve():
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            if time.time() >= ready_at:
+                client.sendall(banner)
+            client.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server, server.getsockname()[1]
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_probe_ssh():
+    server, port = fake_sshd()
+    assert probe_ssh('127.0.0.1', port) == 'SSH-2.0-OpenSSH_6.7p1 Debian-5'
+    server.close()
+    assert probe_ssh('127.0.0.1', free_port()) is None
+
+
+class ResetSocket:
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, size):
+        raise ConnectionResetError(104, 'Connection reset by peer')
+
+
+def test_read_banner_reset():
+    assert read_banner(ResetSocket()) is None
+
+
+def test_wait_for_ssh_booting():
+    server, port = fake_sshd(delay=0.5)
+    banner, waited, attempts = wait_for_ssh('127.0.0.1', port, timeout=10)
+    assert banner.startswith('SSH-2.0')
+    assert 0.4 < waited < 3
+    assert attempts > 1
+    server.close()
+
+
+def test_wait_for_ssh_timeout():
+    with pytest.raises(TimeoutError):
+        wait_for_ssh('127.0.0.1', free_port(), timeout=0.5)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+import boto
+import pytest
+
+from starwatts import StarWatts
+from starwatts.query import Query, parse_query, format_query, Compare, Has, And, Or, Not
+
+INSTANCE = (
+    '<item><instanceId>{id}</instanceId><instanceState><code>16</code><name>{state}</name></instanceState>'
+    '<instanceType>{type}</instanceType><privateIpAddress>10.0.0.1</privateIpAddress><tagSet>{tags}</tagSet></item>'
+)
+
+DESCRIBE_INSTANCES = (
+    '<?xml version="1.0" encoding="UTF-8"?><DescribeInstancesResponse><requestId>r</requestId><reservationSet><item>'
+    '<reservationId>r-1</reservationId><instancesSet>{}</instancesSet></item></reservationSet>'
+    '</DescribeInstancesResponse>'
+)
+
+FLEET = [
+    ('i-1', 'running', 'm1.xlarge', {'name': 'web1', 'env': 'prod', 'os': 'centos7', 'privacy': 'true'}),
+    ('i-2', 'running', 't1.micro', {'name': 'web2', 'env': 'dev', 'os': 'debian'}),
+    ('i-3', 'stopped', 'm1.xlarge', {'name': 'db1', 'env': 'prod', 'os': 'centos6'}),
+    ('i-4', 'running', 'm1.large', {'name': 'files', 'env': 'prod', 'os': 'debian', 'privacy': 'false'}),
+    ('i-5', 'running', 't1.micro', {'name': 'we*rd', 'env': 'dev'}),
+    ('i-6', 'pending', 't1.micro', {}),
+]
+
+
+def wildcard(value):
+    """
+    Regex of a filter value, with the wildcards of the EC2 API.
+    """
+    parts = re.findall(r'\\.|\*|\?|[^\\*?]+', value)
+    return re.compile(''.join('.*' if p == '*' else '.' if p == '?' else re.escape(p[-1] if p[0] == '\\' else p)
+                              for p in parts) + '$')
+
+
+def describe(params):
+    """
+    Answers DescribeInstances with the instances of the fleet matching the filters.
+    """
+    filters = dict()
+    for key, name in params.items():
+        match = re.match(r'Filter\.(\d+)\.Name$', key)
+        if match:
+            filters[name[0]] = [wildcard(v[0]) for k, v in sorted(params.items())
+                                if k.startswith('Filter.{}.Value.'.format(match.group(1)))]
+    items = list()
+    for i, state, t, tags in FLEET:
+        values = {'instance-state-name': [state], 'instance-type': [t], 'tag-key': list(tags)}
+        values.update({'tag:' + k: [v] for k, v in tags.items()})
+        if all(any(r.match(v) for r in regexes for v in values.get(name, [])) for name, regexes in filters.items()):
+            items.append(INSTANCE.format(id=i, state=state, type=t, tags=''.join(
+                '<item><key>{}</key><value>{}</value></item>'.format(k, v) for k, v in tags.items())))
+    return 200, DESCRIBE_INSTANCES.format(''.join(items))
+
+
+@pytest.fixture
+def fleet(ec2):
+    ec2.bodies = list()
+    ec2.handlers['DescribeInstances'] = lambda params: ec2.bodies.append(describe(params)[1]) or describe(params)
+    return ec2
+
+
+def select(server, query):
+    conn = boto.connect_ec2_endpoint(server.url, 'ak', 'sk')
+    return sorted(r.id for r in Query(query).select(conn))
+
+
+def test_parse():
+    assert parse_query("env = prod") == Compare('tag:env', '=', ('prod',))
+    assert parse_query("not state = running or has env and type in (a, 'b c')") == Or((
+        Not(Compare('state', '=', ('running',))),
+        And((Has('tag:env'), Compare('type', 'in', ('a', 'b c')))),
+    ))
+    assert parse_query("missing tag:state") == Not(Has('tag:state'))
+    assert parse_query("name = ''") == Compare('tag:name', '=', ('',))
+    text = "(env = prod or name ^= 'we\\'b') and not (os ~ 'centos[67]' and missing privacy)"
+    assert format_query(parse_query(format_query(parse_query(text)))) == format_query(parse_query(text))
+    for invalid, message in (("env =", "Expected a value, found the end"),
+                             ("env prod", "Expected an operator, found 'prod' at 4"),
+                             ("(env = prod", "Expected ')'"),
+                             ("env = prod name = a", "Expected 'and', 'or' or the end, found 'name' at 11"),
+                             ("os ~ '['", "Invalid regex"),
+                             ("env = 'prod", "Unexpected character at 6")):
+        with pytest.raises(ValueError) as e:
+            parse_query(invalid)
+        assert message in str(e.value)
+
+
+def test_plan():
+    query = Query("env = prod and type in (m1.xlarge, m1.large) and name ^= 'we*' and not os ~ centos")
+    assert query.filters == {'tag:env': ['prod'], 'instance-type': ['m1.xlarge', 'm1.large'], 'tag:name': ['we\\**']}
+    assert format_query(query.residual) == "not tag:os ~ 'centos'"
+    assert Query("(env = dev or env = prod) and has os").filters == {'tag:env': ['dev', 'prod'], 'tag-key': ['os']}
+    assert Query("state = running or env = prod").filters == {}
+    # Values of the same filter are intersected, tag-key values are alternatives
+    assert Query("state in (running, stopped) and state = running").filters == {'instance-state-name': ['running']}
+    assert Query("state = running and state = stopped").empty
+    query = Query("has env and has os")
+    assert query.filters == {'tag-key': ['env']} and format_query(query.residual) == "has tag:os"
+    assert Query("").filters == {} and Query("").residual is None
+    assert Query("env = prod and missing privacy").explain() == \
+        "Filters :     tag:env=prod\nClient side : missing tag:privacy"
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("env = prod", ['i-1', 'i-3', 'i-4']),
+    ("env = prod and state = running", ['i-1', 'i-4']),
+    ("env = prod or type = t1.micro", ['i-1', 'i-2', 'i-3', 'i-4', 'i-5', 'i-6']),
+    ("env != prod", ['i-2', 'i-5', 'i-6']),
+    ("not env = prod", ['i-2', 'i-5', 'i-6']),
+    ("name in (web1, files, nope)", ['i-1', 'i-4']),
+    ("name ^= we", ['i-1', 'i-2', 'i-5']),
+    ("name ^= 'we*'", ['i-5']),
+    ("name = 'we*rd'", ['i-5']),
+    ("os ~ '^centos[67]$' and state = running", ['i-1']),
+    ("missing privacy and has env", ['i-2', 'i-3', 'i-5']),
+    ("missing env", ['i-6']),
+    ("type in (m1.xlarge, m1.large) and not (privacy = false or state = stopped)", ['i-1']),
+    ("state = running and state = stopped", []),
+    ("", ['i-1', 'i-2', 'i-3', 'i-4', 'i-5', 'i-6']),
+])
+def test_select(fleet, text, expected):
+    assert select(fleet, text) == expected
+    # The client-side evaluation of the whole query agrees with the plan
+    conn = boto.connect_ec2_endpoint(fleet.url, 'ak', 'sk')
+    assert sorted(i.id for i in conn.get_only_instances() if Query(text).matches(i)) == expected
+    assert sorted(i.id for i in conn.get_instances_by_query(text)) == expected
+
+
+def test_pushdown_shrinks_payloads(fleet):
+    select(fleet, "")
+    select(fleet, "env = prod and state = running and os ~ centos")
+    assert len(fleet.bodies[1]) * 2 < len(fleet.bodies[0])
+    # Contradictions don't call the API
+    select(fleet, "type = t1.micro and type = m1.large")
+    assert len(fleet.bodies) == 2
+
+
+def test_starwatts(fleet, capsys):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=fleet.url)
+    assert [r.id for r in s.query("name ^= web and env = dev")] == ['i-2']
+    s.pretty_report(env='prod', query="state = running")
+    out = capsys.readouterr().out
+    assert out.count('VM :') == 2 and 'web1' in out and 'files' in out
+    s.pretty_report(name='web2')
+    assert capsys.readouterr().out.count('VM :') == 1
+    s.pretty_report()
+    assert capsys.readouterr().out.count('VM :') == 6
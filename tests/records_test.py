@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import sys
+import time
+
+import boto
+import pytest
+from boto.exception import EC2ResponseError
+
+from starwatts import StarWatts
+from starwatts.records import (parse, describe_instances, describe_volumes, describe_security_groups, InstanceRecord,
+                               INSTANCE_FORMAT)
+
+DESCRIBE_VOLUMES = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<DescribeVolumesResponse xmlns="http://ec2.amazonaws.com/doc/2014-10-01/"><requestId>r</requestId>'
+    '<volumeSet><item><volumeId>vol-1</volumeId><size>10</size><snapshotId/><availabilityZone>eu-west-2a'
+    '</availabilityZone><status>in-use</status><createTime>2016-02-04T14:15:42.000Z</createTime>'
+    '<attachmentSet><item><volumeId>vol-1</volumeId><instanceId>i-00000001</instanceId><device>/dev/sda1</device>'
+    '<status>attached</status></item></attachmentSet><volumeType>standard</volumeType>'
+    '<tagSet><item><key>name</key><value>data</value></item></tagSet></item>'
+    '<item><volumeId>vol-2</volumeId><size>200</size><snapshotId>snap-1</snapshotId><availabilityZone>eu-west-2a'
+    '</availabilityZone><status>available</status><createTime>2016-02-04T14:15:42.000Z</createTime>'
+    '<attachmentSet/><volumeType>io1</volumeType></item></volumeSet></DescribeVolumesResponse>'
+)
+
+
+@pytest.fixture
+def fleet(ec2, instances_xml):
+    ec2.handlers['DescribeInstances'] = lambda params: (200, instances_xml(5))
+    ec2.handlers['DescribeVolumes'] = lambda params: (200, DESCRIBE_VOLUMES)
+    ec2.handlers['DescribeSecurityGroups'] = ec2.describe_security_groups
+    return ec2
+
+
+def test_instances_match_boto(fleet):
+    conn = boto.connect_ec2_endpoint(fleet.url, 'ak', 'sk')
+    records = describe_instances(conn)
+    instances = conn.get_only_instances()
+    assert len(records) == len(instances) == 5
+    for record, inst in zip(records, instances):
+        for name in InstanceRecord.__slots__:
+            assert getattr(record, name) == getattr(inst, name), name
+    # The addresses and tags of the network interfaces aren't taken for the ones of the instance
+    assert records[1].private_ip_address == '10.0.0.1'
+    assert records[0].ip_address == '1.2.3.0' and records[1].ip_address is None
+    assert records[0].tags == {'name': 'node0', 'env': 'dev'}
+    assert sys.intern('env') is next(iter(records[1].tags.keys() - {'name'}))
+    assert records[0].tags['env'] is records[2].tags['env']
+    assert records[0].instance_type is records[2].instance_type
+    assert repr(records[0]) == 'Instance:i-00000000'
+    assert not hasattr(records[0], '__dict__')
+
+
+def test_volumes_and_groups_match_boto(fleet):
+    conn = boto.connect_ec2_endpoint(fleet.url, 'ak', 'sk')
+    records = describe_volumes(conn)
+    volumes = conn.get_all_volumes()
+    for record, volume in zip(records, volumes):
+        for name in ('id', 'size', 'status', 'zone', 'snapshot_id', 'create_time', 'type', 'tags'):
+            assert getattr(record, name) == getattr(volume, name), name
+        assert record.instance_id == volume.attach_data.instance_id
+        assert record.device == volume.attach_data.device
+        assert record.attachment_state == volume.attachment_state()
+    assert records[0].size == 10 and records[1].instance_id is None
+
+    group = describe_security_groups(conn)[0]
+    boto_group = conn.get_all_security_groups()[0]
+    for name in ('id', 'name', 'description', 'vpc_id', 'owner_id', 'tags'):
+        assert getattr(group, name) == getattr(boto_group, name), name
+
+
+def test_to_boto(fleet):
+    conn = boto.connect_ec2_endpoint(fleet.url, 'ak', 'sk')
+    record = describe_instances(conn)[1]
+    inst = record.to_boto(conn)
+    assert (inst.id, inst.state, inst.placement, inst.tags) == ('i-00000001', 'running', 'eu-west-2a', record.tags)
+    calls = len(fleet.calls)
+    refreshed = describe_instances(conn)[0].to_boto(conn, refresh=True)
+    assert len(fleet.calls) == calls + 2
+    assert refreshed.groups[0].id == 'sg-9b5adf25'
+    volume = describe_volumes(conn)[0].to_boto(conn)
+    assert volume.attachment_state() == 'attached' and volume.attach_data.instance_id == 'i-00000001'
+    group = describe_security_groups(conn)[0].to_boto(conn)
+    assert group.name == 'standard' and group.tags == {'zone': 'starwatts'}
+
+
+def test_pages(ec2, instances_xml):
+    def handler(params):
+        if 'NextToken' not in params:
+            return 200, instances_xml(3, next_token='page2')
+        assert params['NextToken'] == ['page2']
+        return 200, instances_xml(2, offset=3)
+    ec2.handlers['DescribeInstances'] = handler
+    conn = boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk')
+    assert [r.id for r in describe_instances(conn)] == ['i-{:08x}'.format(i) for i in range(5)]
+    assert ec2.calls == ['DescribeInstances'] * 2
+
+
+def test_errors(ec2):
+    ec2.handlers['DescribeInstances'] = lambda params: ec2.error('InvalidInstanceID.Malformed')
+    conn = boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk')
+    with pytest.raises(EC2ResponseError) as e:
+        describe_instances(conn, ['i-bad'])
+    assert e.value.error_code == 'InvalidInstanceID.Malformed'
+
+
+def test_large_response(instances_xml):
+    body = instances_xml(3000).encode('utf-8')
+    # CPU time of this thread without the collections of the garbage left by the other tests, which would decide
+    clock = getattr(time, 'thread_time', time.process_time)
+    gc.collect()
+    gc.disable()
+    try:
+        start = clock()
+        records, next_token = parse(body, INSTANCE_FORMAT)
+        fast = clock() - start
+        reservations = boto.resultset.ResultSet([('item', boto.ec2.instance.Reservation)])
+        start = clock()
+        boto.handler.XmlHandlerWrapper(reservations, None).parseString(body.decode('utf-8'))
+        slow = clock() - start
+    finally:
+        gc.enable()
+    assert len(records) == 3000 and next_token is None
+    assert sum(len(r.instances) for r in reservations) == 3000
+    assert fast < slow
+
+
+def test_reports(fleet):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=fleet.url)
+    assert [tags['name'] for tags, _ in s.all_vms(fast=True)] == ['node{}'.format(i) for i in range(5)]
+    assert isinstance(s.all_vms(fast=True)[0][1], InstanceRecord)
+    assert 'Host node1\n\tHostName 10.0.0.1\n' in s.generate_ssh_config()
+    assert len(s.inventory(filters={'tag:env': 'dev'})) == 5
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+from starwatts.scheduler import BinPackingScheduler, JobRequest
+
+
+def test_packs_existing_nodes_first():
+    scheduler = BinPackingScheduler()
+    node = scheduler.add_node('render1', 'm1.xlarge')
+    for i in range(4):
+        scheduler.submit(JobRequest('job{}'.format(i), 1, 3))
+    placements = scheduler.schedule()
+    assert [p.node for p in placements] == [node] * 4
+    assert not any(p.launched for p in placements)
+    assert scheduler.utilisation() == (1.0, 12 / 15)
+
+
+def test_launches_best_fitting_type():
+    launched = list()
+    scheduler = BinPackingScheduler(launcher=lambda instance_type, name: launched.append(instance_type) or name)
+    scheduler.submit(JobRequest('small', 1, 0.5)).schedule()
+    assert launched == ['t1.micro']
+    scheduler.submit(JobRequest('medium', 2, 3)).submit(JobRequest('big', 4, 12)).schedule()
+    assert launched == ['t1.micro', 'm1.xlarge', 't2.medium']
+    assert scheduler.complete('big').instance_type == 'm1.xlarge'
+    assert [n.instance_type for n in scheduler.idle_nodes()] == ['m1.xlarge']
+
+
+def test_max_nodes_and_failed_launch():
+    scheduler = BinPackingScheduler(max_nodes=1)
+    scheduler.submit(JobRequest('a', 4, 10)).submit(JobRequest('b', 4, 10)).schedule()
+    assert [r.name for r in scheduler.queue] == ['b']
+    scheduler.complete('a')
+    assert [p.request.name for p in scheduler.schedule()] == ['b']
+    failing = BinPackingScheduler(launcher=lambda instance_type, name: None)
+    assert failing.submit(JobRequest('a', 1, 1)).schedule() == []
+    assert len(failing.queue) == 1
+    with pytest.raises(ValueError):
+        failing.submit(JobRequest('huge', 64, 256))
+
+
+def test_duplicate_names():
+    scheduler = BinPackingScheduler()
+    scheduler.add_node('render1', 'm1.xlarge')
+    scheduler.submit(JobRequest('a', 1, 1))
+    with pytest.raises(ValueError):
+        scheduler.submit(JobRequest('a', 2, 2))
+    scheduler.schedule()
+    with pytest.raises(ValueError):
+        scheduler.submit(JobRequest('a', 1, 1))
+    scheduler.complete('a')
+    assert scheduler.submit(JobRequest('a', 1, 1)).schedule()[0].request.name == 'a'
+
+
+def test_beats_one_vm_per_job():
+    rng = random.Random(4)
+    requests = [JobRequest('job{}'.format(i), rng.choice([1, 1, 2, 4]), rng.choice([0.5, 1, 3, 6])) for i in range(60)]
+    scheduler = BinPackingScheduler()
+    for request in requests:
+        scheduler.submit(request)
+    scheduler.schedule()
+    assert not scheduler.queue
+    # One m1.xlarge per job
+    assert sum(node.cores for node in scheduler.nodes) < 4 * len(requests) / 2
+    assert scheduler.utilisation()[0] > 2 * sum(r.cores for r in requests) / (4 * len(requests))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import subprocess
+
+from starwatts.script import RemoteScript, render_user_data, OUTSCALE_SECTION
+
+
+def run_local(script):
+    proc = subprocess.run(['sh', '-s'], input=script.render().encode(), stdout=subprocess.PIPE)
+    return proc.returncode, RemoteScript.parse(proc.stdout.decode())
+
+
+def test_steps():
+    script = RemoteScript('test').add('first step', 'echo one; echo two >&2').add('no newline', 'printf x')
+    status, results = run_local(script)
+    assert status == 0
+    assert [r.name for r in results] == ['first step', 'no newline']
+    assert results[0].output == 'one\ntwo'
+    assert results[1].output == 'x'
+    assert all(r.status == 0 for r in results)
+
+
+def test_stops_at_first_failure():
+    script = RemoteScript().add('ok', 'true').add('fail', 'exit 3').add('never', 'echo never')
+    status, results = run_local(script)
+    assert status == 3
+    assert [(r.name, r.status) for r in results] == [('ok', 0), ('fail', 3)]
+
+
+def test_steps_reading_stdin():
+    script = RemoteScript().add('read', 'cat >/dev/null; read line; echo "read $?"').add('after', 'echo after')
+    status, results = run_local(script)
+    assert status == 0
+    assert [(r.name, r.output) for r in results] == [('read', 'read 1'), ('after', 'after')]
+
+
+def test_malformed_markers():
+    script = RemoteScript().add('fake', "echo '__STARWATTS_STEP__ x'; echo '__STARWATTS_STEP__ 0 oops 1 2 name'")
+    status, results = run_local(script)
+    assert status == 0
+    assert [r.name for r in results] == ['fake']
+    assert results[0].output == '__STARWATTS_STEP__ x\n__STARWATTS_STEP__ 0 oops 1 2 name'
+
+
+def test_extend():
+    script = RemoteScript().add('a', 'true').extend(RemoteScript().add('b', 'true'))
+    assert [name for name, _ in script.steps] == ['a', 'b']
+
+
+def test_render_user_data(tmpdir):
+    assert render_user_data() == OUTSCALE_SECTION
+    assert render_user_data(private=False) == ""
+    log = str(tmpdir.join('bootstrap.log'))
+    user_data = render_user_data(RemoteScript().add('hello', 'echo hello'), log=log)
+    assert user_data.startswith("#!/bin/sh\n")
+    assert OUTSCALE_SECTION in user_data
+    proc = subprocess.run(['sh', '-c', user_data], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert proc.returncode == 0
+    with open(log) as f:
+        results = RemoteScript.parse(f.read())
+    assert [(r.name, r.status, r.output) for r in results] == [('hello', 0, 'hello')]
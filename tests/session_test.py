@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+
+def test_run(shell):
+    result = shell.run('echo hello; echo oops >&2; false')
+    assert (result.status, result.stdout, result.stderr) == (1, 'hello\n', 'oops\n')
+
+
+def test_state_is_kept(shell):
+    shell.run('cd /tmp; X=5')
+    assert shell.run('pwd; echo $X; printf end').stdout == '/tmp\n5\nend'
+
+
+def test_run_many(shell):
+    results = shell.run_many(['echo {}'.format(i) for i in range(50)] + ['cat'])
+    assert [r.stdout for r in results[:50]] == ['{}\n'.format(i) for i in range(50)]
+    assert results[-1].status == 0
+
+
+def test_exit(shell):
+    with pytest.raises(EOFError):
+        shell.run('exit 3', timeout=5)
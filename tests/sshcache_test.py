@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import paramiko
+import pytest
+
+from starwatts.sshcache import CachedHostKeyPolicy, FileCache, host_keys, private_key, ssh_config
+
+
+def test_reload_on_change(tmpdir):
+    path = str(tmpdir.join('config'))
+    with open(path, 'w') as f:
+        f.write("Host files\n    HostName 10.0.0.1\n")
+    cache = FileCache(lambda p: open(p).read())
+    assert cache.get(path) is cache.get(path)
+    assert cache.loads == 1
+    with open(path, 'a') as f:
+        f.write("    User starwatts\n")
+    assert 'starwatts' in cache.get(path)
+    assert cache.loads == 2
+    with pytest.raises(FileNotFoundError):
+        cache.get(str(tmpdir.join('missing')))
+
+
+def test_ssh_config(tmpdir):
+    path = str(tmpdir.join('config'))
+    with open(path, 'w') as f:
+        f.write("Host files\n    HostName 10.0.0.1\n    User starwatts\n")
+    conf = ssh_config(path)
+    assert conf.lookup('files')['hostname'] == '10.0.0.1'
+    assert ssh_config(path) is conf
+
+
+def test_host_keys(tmpdir):
+    key = paramiko.RSAKey.generate(1024)
+    path = str(tmpdir.join('known_hosts'))
+    with open(path, 'w') as f:
+        f.write("10.0.0.1 ssh-rsa {}\n".format(key.get_base64()))
+    keys = host_keys(path)
+    assert keys.lookup('10.0.0.1')['ssh-rsa'] == key
+    assert host_keys(path) is keys
+    assert len(host_keys(str(tmpdir.join('missing')))) == 0
+
+
+def test_host_key_policy(tmpdir):
+    key = paramiko.RSAKey.generate(1024)
+    path = str(tmpdir.join('known_hosts'))
+    with open(path, 'w') as f:
+        f.write("10.0.0.1 ssh-rsa {}\n".format(key.get_base64()))
+    policy = CachedHostKeyPolicy(path)
+    client = paramiko.SSHClient()
+    policy.missing_host_key(client, '10.0.0.1', key)
+    with pytest.raises(paramiko.BadHostKeyException):
+        policy.missing_host_key(client, '10.0.0.1', paramiko.RSAKey.generate(1024))
+    other = paramiko.RSAKey.generate(1024)
+    policy.missing_host_key(client, '10.0.0.2', other)
+    assert client.get_host_keys().lookup('10.0.0.2')['ssh-rsa'] == other
+
+
+@pytest.mark.skipif(not hasattr(paramiko, 'DSSKey'), reason="paramiko without DSS keys")
+def test_dss_private_key(tmpdir):
+    key = paramiko.DSSKey.generate(1024)
+    path = str(tmpdir.join('project-dss.pem'))
+    key.write_private_key_file(path)
+    assert private_key(path) == key
+
+
+def test_private_key(tmpdir):
+    key = paramiko.RSAKey.generate(1024)
+    path = str(tmpdir.join('project.pem'))
+    key.write_private_key_file(path)
+    loaded = private_key(path)
+    assert loaded == key
+    assert private_key(path) is loaded
+    os.utime(path, (0, 0))
+    assert private_key(path) is not loaded
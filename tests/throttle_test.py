@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import boto
+import pytest
+from boto.exception import BotoServerError, EC2ResponseError
+
+from starwatts import StarWatts
+from starwatts.connections import accept_gzip
+from starwatts.instrument import ApiInstrumentation, instrument
+from starwatts.throttle import RateLimiter, TokenBucket, decorrelated_jitter, throttle, INTERACTIVE, BACKGROUND
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def throttling(server, times, status=503, code='RequestLimitExceeded'):
+    """
+    Makes the fake server throttle the next calls to DescribeInstances.
+    """
+    answer = server.describe_instances
+    left = [times]
+
+    def handler(params):
+        if left[0] > 0:
+            left[0] -= 1
+            return server.error(code, status)
+        return answer(params)
+    server.handlers['DescribeInstances'] = handler
+
+
+def throttled_connection(server, retries=8):
+    instrumentation = ApiInstrumentation()
+    conn = boto.connect_ec2_endpoint(server.url, 'ak', 'sk')
+    return throttle(instrument(conn, instrumentation), RateLimiter(200, 5), instrumentation, retries, 0.01, 0.05)
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(2, 3, clock)
+    for _ in range(3):
+        assert bucket.delay() == 0
+        bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now = 1.0
+    assert bucket.delay() == 0
+    assert bucket.delay(reserve=1) == 0
+    assert bucket.delay(reserve=2) == pytest.approx(0.5)
+    bucket.drain()
+    assert bucket.delay() == pytest.approx(0.5)
+    with pytest.raises(ValueError):
+        TokenBucket(0, 1)
+
+
+def test_decorrelated_jitter():
+    delay = 0.2
+    for _ in range(50):
+        delay = decorrelated_jitter(0.2, 5, delay)
+        assert 0.2 <= delay <= 5
+
+
+def test_rate():
+    limiter = RateLimiter(rate=50, burst=5)
+    start = time.monotonic()
+    for _ in range(30):
+        limiter.acquire('DescribeInstances')
+    # 5 calls from the burst, then 25 at 50 per second
+    assert time.monotonic() - start >= 0.45
+    assert limiter.waited > 0
+
+
+def test_budgets():
+    limiter = RateLimiter(rate=1000, burst=1000, budgets={'RunInstances': (20, 1)})
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire('RunInstances')
+    assert time.monotonic() - start >= 0.19
+    # The budget doesn't slow the other actions down : checked on the buckets, with a clock that doesn't move
+    limiter = RateLimiter(rate=1000, burst=1000, budgets={'RunInstances': (20, 1)}, clock=Clock())
+    limiter.acquire('RunInstances')
+    assert limiter.budgets['RunInstances'].delay() == pytest.approx(0.05)
+    assert limiter.bucket.delay() == 0
+    for _ in range(5):
+        limiter.acquire('DescribeInstances')
+    assert limiter.bucket.tokens == 994
+
+
+def test_lanes():
+    limiter = RateLimiter(rate=20, burst=4, reserve=0.5, clock=Clock())
+    with limiter.lane(BACKGROUND):
+        assert limiter.current_lane() == BACKGROUND
+        # Background calls leave half of the burst to the interactive ones
+        limiter.acquire('DescribeSnapshots')
+        limiter.acquire('DescribeSnapshots')
+        assert limiter.bucket.tokens == 2
+        assert limiter.bucket.delay(limiter.reserve) == pytest.approx(0.05)
+        assert not limiter.try_acquire('DescribeSnapshots')
+    assert limiter.current_lane() == INTERACTIVE
+    assert limiter.bucket.delay() == 0
+
+    limiter = RateLimiter(rate=20, burst=4, reserve=0.5)
+    with limiter.lane(BACKGROUND):
+        limiter.acquire('DescribeSnapshots')
+        limiter.acquire('DescribeSnapshots')
+        start = time.monotonic()
+        limiter.acquire('DescribeSnapshots')
+        assert time.monotonic() - start >= 0.04
+    with pytest.raises(ValueError):
+        with limiter.lane('urgent'):
+            pass
+
+    order = list()
+    lock = threading.Lock()
+
+    def call(lane):
+        limiter.acquire('DescribeInstances', lane)
+        with lock:
+            order.append(lane)
+    limiter.bucket.drain()
+    threads = [threading.Thread(target=call, args=(BACKGROUND,)) for _ in range(3)]
+    threads += [threading.Thread(target=call, args=(INTERACTIVE,)) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert order[:3] == [INTERACTIVE] * 3
+
+
+def test_starwatts_retries(ec2):
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url, rate=100, burst=10)
+    throttling(ec2, 1)
+    assert len(s.conn.get_only_instances()) == 3
+    assert ec2.calls.count('DescribeInstances') == 2
+    snap = s.instrumentation.snapshot()['DescribeInstances']
+    assert snap['retries'] == 1
+    assert snap['errors'] == {'RequestLimitExceeded': 1}
+    assert snap['callers'] == {'test_starwatts_retries': 2}
+    assert 'starwatts_api_limiter_wait_seconds_total{action="DescribeInstances"}' in s.instrumentation.to_prometheus()
+    with s.background():
+        assert s.limiter.current_lane() == BACKGROUND
+        s.all_vms()
+
+
+def test_gzipped_server_errors(ec2):
+    ec2.gzip = True
+    s = StarWatts(access_key='ak', secret_key='sk', endpoint=ec2.url, rate=100, burst=10)
+    throttling(ec2, 1)
+    assert len(s.conn.get_only_instances()) == 3
+    assert s.instrumentation.snapshot()['DescribeInstances']['errors'] == {'RequestLimitExceeded': 1}
+    throttling(ec2, 1, code='Unavailable')
+    conn = throttle(accept_gzip(boto.connect_ec2_endpoint(ec2.url, 'ak', 'sk')), RateLimiter(200, 5), retries=0)
+    with pytest.raises(BotoServerError) as e:
+        conn.get_only_instances()
+    assert e.value.error_code == 'Unavailable'
+
+
+def test_retries_throttled_calls(ec2):
+    conn = throttled_connection(ec2)
+    throttling(ec2, 3)
+    assert len(conn.get_only_instances()) == 3
+    throttling(ec2, 2, status=400, code='Throttling')
+    assert len(conn.get_only_instances()) == 3
+    assert ec2.calls.count('DescribeInstances') == 7
+    snap = conn.instrumentation.snapshot()['DescribeInstances']
+    assert snap['retries'] == 5
+    assert snap['errors'] == {'RequestLimitExceeded': 3, 'Throttling': 2}
+
+
+def test_gives_up(ec2):
+    conn = throttled_connection(ec2, retries=2)
+    throttling(ec2, 100)
+    with pytest.raises(BotoServerError):
+        conn.get_only_instances()
+    throttling(ec2, 100, status=400, code='Throttling')
+    with pytest.raises(EC2ResponseError):
+        conn.get_only_instances()
+    assert ec2.calls.count('DescribeInstances') == 6
+
+
+def test_no_retry_on_client_errors(ec2):
+    conn = throttled_connection(ec2)
+    with pytest.raises(EC2ResponseError):
+        conn.get_all_volumes()
+    assert ec2.calls == ['DescribeVolumes']
+    assert conn.instrumentation.snapshot()['DescribeVolumes']['retries'] == 0
+
+
+def test_concurrent_calls(ec2):
+    conn = throttled_connection(ec2)
+    throttling(ec2, 4)
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(len(conn.get_only_instances()))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [3] * 10
+    assert ec2.calls.count('DescribeInstances') == 14
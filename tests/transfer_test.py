@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from starwatts.transfer import TransferEngine, TransferStats, human_size
+
+
+def test_resume_offset():
+    assert TransferEngine.resume_offset(None, 100) == 0
+    assert TransferEngine.resume_offset(40, 100) == 40
+    assert TransferEngine.resume_offset(100, 100) == 100
+    assert TransferEngine.resume_offset(150, 100) == 0
+
+
+def test_transfer_stats():
+    stats = TransferStats()
+    stats.add(1024)
+    stats.add(1024)
+    stats.file_done()
+    stats.file_done(skipped=True)
+    stats.error('/tmp/missing', IOError('No such file'))
+    stats.stop()
+    assert stats.bytes == 2048
+    assert stats.files == 2
+    assert stats.skipped == 1
+    assert len(stats.errors) == 1
+    assert "2 file(s) (1 skipped, 1 failed), 2.0 KB" in str(stats)
+
+
+def test_human_size():
+    assert human_size(512) == "512.0 B"
+    assert human_size(3 * 1024 * 1024) == "3.0 MB"
+
+
+@pytest.fixture
+def hosts(tmpdir):
+    for name in ('local', 'node', 'other'):
+        tmpdir.mkdir(name)
+    data = os.urandom(10000)
+    tmpdir.join('local', 'data').write_binary(data)
+    tmpdir.join('other', 'data').write_binary(data)
+    return str(tmpdir), data
+
+
+def age(path, seconds=3600):
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime - seconds, stat.st_mtime - seconds))
+
+
+def test_put_resumes_a_prefix(hosts, sftp_engine):
+    root, data = hosts
+    with open(os.path.join(root, 'node', 'data'), 'wb') as f:
+        f.write(data[:4000])
+    stats = sftp_engine(os.path.join(root, 'node')).put(os.path.join(root, 'local', 'data'), '/data')
+    assert stats.bytes == 6000
+    with open(os.path.join(root, 'node', 'data'), 'rb') as f:
+        assert f.read() == data
+
+
+def test_put_rewrites_other_contents(hosts, sftp_engine):
+    root, data = hosts
+    engine = sftp_engine(os.path.join(root, 'node'))
+    # Same size, other contents : not complete
+    with open(os.path.join(root, 'node', 'data'), 'wb') as f:
+        f.write(data[:-1] + b'x' if data[-1:] != b'x' else data[:-1] + b'y')
+    stats = engine.put(os.path.join(root, 'local', 'data'), '/data')
+    assert (stats.skipped, stats.bytes) == (0, 10000)
+    # A valid prefix, older than the source
+    with open(os.path.join(root, 'node', 'data'), 'wb') as f:
+        f.write(data[:4000])
+    age(os.path.join(root, 'node', 'data'))
+    assert engine.put(os.path.join(root, 'local', 'data'), '/data').bytes == 10000
+    with open(os.path.join(root, 'node', 'data'), 'rb') as f:
+        assert f.read() == data
+    assert engine.put(os.path.join(root, 'local', 'data'), '/data').skipped == 1
+    assert engine.put(os.path.join(root, 'local', 'data'), '/data', resume=False).bytes == 10000
+
+
+def test_get(hosts, sftp_engine):
+    root, data = hosts
+    engine = sftp_engine(os.path.join(root, 'other'))
+    local_path = os.path.join(root, 'local', 'copy')
+    with open(local_path, 'wb') as f:
+        f.write(data[:5000])
+    assert engine.get('/data', local_path).bytes == 5000
+    with open(local_path, 'wb') as f:
+        f.write(b'\0' * 5000)
+    assert engine.get('/data', local_path).bytes == 10000
+    with open(local_path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_relay(hosts, sftp_engine):
+    root, data = hosts
+    source = sftp_engine(os.path.join(root, 'other'))
+    engine = sftp_engine(os.path.join(root, 'node'))
+    with open(os.path.join(root, 'node', 'data'), 'wb') as f:
+        f.write(data[:3000])
+    assert engine.relay(source, '/data', '/data').bytes == 7000
+    assert engine.relay(source, '/data', '/data').skipped == 1
+    with open(os.path.join(root, 'node', 'data'), 'r+b') as f:
+        f.seek(9500)
+        f.write(b'corrupted')
+    stats = engine.relay(source, '/data', '/data')
+    assert (stats.skipped, stats.bytes) == (0, 10000)
+    with open(os.path.join(root, 'node', 'data'), 'rb') as f:
+        assert f.read() == data
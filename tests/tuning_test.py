@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import paramiko
+import pytest
+
+from starwatts.tuning import PROFILES, apply_profile, connect_kwargs, get_profile
+
+
+class FakeTransport:
+    default_window_size = 2097152
+    default_max_packet_size = 32768
+
+    def __init__(self):
+        self.packetizer = paramiko.Packetizer(None)
+
+
+def test_get_profile():
+    assert get_profile('bulk') is PROFILES['bulk']
+    assert get_profile(PROFILES['wan']) is PROFILES['wan']
+    with pytest.raises(ValueError):
+        get_profile('fast')
+
+
+def test_connect_kwargs():
+    assert connect_kwargs('default') == {'compress': False}
+    assert connect_kwargs('wan') == {'compress': True}
+    kwargs = connect_kwargs('bulk')
+    assert kwargs['compress'] is False
+    if 'disabled_algorithms' in kwargs:
+        enabled = set(paramiko.Transport._preferred_ciphers) - set(kwargs['disabled_algorithms']['ciphers'])
+        assert enabled and enabled <= set(PROFILES['bulk'].ciphers)
+
+
+def test_apply_profile():
+    transport = apply_profile(FakeTransport(), 'default')
+    assert transport.default_window_size == 2097152
+    transport = apply_profile(FakeTransport(), 'bulk')
+    assert transport.default_window_size == PROFILES['bulk'].window_size
+    assert transport.default_max_packet_size == PROFILES['bulk'].max_packet_size
+    assert transport.packetizer.REKEY_BYTES == PROFILES['bulk'].rekey_bytes
@@ -1,29 +1,32 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
 import paramiko
 
+from starwatts.sshcache import new_client, ssh_config
 
-def paramiko_connect(host):
-    client = paramiko.SSHClient()
-    client._policy = paramiko.WarningPolicy()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
-    ssh_config = paramiko.SSHConfig()
+def paramiko_connect(host, username='root'):
+    client = new_client()
+
     user_config_file = os.path.expanduser("~/.ssh/config")
     try:
-        with open(user_config_file) as f:
-            ssh_config.parse(f)
+        conf = ssh_config(user_config_file)
     except FileNotFoundError:
         print("{} file could not be found. Aborting.".format(user_config_file))
         sys.exit(1)
-    cfg = {'hostname': options['hostname'], 'username': options["username"]}
+    cfg = {'hostname': host, 'username': username}
 
-    user_config = ssh_config.lookup(cfg['hostname'])
-    for k in ('hostname', 'username', 'port'):
-        if k in user_config:
-            cfg[k] = user_config[k]
+    user_config = conf.lookup(cfg['hostname'])
+    if 'hostname' in user_config:
+        cfg['hostname'] = user_config['hostname']
+    if 'user' in user_config:
+        cfg['username'] = user_config['user']
+    if 'port' in user_config:
+        cfg['port'] = int(user_config['port'])
 
     if 'proxycommand' in user_config:
         cfg['sock'] = paramiko.ProxyCommand(user_config['proxycommand'])
 
-    return client.connect(**cfg)
+    client.connect(**cfg)
+    return client